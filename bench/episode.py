@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+""" Memory and throughput benchmark for Episode.
+
+    Compares mpp.episode.Episode with LegacyEpisode, a copy of the earlier
+    implementation which stored fields in a __dict__ and found them with 
+    dir() for each to_dict() call.
+
+    Run from the root of the tree:
+
+        PYTHONPATH=lib python3 bench/episode.py [--count n]
+"""
+
+import argparse
+import json
+import time
+import tracemalloc
+import types
+from mpp.episode import Episode
+
+class LegacyEpisode():
+    def __init__(self, title, media_url, published, media_path=None, skipped=False, published_ts=None):
+        l = locals()
+        for v in [x for x in l.keys() if x != 'self']:
+            setattr(self, v, l[v])
+
+    def get_fields(self):
+        return [x for x in dir(self) if x[0] != '_' and type(getattr(self, x)) != types.MethodType]
+
+    def to_dict(self):
+        return {x: getattr(self, x) for x in self.get_fields()}
+
+def make_episodes(cls, count):
+    return [cls('Episode number %d' % i, 
+                'http://localhost/media/episode-%d.mp3' % i,
+                'Fri, 20 Jun 2008 07:00:00 GMT',
+                None,
+                False,
+                1213945200 + i) for i in range(count)]
+
+def measure(cls, count):
+    tracemalloc.start()
+    start = time.perf_counter()
+    episodes = make_episodes(cls, count)
+    created = time.perf_counter() - start
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    start = time.perf_counter()
+    data = json.dumps([e.to_dict() for e in episodes])
+    serialised = time.perf_counter() - start
+    print('%-14s %8.1f bytes/episode  create %6.3fs  to_dict+json %6.3fs' % (
+            cls.__name__, memory / count, created, serialised))
+    return memory, serialised
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark Episode memory use and serialisation')
+    parser.add_argument('--count', type=int, default=100000, help='Number of episodes (default=100000)')
+    args = parser.parse_args()
+    legacy_memory, legacy_time = measure(LegacyEpisode, args.count)
+    memory, serialised = measure(Episode, args.count)
+    print('memory: %.1fx smaller, serialisation: %.1fx faster' % (
+            legacy_memory / memory, legacy_time / serialised))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+""" Benchmark for loading a large library with different numbers of worker
+    processes.
+
+    A library of --podcasts synthetic podcasts with --episodes episodes each
+    is generated in a temporary directory, and for each number of workers
+    from 1 up to the number of cores (doubling each time), these are timed:
+
+        reindex     building the index of every feed file, with no index
+        podcasts    loading every podcast, as update and fetch do
+
+    The best of --repeat runs and the speed-up over one worker are printed.
+
+    Run from the root of the tree:
+
+        PYTHONPATH=lib python3 bench/load.py [--podcasts n] [--episodes n] [--workers n,n,...]
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from mpp.library import Library
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from suite import make_podcast
+
+def best_time(fn, setup, repeat):
+    times = []
+    for i in range(repeat):
+        setup()
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def main():
+    cores = os.cpu_count() or 1
+    default_workers = []
+    n = 1
+    while n < cores:
+        default_workers.append(n)
+        n *= 2
+    default_workers.append(cores)
+    parser = argparse.ArgumentParser(description='Benchmark loading a large library with worker processes')
+    parser.add_argument('--podcasts', type=int, default=1000, help='Number of podcasts in the library (default=1000)')
+    parser.add_argument('--episodes', type=int, default=500, help='Number of episodes per podcast (default=500)')
+    parser.add_argument('--workers', default=','.join([str(x) for x in default_workers]),
+                        help='Comma separated numbers of workers to try (default=%s)' % ','.join([str(x) for x in default_workers]))
+    parser.add_argument('--repeat', type=int, default=3, help='Number of runs of each benchmark (default=3)')
+    args = parser.parse_args()
+
+    feed_dir = tempfile.mkdtemp(prefix='mpp-load-')
+    try:
+        library = Library(feed_dir)
+        for i in range(args.podcasts):
+            p = make_podcast('http://127.0.0.1', i, args.episodes)
+            library.add(p, os.path.join(feed_dir, '%s.json' % p.url_hash()))
+        library.write_index()
+        index_path = library.index_path
+        with open(index_path, 'rb') as f:
+            index = f.read()
+        def remove_index():
+            if os.path.exists(index_path):
+                os.unlink(index_path)
+        def restore_index():
+            with open(index_path, 'wb') as f:
+                f.write(index)
+
+        print('%d podcasts x %d episodes, %d cores, %d runs each' % (args.podcasts, args.episodes, cores, args.repeat))
+        base = dict()
+        for workers in [int(x) for x in args.workers.split(',')]:
+            reindex = best_time(lambda: Library(feed_dir, workers), remove_index, args.repeat)
+            podcasts = best_time(lambda: Library(feed_dir, workers).podcasts(), restore_index, args.repeat)
+            base.setdefault('reindex', reindex)
+            base.setdefault('podcasts', podcasts)
+            print('%2d workers  reindex %7.3fs (%4.1fx)  podcasts %7.3fs (%4.1fx)' % (
+                    workers, reindex, base['reindex'] / reindex, podcasts, base['podcasts'] / podcasts))
+    finally:
+        shutil.rmtree(feed_dir)
+
+if __name__ == '__main__':
+    main()
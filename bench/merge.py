@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+""" Benchmark for Podcast.update_from_podcast. 
+
+    The episodes from tests/feed.xml are repeated to make a large feed, and
+    an updated copy with some new episodes is merged into it, both with the
+    episode index and with the old linear scan ("episode not in episodes").
+
+    Run from the root of the tree:
+
+        PYTHONPATH=lib python3 bench/merge.py [--scale n] [--new n] [--moved]
+"""
+
+import argparse
+import copy
+import os
+import time
+from mpp.podcast import Podcast
+
+def scaled_podcast(path, scale):
+    feed = Podcast.from_file_feed(path)
+    p = Podcast(feed.url, feed.title)
+    for i in range(scale):
+        for e in feed.episodes:
+            e = copy.copy(e)
+            e.title = '%s [%d]' % (e.title, i)
+            e.media_url = '%s?copy=%d' % (e.media_url, i)
+            p.episodes.append(e)
+    return p
+
+def linear_merge(podcast, other):
+    new_count = 0
+    for episode in other.episodes:
+        if episode not in podcast.episodes:
+            podcast.episodes.append(episode)
+            new_count += 1
+    return new_count
+
+def timed(label, fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    elapsed = time.perf_counter() - start
+    print('%-20s %8.3fs  (%d new)' % (label, elapsed, result))
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark Podcast.update_from_podcast')
+    parser.add_argument('--scale', type=int, default=20, help='Number of copies of tests/feed.xml episodes (default=20)')
+    parser.add_argument('--new', type=int, default=50, help='Number of new episodes in the update (default=50)')
+    parser.add_argument('--moved', action='store_true', help='Change all media URLs in the update, so episodes must be matched on title and date')
+    args = parser.parse_args()
+    feed_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tests', 'feed.xml')
+    existing = scaled_podcast(feed_file, args.scale)
+    # feeds are usually newest first, where as Podcast.episodes is sorted
+    # oldest first
+    update = copy.deepcopy(existing)
+    update.episodes.reverse()
+    for e in update.episodes[:args.new]:
+        e.title = e.title + ' (new)'
+        e.media_url = e.media_url + '&new=1'
+    if args.moved:
+        for e in update.episodes:
+            e.media_url = e.media_url.replace('http://', 'http://moved.')
+    print('merging %d episodes into %d' % (len(update.episodes), len(existing.episodes)))
+    linear = timed('linear scan', linear_merge, copy.deepcopy(existing), update)
+    indexed = timed('index', copy.deepcopy(existing).update_from_podcast, update)
+    print('speed-up: %.1fx' % (linear / indexed))
+
+if __name__ == '__main__':
+    main()
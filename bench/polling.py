@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+""" Simulation of the polling schedule.
+
+    A library of --podcasts synthetic podcasts is made, publishing hourly,
+    daily, weekly, monthly or not at all (in proportions like those of a
+    typical subscription list), and update --due is simulated once every
+    --every minutes for --days days. The number of polls is printed for
+    each kind of feed, against polling every feed on every run, along with
+    the mean delay between an episode being published and the poll which
+    finds it.
+
+    Run from the root of the tree:
+
+        PYTHONPATH=lib python3 bench/polling.py [--podcasts n] [--days n] [--every minutes]
+"""
+
+import argparse
+import random
+import time
+from mpp.episode import Episode
+from mpp.podcast import Podcast
+from mpp.polling import next_due, is_due
+
+HOUR = 3600
+DAY = 24 * HOUR
+
+# (name, seconds between episodes, share of podcasts)
+KINDS = [('hourly', HOUR, 0.02), ('daily', DAY, 0.18), ('weekly', 7 * DAY, 0.5),
+         ('monthly', 30 * DAY, 0.2), ('dormant', None, 0.1)]
+
+class Feed():
+    def __init__(self, kind, period, start):
+        self.kind = kind
+        self.period = period
+        self.podcast = Podcast('http://localhost/%s/%d.xml' % (kind, random.randrange(1 << 30)), kind)
+        # episodes before the simulation; dormant feeds stopped a year ago
+        last = start - random.uniform(0, period) if period else start - 365 * DAY
+        step = period or 7 * DAY
+        self.published = [last - i * step for i in range(20)][::-1]
+        self.next = last + period if period else None
+        self.found = 0
+        self.poll(start)
+        self.podcast.checked = None
+
+    def publish(self, now):
+        while self.next is not None and self.next <= now:
+            self.published.append(self.next)
+            self.next += self.period * random.uniform(0.8, 1.2)
+
+    def poll(self, now):
+        """ Returns the delays before finding the episodes which are new """
+        delays = [now - t for t in self.published[self.found:]]
+        for t in self.published[self.found:]:
+            self.podcast.episodes.append(Episode('Episode', 'http://localhost/%f.mp3' % t, str(t), published_ts=t))
+        self.found = len(self.published)
+        self.podcast.checked = now
+        return delays
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--podcasts', type=int, default=300)
+    parser.add_argument('--days', type=int, default=28)
+    parser.add_argument('--every', type=int, default=60, help='minutes between runs')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    random.seed(args.seed)
+    start = time.time()
+    feeds = []
+    for kind, period, share in KINDS:
+        feeds += [Feed(kind, period, start) for i in range(round(args.podcasts * share))]
+    runs = args.days * DAY // (args.every * 60)
+    polls = dict((kind, 0) for kind, p, s in KINDS)
+    delays = dict((kind, []) for kind, p, s in KINDS)
+    t0 = time.perf_counter()
+    for run in range(runs):
+        now = start + run * args.every * 60
+        for f in feeds:
+            f.publish(now)
+            if is_due(next_due(f.podcast), now):
+                polls[f.kind] += 1
+                delays[f.kind] += f.poll(now)
+    elapsed = time.perf_counter() - t0
+    print('%d podcasts, a run every %d minutes for %d days (%d runs)' % (len(feeds), args.every, args.days, runs))
+    print('%-10s %8s %10s %8s %12s' % ('kind', 'podcasts', 'polls', 'of all', 'mean delay'))
+    for kind, p, s in KINDS:
+        n = len([f for f in feeds if f.kind == kind])
+        d = delays[kind]
+        print('%-10s %8d %10d %7.1f%% %11s' % (kind, n, polls[kind], 100.0 * polls[kind] / max(n * runs, 1),
+                                              '%.1fh' % (sum(d) / len(d) / HOUR) if d else '-'))
+    total = sum(polls.values())
+    print('%-10s %8d %10d %7.1f%%' % ('total', len(feeds), total, 100.0 * total / (len(feeds) * runs)))
+    print('scheduling took %.0fms per run' % (1000 * elapsed / runs))
+
+if __name__ == '__main__':
+    main()
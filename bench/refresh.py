@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+""" Benchmark for refreshing a large feed which has a few new items.
+
+    The items in tests/feed.xml are repeated to make a large feed, and a
+    podcast which already has all but the newest few episodes is updated 
+    from it, using the full feedparser parse and the incremental parser.
+
+    Run from the root of the tree:
+
+        PYTHONPATH=lib python3 bench/refresh.py [--scale n] [--new n]
+"""
+
+import argparse
+import copy
+import os
+import re
+import time
+import tracemalloc
+from mpp.podcast import Podcast, parse_feed
+
+def scaled_feed(path, scale):
+    """ Returns feed data with the items repeated scale times. Each copy 
+        has different media URLs and is dated a year earlier than the last.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    start = data.index(b'<item>')
+    end = data.rindex(b'</item>') + len(b'</item>')
+    items = data[start:end]
+    copies = []
+    for i in range(scale):
+        c = re.sub(rb'\.mp3', b'.mp3?copy=%d' % i, items)
+        c = re.sub(rb'(<pubDate>[^<]* )(\d{4})', lambda m: m.group(1) + str(int(m.group(2)) - i).encode(), c)
+        copies.append(c)
+    return data[:start] + b''.join(copies) + data[end:]
+
+def timed(label, fn, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn(*args)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print('%-14s %8.3fs  peak %6.1f MB  (%d new)' % (label, elapsed, peak / 1024 / 1024, result))
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark refreshing a large feed')
+    parser.add_argument('--scale', type=int, default=10, help='Number of copies of tests/feed.xml items (default=10)')
+    parser.add_argument('--new', type=int, default=2, help='Number of new items at the start of the feed (default=2)')
+    args = parser.parse_args()
+    feed_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tests', 'feed.xml')
+    data = scaled_feed(feed_file, args.scale)
+    full = parse_feed(data, 'http://localhost/feed.xml')
+    existing = Podcast(full.url, full.title)
+    for e in sorted(full.episodes)[:-args.new]:
+        existing.add_episode(copy.copy(e))
+    print('refreshing a %.1f MB feed of %d items, %d new' % (len(data) / 1024 / 1024, len(full.episodes), args.new))
+    full_parse = lambda: copy.deepcopy(existing).update_from_podcast(parse_feed(data, existing.url))
+    incremental = lambda: copy.deepcopy(existing).update_from_data(data)
+    full_time = timed('feedparser', full_parse)
+    incremental_time = timed('incremental', incremental)
+    print('speed-up: %.1fx' % (full_time / incremental_time))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+""" Benchmark for the start-up time of read-only commands.
+
+    A library of --podcasts synthetic podcasts is generated in a temporary
+    directory, and mpp is run in a new process for each command, which is
+    how shell scripts and player hooks call it. The best time of --repeat
+    runs of each command is printed, along with its time over that of
+    starting the interpreter alone, and the exit status is 1 if that is
+    over the --budget in milliseconds for any command.
+
+    With --daemon, mpp daemon is started for the library, and the commands,
+    and a couple which load feeds, are answered by it.
+
+    Run from the root of the tree:
+
+        PYTHONPATH=lib python3 bench/startup.py [--podcasts n] [--episodes n] [--budget ms] [--daemon]
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import mpp.config
+import mpp.daemon
+from mpp.manager import PodcastManager
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from suite import make_podcast
+
+COMMANDS = [['ls'], ['ls', '--path'], ['ep', '--path']]
+
+# commands which load feeds, unless a daemon has them in memory
+DAEMON_COMMANDS = [['ep', '*', 'xyzzy'], ['ep', '--url', '--last', '1']]
+
+def best_time(argv, env, repeat):
+    """ Returns the best time of repeat runs of argv in ms """
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(argv, env=env, stdout=subprocess.DEVNULL, check=True)
+        times.append((time.perf_counter() - start) * 1000)
+    return min(times)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the start-up time of read-only mpp commands')
+    parser.add_argument('--podcasts', type=int, default=300, help='Number of podcasts in the library (default=300)')
+    parser.add_argument('--episodes', type=int, default=200, help='Number of episodes per podcast (default=200)')
+    parser.add_argument('--storage', choices=['files', 'sqlite'], default='files', help='Library storage (default=files)')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of runs of each command (default=5)')
+    parser.add_argument('--budget', type=float, default=100, help='Time allowed for each command in ms (default=100)')
+    parser.add_argument('--daemon', action='store_true', help='Run the commands in mpp daemon')
+    args = parser.parse_args()
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    dir = tempfile.mkdtemp(prefix='mpp-startup-')
+    daemon = None
+    try:
+        config = {'feed_dir': os.path.join(dir, 'feeds'), 'audio_directory': os.path.join(dir, 'audio'), 'storage': args.storage}
+        for d in [config['feed_dir'], config['audio_directory']]:
+            os.makedirs(d)
+        mpp.config.config = config
+        manager = PodcastManager(config)
+        for i in range(args.podcasts):
+            p = make_podcast('http://127.0.0.1', i, args.episodes)
+            manager.library.add(p, manager.get_podcast_path(p))
+        manager.library.write_index()
+        config_path = os.path.join(dir, 'config')
+        with open(config_path, 'w') as f:
+            f.write(''.join(['%s=%s\n' % x for x in config.items()]))
+
+        env = dict(os.environ, PYTHONPATH=os.path.join(root, 'lib'))
+        commands = COMMANDS
+        if args.daemon:
+            daemon = subprocess.Popen([sys.executable, os.path.join(root, 'mpp'), '-c', config_path, 'daemon', '--no-download', '--interval', '86400'],
+                                      env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            while not mpp.daemon.listening(mpp.daemon.socket_path(config)):
+                time.sleep(0.1)
+            commands = COMMANDS + DAEMON_COMMANDS
+        print('%d podcasts x %d episodes, %s storage, budget %dms%s' % (args.podcasts, args.episodes, args.storage, args.budget,
+                                                                        ', with mpp daemon' if args.daemon else ''))
+        python = best_time([sys.executable, '-c', 'pass'], env, args.repeat)
+        print('%-12s best %6.1fms' % ('python', python))
+        over = False
+        for command in commands:
+            best = best_time([sys.executable, os.path.join(root, 'mpp'), '-c', config_path] + command, env, args.repeat)
+            flag = ''
+            if best - python > args.budget:
+                over = True
+                flag = '  OVER BUDGET'
+            print('%-12s best %6.1fms  +%6.1fms%s' % (' '.join(command), best, best - python, flag))
+    finally:
+        if daemon is not None:
+            daemon.terminate()
+            daemon.wait()
+        shutil.rmtree(dir)
+    if over:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+""" Benchmark suite for mpp, using synthetic libraries and feeds.
+
+    A library of --podcasts podcasts with --episodes episodes each is
+    generated in a temporary directory, along with RSS feeds for them which
+    are served by a local HTTP server, and these operations are timed:
+
+        load_podcasts       loading the library, without and with the index
+        list_podcasts       mpp list
+        list_episodes       mpp ep for all podcasts
+        update_from_podcast merging a large feed into a podcast
+        save_to_file        saving a large podcast
+        update              mpp update against the local server
+        download            mpp download against the local server
+
+    Each is run --repeat times, and the best and median times are printed
+    and saved as JSON with --output. Results from an earlier run can be
+    compared with --compare, which exits with status 1 if any benchmark
+    has become slower by more than --threshold.
+
+    Run from the root of the tree:
+
+        PYTHONPATH=lib python3 bench/suite.py [--podcasts n] [--episodes n] [--output results.json] [--compare old.json]
+"""
+
+import argparse
+import contextlib
+import copy
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import mpp.config
+from mpp.episode import Episode
+from mpp.manager import PodcastManager
+from mpp.podcast import Podcast
+
+START_TS = 1500000000
+DAY = 24*60*60
+
+def episode_url(base, podcast, episode):
+    return '%s/media/%d/%d.mp3' % (base, podcast, episode)
+
+def make_podcast(base, i, episodes, new=0):
+    """ A podcast with its feed's episodes, apart from the newest new ones.
+        The episodes are all skipped.
+    """
+    p = Podcast('%s/feed/%d.xml' % (base, i), 'Podcast %d' % i)
+    for j in range(episodes - new):
+        ts = START_TS + j*DAY
+        published = time.strftime('%a, %d %b %Y %H:%M:%S GMT', time.gmtime(ts))
+        p.episodes.append(Episode('Podcast %d episode %d' % (i, j), episode_url(base, i, j), published, skipped=True, published_ts=ts))
+    return p
+
+def make_feed(base, i, episodes):
+    """ RSS for podcast i, newest item first """
+    items = []
+    for j in reversed(range(episodes)):
+        published = time.strftime('%a, %d %b %Y %H:%M:%S GMT', time.gmtime(START_TS + j*DAY))
+        items.append('<item><title>Podcast %d episode %d</title><pubDate>%s</pubDate>'
+                     '<enclosure url="%s" type="audio/mpeg"/></item>' % (i, j, published, episode_url(base, i, j)))
+    return ('<?xml version="1.0"?><rss version="2.0"><channel><title>Podcast %d</title><link>%s</link>%s</channel></rss>' % (
+                i, base, '\n'.join(items))).encode('utf-8')
+
+class Server():
+    """ A local HTTP server for feeds and media files """
+    def __init__(self, episodes, media_size):
+        self.feeds = dict()
+        self.episodes = episodes
+        self.media = b'\0' * media_size
+        server = self
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            def do_GET(self):
+                parts = self.path.split('/')
+                if parts[1] == 'feed':
+                    i = int(parts[2].split('.')[0])
+                    if i not in server.feeds:
+                        server.feeds[i] = make_feed(server.base, i, server.episodes)
+                    body = server.feeds[i]
+                else:
+                    body = server.media
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            def log_message(self, *args):
+                pass
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.base = 'http://127.0.0.1:%d' % self.httpd.server_address[1]
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.httpd.shutdown()
+
+def make_args(**kwargs):
+    d = {'pfilter': None, 'efilter': None, 'verbose': False, 'url': None, 'path': None,
+         'status': ['any'], 'since': None, 'first': None, 'last': None, 'full': False,
+         'parallel': 4, 'connections': 32, 'per_host': 8, 'max': None, 'order': 'newest',
+         'rate': None, 'progress': 'none'}
+    d.update(kwargs)
+    return argparse.Namespace(**d)
+
+class Suite():
+    def __init__(self, args):
+        self.args = args
+        self.dir = tempfile.mkdtemp(prefix='mpp-bench-')
+        self.feed_dir = os.path.join(self.dir, 'feeds')
+        self.audio_dir = os.path.join(self.dir, 'audio')
+        self.config = {'feed_dir': self.feed_dir, 'audio_directory': self.audio_dir,
+                       'storage': args.storage, 'feed_format': args.feed_format}
+        mpp.config.config = self.config
+        self.server = Server(args.episodes, args.media_kb * 1024)
+        self.results = dict()
+
+    def close(self):
+        self.server.stop()
+        shutil.rmtree(self.dir)
+
+    def make_library(self, new=0):
+        for d in [self.feed_dir, self.audio_dir]:
+            shutil.rmtree(d, ignore_errors=True)
+            os.makedirs(d)
+        manager = PodcastManager(self.config)
+        for i in range(self.args.podcasts):
+            p = make_podcast(self.server.base, i, self.args.episodes, new)
+            manager.library.add(p, manager.get_podcast_path(p))
+        manager.library.write_index()
+
+    def run(self, name, fn, setup=None):
+        times = []
+        for i in range(self.args.repeat):
+            state = setup() if setup else None
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                fn(state)
+                times.append(time.perf_counter() - start)
+        self.results[name] = {'best': min(times), 'median': statistics.median(times), 'runs': times}
+        print('%-22s best %8.3fs  median %8.3fs' % (name, min(times), statistics.median(times)))
+
+    def run_all(self):
+        a = self.args
+        print('%d podcasts x %d episodes, %s storage, %d runs each' % (a.podcasts, a.episodes, a.storage, a.repeat))
+        self.make_library()
+        def remove_index():
+            if os.path.exists(os.path.join(self.feed_dir, '.index.json')):
+                os.unlink(os.path.join(self.feed_dir, '.index.json'))
+        if a.storage == 'files':
+            self.run('load_podcasts_cold', lambda s: PodcastManager(self.config).library.podcasts(), setup=remove_index)
+        self.run('load_podcasts', lambda s: PodcastManager(self.config).library.podcasts())
+        self.run('list_podcasts', lambda s: PodcastManager(self.config).exec(make_args(cmd='list_podcasts')))
+        self.run('list_episodes', lambda s: PodcastManager(self.config).exec(make_args(cmd='list_episodes')))
+
+        big = make_podcast(self.server.base, 0, a.feed_items, new=a.new)
+        update = make_podcast(self.server.base, 0, a.feed_items)
+        self.run('update_from_podcast', lambda s: s.update_from_podcast(update), setup=lambda: copy.deepcopy(big))
+        path = os.path.join(self.dir, 'big%s' % ('.mpk' if a.feed_format == 'msgpack' else '.json'))
+        self.run('save_to_file', lambda s: big.save_to_file(path))
+
+        self.run('update', lambda s: PodcastManager(self.config).exec(make_args(cmd='update_podcasts')),
+                 setup=lambda: self.make_library(new=a.new))
+        self.run('download', lambda s: PodcastManager(self.config).exec(make_args(cmd='download_podcasts', max=a.new)),
+                 setup=self.make_download_library)
+
+    def make_download_library(self):
+        """ a library with the newest --new episodes of each podcast new """
+        self.make_library()
+        manager = PodcastManager(self.config)
+        for p in manager.library.podcasts():
+            for e in p.episodes[-self.args.new:]:
+                e.skipped = False
+            manager.library.save(p)
+        manager.library.write_index()
+
+    def save(self, path):
+        try:
+            revision = subprocess.check_output(['git', 'describe', '--always', '--dirty'], stderr=subprocess.DEVNULL).decode().strip()
+        except Exception:
+            revision = None
+        with open(path, 'w') as f:
+            json.dump({'revision': revision, 'time': time.time(), 'python': platform.python_version(),
+                       'params': {k: v for k, v in vars(self.args).items() if k not in ('output', 'compare', 'threshold')},
+                       'results': self.results}, f, indent=4)
+
+def compare(results, path, threshold):
+    """ Print the change in best time of each benchmark since the results in
+        path. Returns the names of benchmarks which are slower by more than
+        threshold.
+    """
+    with open(path) as f:
+        old = json.load(f)
+    print('compared with %s (revision %s):' % (path, old.get('revision')))
+    slower = []
+    for name, r in results.items():
+        if name not in old['results']:
+            continue
+        ratio = r['best'] / old['results'][name]['best']
+        flag = ''
+        if ratio > threshold:
+            slower.append(name)
+            flag = '  SLOWER'
+        print('%-22s %8.3fs -> %8.3fs  %5.2fx%s' % (name, old['results'][name]['best'], r['best'], ratio, flag))
+    return slower
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark mpp with synthetic libraries and feeds')
+    parser.add_argument('--podcasts', type=int, default=50, help='Number of podcasts in the library (default=50)')
+    parser.add_argument('--episodes', type=int, default=500, help='Number of episodes per podcast (default=500)')
+    parser.add_argument('--feed-items', type=int, default=5000, help='Number of episodes in the large podcast (default=5000)')
+    parser.add_argument('--new', type=int, default=2, help='Number of new episodes per podcast for update and download (default=2)')
+    parser.add_argument('--media-kb', type=int, default=256, help='Size of each media file in kB (default=256)')
+    parser.add_argument('--storage', choices=['files', 'sqlite'], default='files', help='Library storage (default=files)')
+    parser.add_argument('--feed-format', choices=['json', 'msgpack'], default='json', help='Feed file format (default=json)')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of runs of each benchmark (default=3)')
+    parser.add_argument('--output', help='Save the results as JSON to this path')
+    parser.add_argument('--compare', help='Compare with results saved by an earlier run')
+    parser.add_argument('--threshold', type=float, default=1.25, help='Ratio of best times counted as a regression (default=1.25)')
+    args = parser.parse_args()
+    suite = Suite(args)
+    try:
+        suite.run_all()
+    finally:
+        suite.close()
+    if args.output:
+        suite.save(args.output)
+    if args.compare and compare(suite.results, args.compare, args.threshold):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,286 @@
+import json
+import logging
+import os
+import socket
+import sys
+import threading
+from mpp.logger import log
+
+# mpp daemon keeps the podcasts in memory, updating and downloading them on a
+# schedule, and runs these commands for the mpp script, which sends them to
+# it over a Unix socket if it is running. A request is a line of JSON with
+# the command's arguments, and the daemon answers with lines of JSON holding
+# the command's output ({"out": text} and {"err": text}) and finally its exit
+# status ({"exit": status}).
+#
+# Commands which change the library run one at a time. Reads run in the
+# thread of their connection, and don't wait for a change which is being
+# made, as long as the library supports that.
+
+READ_COMMANDS = ('list_podcasts', 'show_podcast', 'list_episodes')
+WRITE_COMMANDS = ('catchup_podcast', 'renew_episodes', 'update_podcasts', 'download_podcasts', 'fetch_podcasts')
+COMMANDS = READ_COMMANDS + WRITE_COMMANDS
+
+# the default seconds between scheduled updates of the feeds which are due
+INTERVAL = 900
+
+def socket_path(config):
+    return config.get('daemon_socket', os.path.join(config['feed_dir'], '.mpp.sock'))
+
+def call(path, args, out=None, err=None):
+    """ Run a command in the daemon listening at path, copying its output to
+        out and err (default stdout and stderr). Returns the command's exit
+        status, or None if no daemon is running.
+    """
+    out = out or sys.stdout
+    err = err or sys.stderr
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(path)
+    except (FileNotFoundError, ConnectionRefusedError) as e:
+        log.debug('daemon.call() no daemon at %s: %s' % (path, e))
+        s.close()
+        return None
+    with s, s.makefile('rwb') as f:
+        request = {'args': {k: v for k, v in vars(args).items() if k != 'func'},
+                   'tty': out.isatty(),
+                   'level': log.getEffectiveLevel()}
+        f.write(json.dumps(request).encode('utf-8') + b'\n')
+        f.flush()
+        for line in f:
+            msg = json.loads(line.decode('utf-8'))
+            if 'out' in msg:
+                out.write(msg['out'])
+                out.flush()
+            elif 'err' in msg:
+                err.write(msg['err'])
+                err.flush()
+            elif 'exit' in msg:
+                return msg['exit']
+    log.error('the daemon at %s closed the connection' % path)
+    return 1
+
+class Client():
+    """ The output of a command run for a connection. Output is buffered
+        until a line is complete, or for reads, until the command has
+        finished. If the client goes away, the command carries on without
+        it.
+    """
+    def __init__(self, f, tty=False, level=logging.INFO, line_buffered=False):
+        self.f = f
+        self.tty = tty
+        self.level = level
+        self.line_buffered = line_buffered
+        self.gone = False
+        self.lock = threading.Lock()
+
+    def send(self, msg):
+        with self.lock:
+            if self.gone:
+                return
+            try:
+                self.f.write(json.dumps(msg).encode('utf-8') + b'\n')
+                if self.line_buffered or 'exit' in msg:
+                    self.f.flush()
+            except OSError as e:
+                log.debug('Client.send() client has gone: %s' % e)
+                self.gone = True
+
+    def isatty(self):
+        return self.tty
+
+# the client of the command run by each thread
+_local = threading.local()
+
+class Output():
+    """ Stands in for sys.stdout or sys.stderr, sending what is written to
+        the client of the command running in the thread. Threads started by a
+        command which changes the library (like the progress reporter) write
+        to the client of that command.
+    """
+    def __init__(self, daemon, stream, key):
+        self.daemon = daemon
+        self.stream = stream
+        self.key = key
+
+    def client(self):
+        return getattr(_local, 'client', None) or self.daemon.owner
+
+    def write(self, text):
+        c = self.client()
+        if c is None:
+            return self.stream.write(text)
+        c.send({self.key: text})
+        return len(text)
+
+    def flush(self):
+        if self.client() is None:
+            self.stream.flush()
+
+    def isatty(self):
+        c = self.client()
+        return self.stream.isatty() if c is None else c.isatty()
+
+    def fileno(self):
+        return self.stream.fileno()
+
+class ClientLogHandler(logging.Handler):
+    """ Sends log messages about a client's command to the client, at the
+        level it asked for
+    """
+    def __init__(self, daemon, formatter=None):
+        super().__init__()
+        self.daemon = daemon
+        if formatter is not None:
+            self.setFormatter(formatter)
+
+    def emit(self, record):
+        c = getattr(_local, 'client', None) or self.daemon.owner
+        if c is not None and record.levelno >= c.level:
+            c.send({'err': self.format(record) + '\n'})
+
+class Daemon():
+    """ Runs commands for clients connecting to a Unix socket at path, with
+        a PodcastManager whose podcasts stay loaded, and runs update --due (or
+        fetch --due, if download is True) every interval seconds with the
+        options in args.
+    """
+    def __init__(self, manager, path, args, interval=INTERVAL, download=True):
+        self.manager = manager
+        self.path = path
+        self.args = args
+        self.interval = interval
+        self.download = download
+        self.lock = threading.Lock()
+        # the client of the command which holds the lock
+        self.owner = None
+        self.stopping = threading.Event()
+
+    def listen(self):
+        """ Returns a server for the socket, which handles each connection in
+            a thread
+        """
+        import socketserver
+        if listening(self.path):
+            raise Exception('a daemon is already listening on %s' % self.path)
+        if os.path.lexists(self.path):
+            os.unlink(self.path)
+        daemon = self
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                daemon.handle(self.rfile, self.wfile)
+        class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+            daemon_threads = True
+        # only the user can connect
+        umask = os.umask(0o177)
+        try:
+            server = Server(self.path, Handler)
+        finally:
+            os.umask(umask)
+        return server
+
+    def serve(self):
+        import signal
+        server = self.listen()
+        log.info('daemon listening on %s' % self.path)
+        formatter = log.handlers[0].formatter if log.handlers else None
+        log.addHandler(ClientLogHandler(self, formatter))
+        sys.stdout = Output(self, sys.stdout, 'out')
+        sys.stderr = Output(self, sys.stderr, 'err')
+        pid = os.getpid()
+        def terminate(signum, frame):
+            if os.getpid() != pid:
+                # a worker process of a command, which would otherwise raise
+                # SystemExit in the middle of its work
+                os._exit(128 + signum)
+            sys.exit(0)
+        signal.signal(signal.SIGTERM, terminate)
+        # load every podcast now, rather than for the first command
+        self.manager.library.podcasts()
+        scheduler = threading.Thread(target=self._schedule, name='schedule', daemon=True)
+        scheduler.start()
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            log.info('daemon shutting down')
+            self.stopping.set()
+            server.server_close()
+            if os.path.lexists(self.path):
+                os.unlink(self.path)
+            sys.stdout = sys.stdout.stream
+            sys.stderr = sys.stderr.stream
+
+    def handle(self, rfile, wfile):
+        import argparse
+        try:
+            request = json.loads(rfile.readline().decode('utf-8'))
+            args = argparse.Namespace(**request['args'])
+        except Exception as e:
+            log.warning('Daemon.handle() bad request: %s' % e)
+            return
+        client = Client(wfile, request.get('tty', False), request.get('level', logging.INFO), args.cmd in WRITE_COMMANDS)
+        status = self.run(args, client)
+        client.send({'exit': status})
+
+    def run(self, args, client=None):
+        """ Run a command for a client, returning its exit status """
+        log.debug('Daemon.run(%s)' % args.cmd)
+        if args.cmd not in COMMANDS:
+            log.error('the daemon does not run %s' % args.cmd)
+            return 1
+        from mpp.query import QueryError
+        from mpp.util import forget_media
+        _local.client = client
+        try:
+            concurrent = args.cmd in READ_COMMANDS and self.manager.library.concurrent_reads
+            if concurrent and not self.lock.acquire(blocking=False):
+                # the library is being changed in memory, so it is up to date
+                forget_media()
+                getattr(self.manager, args.cmd)(args)
+                return 0
+            if not concurrent:
+                self.lock.acquire()
+            try:
+                self.owner = client
+                self.manager.library.revalidate()
+                self.manager.exec(args)
+            finally:
+                self.owner = None
+                self.lock.release()
+            return 0
+        except SystemExit as e:
+            return e.code if isinstance(e.code, int) else 1
+        except QueryError as e:
+            log.error('%s' % e)
+            return 1
+        except Exception as e:
+            log.exception('Daemon.run() %s failed: %s' % (args.cmd, e))
+            return 1
+        finally:
+            _local.client = None
+
+    def _schedule(self):
+        while not self.stopping.is_set():
+            self.run(self.scheduled_args())
+            self.stopping.wait(self.interval)
+
+    def scheduled_args(self):
+        import argparse
+        a = self.args
+        return argparse.Namespace(cmd='fetch_podcasts' if self.download else 'update_podcasts',
+                                  pfilter=None, efilter=None, verbose=a.verbose, due=True,
+                                  parallel=a.parallel, connections=a.connections, per_host=a.per_host,
+                                  max=None, order='newest', progress='none', rate=a.rate)
+
+def listening(path):
+    """ True if a daemon is listening at path """
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(path)
+        return True
+    except OSError:
+        return False
+    finally:
+        s.close()
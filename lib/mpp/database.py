@@ -0,0 +1,277 @@
+import json
+import logging
+import sqlite3
+from mpp.episode import Episode, since_timestamp
+from mpp.library import IndexEntry
+from mpp.podcast import Podcast
+from mpp.query import episode_query
+from mpp.timing import timed
+from mpp.util import log
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS podcasts (
+    id INTEGER PRIMARY KEY,
+    url_hash TEXT NOT NULL UNIQUE,
+    url TEXT NOT NULL,
+    title TEXT,
+    etag TEXT,
+    modified TEXT,
+    content_hash TEXT,
+    schedule TEXT,
+    due REAL
+);
+CREATE TABLE IF NOT EXISTS episodes (
+    id INTEGER PRIMARY KEY,
+    podcast_id INTEGER NOT NULL REFERENCES podcasts(id),
+    title TEXT,
+    media_url TEXT,
+    published TEXT,
+    published_ts INTEGER,
+    media_path TEXT,
+    skipped INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS episodes_podcast_ts ON episodes (podcast_id, published_ts);
+CREATE INDEX IF NOT EXISTS episodes_status ON episodes (podcast_id, skipped, media_path);
+CREATE INDEX IF NOT EXISTS episodes_ts ON episodes (published_ts);
+CREATE INDEX IF NOT EXISTS episodes_media_url ON episodes (media_url);
+'''
+
+EPISODE_COLUMNS = 'id, title, media_url, published, published_ts, media_path, skipped'
+
+# columns added to the podcasts table since it was first created
+PODCAST_COLUMNS = (('schedule', 'TEXT'), ('due', 'REAL'))
+
+# SQL conditions which select the episodes which may have each status.
+# Whether an episode with a media_path is downloaded or listened depends on
+# whether the file exists, which is checked afterwards.
+STATUS_SQL = {
+    'new': '(skipped = 0 AND media_path IS NULL)',
+    'skipped': 'skipped = 1',
+    'downloaded': '(skipped = 0 AND media_path IS NOT NULL)',
+    'listened': '(skipped = 0 AND media_path IS NOT NULL)',
+    'any': '1',
+}
+
+class DatabaseLibrary():
+    """ The podcasts in an SQLite database, with the same interface as
+        mpp.library.Library.
+
+        Episode queries are done in SQL, so only the matching episodes are
+        loaded, and saving a podcast inserts its new episodes and updates
+        the rows of episodes which have changed, rather than re-writing
+        everything.
+    """
+    # a daemon may use the connection from several threads, but not at once
+    concurrent_reads = False
+
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(SCHEMA)
+        columns = [x[1] for x in self.db.execute('PRAGMA table_info(podcasts)')]
+        for name, type in PODCAST_COLUMNS:
+            if name not in columns:
+                log.debug('DatabaseLibrary() adding column podcasts.%s' % name)
+                self.db.execute('ALTER TABLE podcasts ADD COLUMN %s %s' % (name, type))
+        self.entries = dict()
+        self.ids = dict()
+        self.loaded = dict()
+        self.data_version = None
+        self.refresh()
+
+    @timed('load_podcasts')
+    def refresh(self):
+        log.debug('DatabaseLibrary.refresh() reading podcasts from: %s' % self.path)
+        self.entries = dict()
+        self.ids = dict()
+        self.loaded = dict()
+        self.data_version = self._data_version()
+        media = dict()
+        for podcast_id, media_path in self.db.execute('SELECT podcast_id, media_path FROM episodes WHERE skipped = 0 AND media_path IS NOT NULL ORDER BY COALESCE(published_ts, 0), id'):
+            media.setdefault(podcast_id, []).append(media_path)
+        for row in self.db.execute('''SELECT p.id, p.title, p.url, p.url_hash, COUNT(e.id),
+                                             TOTAL(e.skipped = 0 AND e.media_path IS NULL), TOTAL(e.skipped), p.due
+                                      FROM podcasts p LEFT JOIN episodes e ON e.podcast_id = p.id
+                                      GROUP BY p.id'''):
+            self._set_entry(row, media.get(row[0], []))
+        return len(self.entries)
+
+    def revalidate(self):
+        """ Re-read the podcasts if another connection has changed the
+            database since they were read
+        """
+        if self._data_version() != self.data_version:
+            log.debug('DatabaseLibrary.revalidate() %s has been changed' % self.path)
+            self.refresh()
+
+    def _data_version(self):
+        return self.db.execute('PRAGMA data_version').fetchone()[0]
+
+    def _set_entry(self, row, media):
+        podcast_id, title, url, url_hash, episodes, new, skipped, due = row
+        self.ids[url_hash] = podcast_id
+        self.entries[url_hash] = IndexEntry(title, url, url_hash, self.path, None, episodes, int(new), int(skipped), media, 0, due)
+
+    def _refresh_entry(self, url_hash):
+        podcast_id = self.ids[url_hash]
+        row = self.db.execute('''SELECT p.id, p.title, p.url, p.url_hash, COUNT(e.id),
+                                        TOTAL(e.skipped = 0 AND e.media_path IS NULL), TOTAL(e.skipped), p.due
+                                 FROM podcasts p LEFT JOIN episodes e ON e.podcast_id = p.id
+                                 WHERE p.id = ? GROUP BY p.id''', (podcast_id,)).fetchone()
+        media = [x[0] for x in self.db.execute('SELECT media_path FROM episodes WHERE podcast_id = ? AND skipped = 0 AND media_path IS NOT NULL ORDER BY COALESCE(published_ts, 0), id', (podcast_id,))]
+        self._set_entry(row, media)
+
+    def summaries(self, pfilter=None, due=None):
+        """ Returns the index entries of podcasts matching pfilter, and if
+            due is a time, which are due to be polled then
+        """
+        return [x for x in self.entries.values() if x.matches_filter(pfilter) and (due is None or x.is_due(due))]
+
+    def podcasts(self, pfilter=None, due=None):
+        """ Returns the podcasts matching pfilter (and due, as for
+            summaries), loading them if needed
+        """
+        return [self.load(x.url_hash) for x in self.summaries(pfilter, due)]
+
+    def has_podcast(self, podcast):
+        return podcast.url_hash() in self.entries
+
+    def entry_for(self, podcast):
+        return self.entries.get(podcast.url_hash())
+
+    def load(self, url_hash):
+        if url_hash not in self.loaded:
+            row = self.db.execute('SELECT url, title, etag, modified, content_hash, schedule FROM podcasts WHERE id = ?', (self.ids[url_hash],)).fetchone()
+            p = Podcast(row[0], row[1])
+            p.etag, p.modified, p.content_hash = row[2:5]
+            if row[5]:
+                p.set_schedule(json.loads(row[5]))
+            p.episodes = self._episodes('podcast_id = ?', [self.ids[url_hash]])
+            self.loaded[url_hash] = p
+        return self.loaded[url_hash]
+
+    def _episodes(self, where, params):
+        episodes = []
+        for row in self.db.execute('SELECT %s FROM episodes WHERE %s ORDER BY COALESCE(published_ts, 0), id' % (EPISODE_COLUMNS, where), params):
+            rowid, title, media_url, published, published_ts, media_path, skipped = row
+            e = Episode(title, media_url, published, media_path, bool(skipped), published_ts)
+            e._row = (rowid, media_path, bool(skipped))
+            episodes.append(e)
+        return episodes
+
+    def select_episodes(self, entry, stati=None, since=None, efilter=None):
+        """ Returns the episodes of the podcast for an index entry which have
+            one of stati, were published since since, and match efilter, in
+            date order. Only the matching rows are read from the database.
+        """
+        query = episode_query(efilter, None if stati is None else tuple(stati), since)
+        if entry.url_hash in self.loaded:
+            podcast = self.loaded[entry.url_hash]
+            return [e for e in podcast.episodes if query.match(e, entry)]
+        where = ['podcast_id = ?']
+        params = [self.ids[entry.url_hash]]
+        if stati is not None:
+            where.append('(%s)' % ' OR '.join([STATUS_SQL.get(s, '0') for s in stati]))
+        if since is not None:
+            where.append('COALESCE(published_ts, 0) >= ?')
+            params.append(since_timestamp(since))
+        # words which every matching title contains
+        for word in query.words:
+            where.append("title LIKE ? ESCAPE '\\'")
+            params.append('%%%s%%' % word.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_'))
+        episodes = self._episodes(' AND '.join(where), params)
+        # LIKE only ignores the case of ASCII letters, the rest of the query
+        # is not done in SQL, and downloaded and listened depend on the
+        # media files, so check each episode as well
+        return [e for e in episodes if query.match(e, entry)]
+
+    def save_episodes(self, entry, episodes):
+        """ Save changes made to episodes from select_episodes """
+        if len(episodes) == 0:
+            return
+        with self.db:
+            self._save_episodes(self.ids[entry.url_hash], episodes)
+        self._refresh_entry(entry.url_hash)
+
+    def _save_episodes(self, podcast_id, episodes):
+        for e in episodes:
+            if e._row is None:
+                c = self.db.execute('INSERT INTO episodes (podcast_id, title, media_url, published, published_ts, media_path, skipped) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                    (podcast_id, e.title, e.media_url, e.published, e.published_ts, e.media_path, bool(e.skipped)))
+                e._row = (c.lastrowid, e.media_path, bool(e.skipped))
+            elif e._row[1:] != (e.media_path, bool(e.skipped)):
+                log.log(logging.DEBUG-1, 'DatabaseLibrary._save_episodes() updating %s' % e.title)
+                self.db.execute('UPDATE episodes SET media_path = ?, skipped = ? WHERE id = ?', (e.media_path, bool(e.skipped), e._row[0]))
+                e._row = (e._row[0], e.media_path, bool(e.skipped))
+
+    def catch_up(self, entry, leave=0):
+        if entry.url_hash in self.loaded:
+            podcast = self.loaded[entry.url_hash]
+            count = podcast.catch_up(leave)
+            if count > 0:
+                self.save(podcast)
+            return count
+        with self.db:
+            c = self.db.execute('''UPDATE episodes SET skipped = 1 WHERE skipped = 0 AND id IN (
+                                       SELECT id FROM episodes WHERE podcast_id = ?
+                                       ORDER BY COALESCE(published_ts, 0), id LIMIT ?)''',
+                                (self.ids[entry.url_hash], max(entry.episodes - leave, 0)))
+        if c.rowcount > 0:
+            self._refresh_entry(entry.url_hash)
+        return c.rowcount
+
+    def add(self, podcast, path=None):
+        self.save(podcast)
+
+    @timed('DatabaseLibrary.save')
+    def save(self, podcast):
+        """ Upserts the podcast row, inserts new episodes and updates the
+            episodes which have changed
+        """
+        url_hash = podcast.url_hash()
+        log.log(logging.DEBUG-1, 'DatabaseLibrary.save(%s)' % podcast.title)
+        with self.db:
+            self.db.execute('''INSERT INTO podcasts (url_hash, url, title, etag, modified, content_hash, schedule, due) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                               ON CONFLICT(url_hash) DO UPDATE SET url = excluded.url, title = excluded.title, etag = excluded.etag,
+                                                                   modified = excluded.modified, content_hash = excluded.content_hash,
+                                                                   schedule = excluded.schedule, due = excluded.due''',
+                            (url_hash, podcast.url, podcast.title, podcast.etag, podcast.modified, podcast.content_hash,
+                             json.dumps(podcast.schedule()), podcast.next_due()))
+            podcast_id = self.db.execute('SELECT id FROM podcasts WHERE url_hash = ?', (url_hash,)).fetchone()[0]
+            self.ids[url_hash] = podcast_id
+            self._save_episodes(podcast_id, podcast.episodes)
+        self.loaded[url_hash] = podcast
+        self._refresh_entry(url_hash)
+
+    def rename(self, podcast, title):
+        podcast.title = title
+        with self.db:
+            self.db.execute('UPDATE podcasts SET title = ? WHERE id = ?', (title, self.ids[podcast.url_hash()]))
+        self._refresh_entry(podcast.url_hash())
+
+    def save_schedule(self, podcast):
+        """ Save the polling schedule of a podcast which has been polled
+            without any other changes
+        """
+        with self.db:
+            self.db.execute('UPDATE podcasts SET schedule = ?, due = ? WHERE id = ?',
+                            (json.dumps(podcast.schedule()), podcast.next_due(), self.ids[podcast.url_hash()]))
+        self._refresh_entry(podcast.url_hash())
+
+    def move(self, podcast, path):
+        raise Exception('podcasts in an sqlite database cannot be migrated, use export and import instead')
+
+    def remove(self, podcast):
+        url_hash = podcast.url_hash()
+        with self.db:
+            self.db.execute('DELETE FROM episodes WHERE podcast_id = ?', (self.ids[url_hash],))
+            self.db.execute('DELETE FROM podcasts WHERE id = ?', (self.ids[url_hash],))
+        self.entries.pop(url_hash, None)
+        self.ids.pop(url_hash, None)
+        self.loaded.pop(url_hash, None)
+
+    def write_index(self):
+        # changes are committed as they are made
+        pass
@@ -1,46 +1,102 @@
-import types
 import logging
-import dateutil.parser
-import os
 import re
-from mpp.util import log
+import calendar
+import datetime
+import functools
+import mpp.util
+from mpp.timing import timed
+from mpp.util import log, media_exists
 
 class Episode():
-    def __init__(self, title, media_url, published, media_path=None, skipped=False):
-        # this works a little like a named tuple
-        l = locals()
-        for v in [x for x in l.keys() if x != 'self']:
-            setattr(self, v, l[v])
+    # The fields of an episode, which are saved in the feed data. Using
+    # __slots__ means episodes don't each carry a __dict__.
+    FIELDS = ('title', 'media_url', 'published', 'published_ts', 'media_path', 'skipped')
+    __slots__ = ('title', 'media_url', 'published', 'published_ts', '_media_path', '_skipped', '_status', '_status_generation', '_row')
+
+    def __init__(self, title, media_url, published, media_path=None, skipped=False, published_ts=None):
+        self.title = title
+        self.media_url = media_url
+        # published is kept as it appears in the feed, published_ts is a
+        # UTC timestamp which is used for comparisons and sorting
+        self.published = published
+        if published_ts is None:
+            published_ts = parse_timestamp(published)
+        self.published_ts = published_ts
+        self._status = None
+        self.media_path = media_path
+        self.skipped = skipped
+        # (rowid, media_path, skipped) as last saved, for episodes stored 
+        # in a database (see mpp.database)
+        self._row = None
+
+    # status() is cached, so changing media_path or skipped clears the cache
+    @property
+    def media_path(self):
+        return self._media_path
+
+    @media_path.setter
+    def media_path(self, media_path):
+        self._media_path = media_path
+        self._status = None
+
+    @property
+    def skipped(self):
+        return self._skipped
+
+    @skipped.setter
+    def skipped(self, skipped):
+        self._skipped = skipped
+        self._status = None
+
+    def __getstate__(self):
+        return (None, {x: getattr(self, x) for x in self.FIELDS})
+
+    def __setstate__(self, state):
+        self._status = None
+        self._row = None
+        for k, v in state[1].items():
+            setattr(self, k, v)
 
     def __str__(self):
-        return 'Episode(%s)' % ', '.join(['%s=%s' % (x, getattr(self, x)) for x in self.get_fields()])
+        return 'Episode(%s)' % ', '.join(['%s=%s' % (x, getattr(self, x)) for x in self.FIELDS])
 
     def __lt__(self, other):
-        pd = self._pub_date().replace(tzinfo=None)
-        od = other._pub_date().replace(tzinfo=None)
-        return pd < od
+        return (self.published_ts or 0) < (other.published_ts or 0)
 
     def get_fields(self):
-        return [x for x in dir(self) if x[0] != '_' and type(getattr(self, x)) != types.MethodType]
+        return list(self.FIELDS)
 
     def to_dict(self):
-        return {x: getattr(self, x) for x in self.get_fields()}
+        return {x: getattr(self, x) for x in self.FIELDS}
 
     def _pub_date(self):
-        """ Returns a datetime object from the published value (which is a
-            string)
+        """ Returns a UTC datetime object from the published timestamp
         """
-        if self.published:
-            return dateutil.parser.parse(self.published)
+        if self.published_ts is not None:
+            return datetime.datetime.fromtimestamp(self.published_ts, datetime.timezone.utc)
         return None
 
+    def title_key(self):
+        """ Returns a (title, publish time) tuple, with the publish time 
+            normalised to a UTC timestamp. Episodes with the same title_key
+            are equal.
+        """
+        return (self.title, self.published_ts)
+
+    @timed('Episode.status')
     def status(self):
+        if self._status is None or self._status_generation != mpp.util.media_generation:
+            self._status = self._find_status()
+            self._status_generation = mpp.util.media_generation
+        return self._status
+
+    def _find_status(self):
         if self.skipped:
             return 'skipped'
         else:
             if self.media_path is None:
                 return 'new'
-            elif os.path.exists(self.media_path):
+            elif media_exists(self.media_path):
                 return 'downloaded'
             else:
                 return 'listened'
@@ -52,14 +108,14 @@ class Episode():
         return(s == status or s == 'any')
 
     def matches_filter(self, filter):
-        if filter is None or filter == '*':
-            return True
-        return filter.lower() in self.title.lower()
+        # mpp.query imports this module
+        from mpp.query import episode_query
+        return episode_query(filter).match(self)
 
     def since(self, datestring):
         if datestring is None:
             return True
-        return self._pub_date() >= dateutil.parser.parse(datestring)
+        return (self.published_ts or 0) >= since_timestamp(datestring)
 
     def __eq__(self, ep):
         """ Somewhat fuzzy equality operator. There are some cases where we
@@ -71,7 +127,7 @@ class Episode():
         """
         if self.media_url == ep.media_url:
             return True
-        elif self.title == ep.title and self._pub_date() == ep._pub_date():
+        elif self.title == ep.title and self.title_key() == ep.title_key():
             return True
         else:
             return False
@@ -90,6 +146,35 @@ class Episode():
                     d['media_url'],
                     d['published'],
                     d.get('media_path'),
-                    d.get('skipped') )
+                    d.get('skipped'),
+                    d.get('published_ts') )
+
+# the named zones of RFC 822 dates, for dates which email.utils can't parse
+# but dateutil can, which would otherwise ignore them
+TIMEZONES = {'UT': 0, 'GMT': 0, 'Z': 0,
+             'EST': -5*3600, 'EDT': -4*3600, 'CST': -6*3600, 'CDT': -5*3600,
+             'MST': -7*3600, 'MDT': -6*3600, 'PST': -8*3600, 'PDT': -7*3600}
+
+def parse_timestamp(datestring):
+    """ Returns a UTC timestamp from a date string, or None if datestring is
+        empty. Times without a timezone are taken to be UTC. Most feeds use 
+        RFC 822 dates, which email.utils parses much faster than dateutil.
+    """
+    if not datestring:
+        return None
+    import email.utils
+    try:
+        return calendar.timegm(email.utils.parsedate_to_datetime(datestring).utctimetuple())
+    except (TypeError, ValueError, IndexError):
+        pass
+    import dateutil.parser
+    return calendar.timegm(dateutil.parser.parse(datestring, tzinfos=TIMEZONES).utctimetuple())
+
+@functools.lru_cache(maxsize=16)
+def since_timestamp(datestring):
+    """ parse_timestamp for --since arguments, which are compared with every
+        episode
+    """
+    return parse_timestamp(datestring)
 
 
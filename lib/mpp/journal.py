@@ -0,0 +1,99 @@
+import json
+import logging
+import os
+from mpp.util import log
+
+# Changes to a podcast saved as a file are appended to a journal next to it,
+# as lines of JSON, rather than re-writing the whole feed file. Each record
+# holds the new state of an episode or of the podcast's own fields, so
+# replaying a record more than once does no harm.
+
+def journal_path(path):
+    return path + '.journal'
+
+def journal_size(path):
+    try:
+        return os.stat(journal_path(path)).st_size
+    except FileNotFoundError:
+        return 0
+
+def episode_record(e, index=None):
+    """ A record of the state of episode e, which is at index in the
+        podcast's episodes
+    """
+    return {'episode': e.to_dict(), 'index': index}
+
+def podcast_record(podcast):
+    d = {'title': podcast.title}
+    d.update(podcast.schedule())
+    return {'podcast': d}
+
+def append(path, records):
+    """ Append records to the journal of the feed file at path. They are
+        written with a single write to a file opened for appending, so that
+        records appended by several processes are not mixed up. Each record
+        starts on a new line, so one which was cut short by a crash does not
+        run into the next.
+    """
+    data = ''.join(['\n' + json.dumps(r, separators=(',', ':')) for r in records]).encode('utf-8')
+    fd = os.open(journal_path(path), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o666)
+    try:
+        written = os.write(fd, data)
+        if written != len(data):
+            raise OSError('short write to %s (%d of %d bytes)' % (journal_path(path), written, len(data)))
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def read(path):
+    """ Returns the records in the journal of the feed file at path """
+    try:
+        with open(journal_path(path), 'rb') as f:
+            lines = f.read().split(b'\n')
+    except FileNotFoundError:
+        return []
+    records = []
+    for line in lines:
+        if not line:
+            continue
+        try:
+            records.append(json.loads(line.decode('utf-8')))
+        except ValueError:
+            # the end of a record which was being written when we crashed
+            log.warning('journal.read() ignoring bad record in %s' % journal_path(path))
+    return records
+
+def replay(podcast, records):
+    for r in records:
+        if 'podcast' in r:
+            podcast.title = r['podcast'].get('title', podcast.title)
+            podcast.set_schedule(r['podcast'])
+        elif 'episode' in r:
+            e = find_recorded(podcast.episodes, r['episode'], r.get('index'))
+            if e is None:
+                log.log(logging.DEBUG-1, 'journal.replay() no episode for %s' % r['episode'])
+                continue
+            e.media_path = r['episode'].get('media_path')
+            e.skipped = r['episode'].get('skipped')
+
+def find_recorded(episodes, d, index):
+    """ Returns the episode which the record d was made for: the one at
+        index if it has the recorded media_url, title and published, or
+        for a record without an index, the only episode which has them.
+        Episodes which only look alike (see Episode.__eq__) are not used,
+        as several episodes may share a media_url or title.
+    """
+    key = (d.get('media_url'), d.get('title'), d.get('published'))
+    same = lambda e: (e.media_url, e.title, e.published) == key
+    if index is not None:
+        if 0 <= index < len(episodes) and same(episodes[index]):
+            return episodes[index]
+        return None
+    found = [e for e in episodes if same(e)]
+    return found[0] if len(found) == 1 else None
+
+def remove(path):
+    try:
+        os.unlink(journal_path(path))
+    except FileNotFoundError:
+        pass
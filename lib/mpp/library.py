@@ -0,0 +1,470 @@
+import gc
+import glob
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+import mpp.journal
+from mpp.episode import Episode
+from mpp.podcast import Podcast
+from mpp.polling import is_due
+from mpp.query import podcast_query, episode_query, title_tokens
+from mpp.storage import atomic_write, extensions
+from mpp.timing import timed, collected, merge
+from mpp.util import log, media_exists
+
+# Feed files are read in worker processes when at least this many need to be
+# loaded at once, and the library has more than one worker
+PARALLEL_LOAD = 32
+
+# The arguments of Episode(), in order, which is how episodes are passed
+# back from the workers
+EPISODE_ARGS = ('title', 'media_url', 'published', 'media_path', 'skipped', 'published_ts')
+
+# A journal is compacted, by re-writing its feed file, when it is larger than
+# both this and a quarter of the feed file
+COMPACT_SIZE = 16 * 1024
+
+class IndexEntry():
+    """ A summary of a podcast, as stored in the library index. This is
+        enough to list podcasts and resolve filters without loading the
+        feed file.
+    """
+    FIELDS = ('title', 'url', 'url_hash', 'path', 'mtime', 'episodes', 'new', 'skipped', 'media', 'journal', 'due')
+    __slots__ = FIELDS
+
+    def __init__(self, title, url, url_hash, path, mtime, episodes=0, new=0, skipped=0, media=None, journal=0, due=None):
+        self.title = title
+        self.url = url
+        self.url_hash = url_hash
+        self.path = path
+        self.mtime = mtime
+        # the size of the feed file's journal (see mpp.journal)
+        self.journal = journal or 0
+        self.episodes = episodes
+        self.new = new
+        self.skipped = skipped
+        # media paths of episodes which are not skipped. Whether these are
+        # downloaded or listened depends on whether the file exists.
+        self.media = media if media is not None else []
+        # when the feed should next be polled (see mpp.polling)
+        self.due = due
+
+    def matches_filter(self, filter):
+        return podcast_query(filter).match(self)
+
+    def downloaded(self):
+        return len([1 for x in self.media if media_exists(x)])
+
+    def is_due(self, now):
+        return is_due(self.due, now)
+
+    def to_dict(self):
+        return {x: getattr(self, x) for x in self.FIELDS}
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(*[d.get(x) for x in cls.FIELDS])
+
+    @classmethod
+    def from_podcast(cls, podcast, mtime, journal=0):
+        return cls( podcast.title,
+                    podcast.url,
+                    podcast.url_hash(),
+                    podcast.path,
+                    mtime,
+                    len(podcast.episodes),
+                    len([1 for x in podcast.episodes if not x.skipped and x.media_path is None]),
+                    len([1 for x in podcast.episodes if x.skipped]),
+                    [x.media_path for x in podcast.episodes if not x.skipped and x.media_path],
+                    journal,
+                    podcast.next_due() )
+
+class Library():
+    """ The podcasts in feed_dir.
+
+        An index of the podcasts is kept in feed_dir/.index.json, and feed
+        files are only loaded when a command needs them. If a feed file's
+        modification time differs from the one in the index, it is loaded
+        and its index entry is refreshed.
+
+        When many feed files have to be read at once (re-indexing, or
+        loading every podcast for update), they are decoded in up to
+        workers processes (see read_feeds).
+
+        Changes to the status of episodes, and renaming, are appended to a
+        journal for the feed file (see mpp.journal), which is replayed when
+        it is loaded, and compacted into the feed file by write_index once
+        it has grown.
+
+        The tokens of the episode titles of each podcast are kept in
+        feed_dir/.tokens.json, which is loaded when a filter has words to
+        look up, so that only the feeds which could match are loaded.
+    """
+    # a daemon can answer reads in other threads while a command is making
+    # changes, as those happen in its memory. Readers don't change entries,
+    # and take each cache (the token postings and the candidates of each
+    # query) into a local once, as a writer may replace it at any time.
+    # The title tokens, which readers bring up to date, have a lock.
+    concurrent_reads = True
+
+    def __init__(self, feed_dir, workers=1):
+        self.feed_dir = feed_dir
+        self.workers = workers
+        self.index_path = os.path.join(feed_dir, '.index.json')
+        self.tokens_path = os.path.join(feed_dir, '.tokens.json')
+        self.entries = dict()
+        self.loaded = dict()
+        self.changed = False
+        # [mtime, tokens] by path, read from tokens_path when needed, and
+        # those of podcasts saved since
+        self.tokens = None
+        self.new_tokens = dict()
+        self.tokens_changed = False
+        self._tokens_lock = threading.Lock()
+        # (postings, paths found for each word) for _lookup
+        self._postings = None
+        self._candidates = dict()
+        self.refresh()
+
+    @timed('load_podcasts')
+    def refresh(self):
+        log.debug('Library.refresh() looking for feeds in: %s' % self.feed_dir)
+        index = dict()
+        try:
+            with open(self.index_path, 'r') as f:
+                index = {d['path']: IndexEntry.from_dict(d) for d in json.load(f)}
+        except FileNotFoundError:
+            log.debug('Library.refresh() no index at %s' % self.index_path)
+        except Exception as e:
+            log.warning('Library.refresh() ignoring bad index %s: %s' % (self.index_path, e))
+        self.entries = dict()
+        self.loaded = dict()
+        paths = []
+        for extension in extensions():
+            paths.extend(glob.glob('%s/*%s' % (self.feed_dir, extension)))
+        stale = []
+        for path in paths:
+            entry = index.get(path)
+            if entry is None or entry.mtime != os.stat(path).st_mtime_ns or entry.journal != mpp.journal.journal_size(path):
+                log.log(logging.DEBUG-1, 'Library.refresh() re-indexing %s' % path)
+                stale.append(path)
+            else:
+                self.entries[path] = entry
+        if self._parallel(stale):
+            for entry, podcast in self._read(stale, False):
+                self.entries[entry.path] = entry
+                self.changed = True
+        else:
+            for path in stale:
+                self.update(self.load(path))
+        if set(index.keys()) - set(self.entries.keys()):
+            self.changed = True
+        return len(self.entries)
+
+    def revalidate(self):
+        """ Bring the podcasts in memory up to date with the feed files,
+            for a long running process. Those changed by another process
+            are re-loaded, and those which have been removed are dropped.
+        """
+        paths = set()
+        for extension in extensions():
+            paths.update(glob.glob('%s/*%s' % (self.feed_dir, extension)))
+        for path in paths:
+            entry = self.entries.get(path)
+            if entry is None or entry.mtime != os.stat(path).st_mtime_ns or entry.journal != mpp.journal.journal_size(path):
+                log.debug('Library.revalidate() re-loading %s' % path)
+                self.loaded.pop(path, None)
+                self.update(self.load(path))
+        for path in set(self.entries.keys()) - paths:
+            log.debug('Library.revalidate() %s has been removed' % path)
+            self.entries.pop(path, None)
+            self.loaded.pop(path, None)
+            self.changed = True
+
+    def summaries(self, pfilter=None, due=None):
+        """ Returns the index entries of podcasts matching pfilter, and if
+            due is a time, which are due to be polled then
+        """
+        return [x for x in list(self.entries.values()) if x.matches_filter(pfilter) and (due is None or x.is_due(due))]
+
+    def podcasts(self, pfilter=None, due=None):
+        """ Returns the podcasts matching pfilter (and due, as for
+            summaries), loading them if needed
+        """
+        matched = self.summaries(pfilter, due)
+        self.load_many([x.path for x in matched])
+        return [self.load(x.path) for x in matched]
+
+    def has_podcast(self, podcast):
+        url_hash = podcast.url_hash()
+        return any([x.url_hash == url_hash for x in list(self.entries.values())])
+
+    def entry_for(self, podcast):
+        return self.entries.get(podcast.path)
+
+    def select_episodes(self, entry, stati=None, since=None, efilter=None):
+        """ Returns the episodes of the podcast for an index entry which have
+            one of stati, were published since since, and match efilter, in
+            date order
+        """
+        query = episode_query(efilter, None if stati is None else tuple(stati), since)
+        if not self.may_match(entry, query):
+            return []
+        podcast = self.load(entry.path)
+        return [e for e in podcast.episodes if query.match(e, entry)]
+
+    def may_match(self, entry, query):
+        """ False if the token index shows that none of the episode titles
+            of the podcast for entry can match query
+        """
+        candidates = self._candidates
+        if query not in candidates:
+            candidates[query] = query.candidates(self._lookup)
+        found = candidates[query]
+        return found is None or entry.path in found
+
+    def _lookup(self, word):
+        """ The paths of podcasts with an episode title token containing
+            word
+        """
+        cache = self._postings
+        if cache is None:
+            postings = dict()
+            for path, (mtime, tokens) in self._title_tokens().items():
+                for t in tokens:
+                    postings.setdefault(t, set()).add(path)
+            cache = self._postings = (postings, dict())
+        postings, found_for = cache
+        found = found_for.get(word)
+        if found is None:
+            found = set()
+            for token, paths in postings.items():
+                if word in token:
+                    found |= paths
+            found_for[word] = found
+        return found
+
+    def _read_tokens(self):
+        try:
+            with open(self.tokens_path, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return dict()
+        except Exception as e:
+            log.warning('Library._read_tokens() ignoring bad token index %s: %s' % (self.tokens_path, e))
+            return dict()
+
+    @timed('Library.title_tokens')
+    def _title_tokens(self):
+        """ A copy of the title tokens of each podcast, brought up to date
+            with the index
+        """
+        with self._tokens_lock:
+            if self.tokens is None:
+                self.tokens = self._read_tokens()
+            if self.new_tokens:
+                self.tokens.update(self.new_tokens)
+                self.new_tokens = dict()
+                self.tokens_changed = True
+            for path, entry in list(self.entries.items()):
+                t = self.tokens.get(path)
+                if t is None or t[0] != entry.mtime:
+                    log.log(logging.DEBUG-1, 'Library._title_tokens() indexing %s' % path)
+                    self.tokens[path] = podcast_tokens(self.load(path), entry.mtime)
+                    self.tokens_changed = True
+            return dict(self.tokens)
+
+    def save_episodes(self, entry, episodes):
+        """ Save changes made to episodes from select_episodes, by appending
+            them to the journal
+        """
+        if len(episodes) > 0:
+            podcast = self.load(entry.path)
+            index = dict((id(e), i) for i, e in enumerate(podcast.episodes))
+            mpp.journal.append(entry.path, [mpp.journal.episode_record(e, index.get(id(e))) for e in episodes])
+            self.update(podcast)
+
+    def catch_up(self, entry, leave=0):
+        podcast = self.load(entry.path)
+        unskipped = [e for e in podcast.episodes if not e.skipped]
+        count = podcast.catch_up(leave)
+        self.save_episodes(entry, [e for e in unskipped if e.skipped])
+        return count
+
+    def rename(self, podcast, title):
+        podcast.title = title
+        mpp.journal.append(podcast.path, [mpp.journal.podcast_record(podcast)])
+        self.update(podcast)
+
+    def save_schedule(self, podcast):
+        """ Save the polling schedule of a podcast which has been polled
+            without any other changes
+        """
+        mpp.journal.append(podcast.path, [mpp.journal.podcast_record(podcast)])
+        self.update(podcast)
+
+    def load(self, path):
+        podcast = self.loaded.get(path)
+        if podcast is None:
+            # a podcast loaded by two threads at once is only kept once
+            podcast = self.loaded.setdefault(path, load_podcast(path))
+        return podcast
+
+    @timed('Library.load_many')
+    def load_many(self, paths):
+        """ Load the feed files in paths which are not already loaded, in
+            worker processes if there are enough of them
+        """
+        paths = [x for x in paths if x not in self.loaded]
+        if not self._parallel(paths):
+            return
+        for entry, podcast in self._read(paths, True):
+            podcast.path = entry.path
+            self.loaded.setdefault(entry.path, podcast)
+
+    def _parallel(self, paths):
+        return self.workers > 1 and len(paths) >= PARALLEL_LOAD
+
+    def _read(self, paths, podcasts):
+        """ Read paths with read_feeds in a pool of processes, in a few
+            chunks per worker, returning (entry, podcast) for each path, in
+            the same order
+        """
+        from concurrent.futures import ProcessPoolExecutor
+        workers = min(self.workers, len(paths))
+        size = -(-len(paths) // (workers * 4))
+        chunks = [paths[i:i+size] for i in range(0, len(paths), size)]
+        log.debug('Library._read() reading %d feeds with %d workers' % (len(paths), workers))
+        results = []
+        with ProcessPoolExecutor(workers) as pool:
+            futures = [pool.submit(collected, read_feeds, x, podcasts) for x in chunks]
+            # nothing built here lives for less than the whole command, so
+            # the garbage collector would only slow down building it
+            with gc_paused():
+                for f in futures:
+                    read, samples = f.result()
+                    merge(samples)
+                    for entry, podcast in read:
+                        results.append((IndexEntry(*entry), podcast and podcast_from_tuple(podcast)))
+        return results
+
+    def add(self, podcast, path):
+        podcast.path = path
+        self.loaded[path] = podcast
+        self.save(podcast)
+
+    def save(self, podcast):
+        """ Re-write the podcast's feed file, which includes the changes in
+            its journal, so the journal is removed
+        """
+        podcast.save()
+        mpp.journal.remove(podcast.path)
+        self.update(podcast)
+
+    def update(self, podcast):
+        """ Update the index entry for a podcast, which has just been saved """
+        old = self.entries.get(podcast.path)
+        entry = self.entries[podcast.path] = IndexEntry.from_podcast(podcast, os.stat(podcast.path).st_mtime_ns,
+                                                                     mpp.journal.journal_size(podcast.path))
+        self.changed = True
+        # titles only change when the feed file is re-written
+        if old is None or old.mtime != entry.mtime:
+            tokens = podcast_tokens(podcast, entry.mtime)
+            with self._tokens_lock:
+                self.new_tokens[podcast.path] = tokens
+            self._postings = None
+            self._candidates = dict()
+
+    def move(self, podcast, path):
+        """ Save a podcast to a new path (possibly in a different format),
+            and remove the old file
+        """
+        old_path = podcast.path
+        self.add(podcast, path)
+        if old_path != path:
+            os.unlink(old_path)
+            mpp.journal.remove(old_path)
+            self.entries.pop(old_path, None)
+            self.loaded.pop(old_path, None)
+
+    def remove(self, podcast):
+        podcast.delete()
+        mpp.journal.remove(podcast.path)
+        self.entries.pop(podcast.path, None)
+        self.loaded.pop(podcast.path, None)
+        self.changed = True
+
+    def compact(self):
+        """ Re-write the feed files whose journals have grown too large """
+        for entry in list(self.entries.values()):
+            if entry.journal > COMPACT_SIZE and entry.journal > os.stat(entry.path).st_size // 4:
+                log.debug('Library.compact() %s journal is %d bytes' % (entry.path, entry.journal))
+                self.save(self.load(entry.path))
+
+    def write_index(self):
+        self.compact()
+        with self._tokens_lock:
+            if self.new_tokens or self.tokens_changed:
+                if self.tokens is None:
+                    self.tokens = self._read_tokens()
+                self.tokens.update(self.new_tokens)
+                self.new_tokens = dict()
+                log.debug('Library.write_index() tokens -> %s' % self.tokens_path)
+                atomic_write(self.tokens_path, json.dumps({k: v for k, v in self.tokens.items() if k in self.entries}).encode('utf-8'))
+                self.tokens_changed = False
+        if not self.changed:
+            return
+        log.debug('Library.write_index() %d entries -> %s' % (len(self.entries), self.index_path))
+        atomic_write(self.index_path, json.dumps([x.to_dict() for x in self.entries.values()]).encode('utf-8'))
+        self.changed = False
+
+def read_feeds(paths, podcasts):
+    """ Read feed files in a worker process, returning the index entry of
+        each as a tuple, and if podcasts is True, the podcast as a tuple of
+        its fields and episode tuples (see podcast_from_tuple), which are
+        much quicker to pickle and unpickle than the objects
+    """
+    results = []
+    for path in paths:
+        p = load_podcast(path)
+        entry = IndexEntry.from_podcast(p, os.stat(path).st_mtime_ns, mpp.journal.journal_size(path))
+        podcast = None
+        if podcasts:
+            podcast = (p.url, p.title, p.etag, p.modified, p.content_hash, p.schedule(),
+                       [tuple([getattr(e, x) for x in EPISODE_ARGS]) for e in p.episodes])
+        results.append((tuple([getattr(entry, x) for x in IndexEntry.FIELDS]), podcast))
+    return results
+
+def podcast_tokens(podcast, mtime):
+    tokens = set()
+    for e in podcast.episodes:
+        tokens |= title_tokens(e.title)
+    return [mtime, sorted(tokens)]
+
+def load_podcast(path):
+    """ Load a podcast from its feed file and journal """
+    p = Podcast.from_file(path)
+    mpp.journal.replay(p, mpp.journal.read(path))
+    return p
+
+def podcast_from_tuple(t):
+    """ The Podcast for a tuple from read_feeds, whose episodes are already
+        in date order
+    """
+    p = Podcast(t[0], t[1])
+    p.etag, p.modified, p.content_hash = t[2:5]
+    p.set_schedule(t[5])
+    p.episodes = [Episode(*x) for x in t[6]]
+    return p
+
+@contextmanager
+def gc_paused():
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
@@ -0,0 +1,6 @@
+import logging
+
+# The logger for all of mpp. It is in a module of its own, which imports
+# nothing else, so that modules which mpp.util imports, and the mpp daemon
+# client, can use it without importing mpp.util.
+log = logging.getLogger('mpp')
@@ -1,50 +1,68 @@
-import glob
 import os
 import logging
-import dateutil.parser
 import sys
 import json
+import threading
+import time
 from contextlib import contextmanager
-from prettytable import PrettyTable
-from multiprocessing import Pool
+import mpp.store
 from mpp.podcast import Podcast
-from mpp.util import log, confirm, update_and_save_podcast, download_podcast_episode
+from mpp.library import Library
+from mpp.storage import storage_named
+from mpp.util import log, confirm, download_task, init_download_worker, media_exists, media_created, media_removed, forget_media
 
 class PodcastManager():
     def __init__(self, config):
         self.config = config
-        self.podcasts = []
-        self.load_podcasts()
+        storage = self.config.get('storage', 'files')
+        if storage == 'files':
+            self.library = Library(self.config['feed_dir'], int(self.config.get('load_workers', os.cpu_count() or 1)))
+        elif storage == 'sqlite':
+            from mpp.database import DatabaseLibrary
+            self.library = DatabaseLibrary(self.config.get('database', os.path.join(self.config['feed_dir'], 'mpp.sqlite')))
+        else:
+            raise Exception('unknown storage "%s" (should be files or sqlite)' % storage)
+        # while downloading, messages go through the progress reporter
+        self.reporter = None
 
     def exec(self, args):
-        getattr(self, args.cmd)(args)
-        
+        forget_media()
+        try:
+            getattr(self, args.cmd)(args)
+        finally:
+            self.library.write_index()
+
+    def message(self, text):
+        if self.reporter is not None:
+            self.reporter.message(text)
+        else:
+            print(text)
+
+    @property
+    def podcasts(self):
+        return self.library.podcasts()
+
     def load_podcasts(self):
-        log.debug('looking for feeds in: %s' % self.config['feed_dir'])
-        self.podcasts = []
-        for path in glob.glob('%s/*.json' % self.config['feed_dir']):
-            podcast = Podcast.from_file(path)
-            self.podcasts.append(podcast)
-        return len(self.podcasts)
+        return self.library.refresh()
 
     def save_podcasts(self):
         for p in self.podcasts:
-            p.save_to_file(self.config['feed_dir'] + '/%s.json' % p.url_hash())
+            self.library.save(p)
 
-    def get_podcast_path(self, p):
-        return self.config['feed_dir'] + '/%s.json' % p.url_hash()
+    def get_podcast_path(self, p, feed_format=None):
+        storage = storage_named(feed_format or self.config.get('feed_format', 'json'))
+        return self.config['feed_dir'] + '/%s%s' % (p.url_hash(), storage.extension)
 
     def add_podcast(self, args):
         # check if we already have it
         p = Podcast(args.url)
         path = self.get_podcast_path(p)
-        if os.path.exists(path):
-            raise(Exception('already exists: %s : %s' % (args.url, path)))
+        if self.library.has_podcast(p):
+            raise(Exception('already exists: %s' % args.url))
         p = Podcast.from_url(args.url)
         if args.title:
             p.title = args.title
-        self.podcasts.append(p)
-        p.save_to_file(path)
+        self.library.add(p, path)
         return p
 
     def remove_podcast(self, args):
@@ -52,25 +70,24 @@ class PodcastManager():
         if args.pfilter is None:
             if not confirm('Remove all podcasts?'):
                 return
-        to_remove = [x for x in self.podcasts if x.matches_filter(args.pfilter)]
+        to_remove = self.library.podcasts(args.pfilter)
         if len(to_remove) > 0:
             if args.verbose:
                 self.list_podcasts(args)
             for p in to_remove:
-                p.delete()
+                self.library.remove(p)
                 remove_count += 1
         if args.verbose:
             print('Removed %d podcasts' % remove_count)
 
     def rename_podcast(self, args):
-        to_rename = [x for x in self.podcasts if x.matches_filter(args.pfilter)]
+        to_rename = self.library.podcasts(args.pfilter)
         if len(to_rename) != 1:
             log.error('the filter for renaming a podcast should match exactly one podcast (but matches %d)' % len(to_rename))
             exit(1)
         to_rename = to_rename[0]
         log.debug('Renaming %s -> %s' % (to_rename.title, ' '.join(args.title)))
-        to_rename.title = ' '.join(args.title)
-        to_rename.save()
+        self.library.rename(to_rename, ' '.join(args.title))
 
     def show_podcast(self, args):
         log.debug('show_podcast(%s)' % args.pfilter)
@@ -82,7 +99,8 @@ class PodcastManager():
             if a not in args:
                 setattr(args,a,None)
         log.debug('list_podcasts(%s)' % args.pfilter)
-        matched = [x for x in self.podcasts if x.matches_filter(args.pfilter)]
+        matched = self.library.summaries(args.pfilter)
+        from prettytable import PrettyTable
         t = PrettyTable()
         t.add_column('Title', [p.title for p in matched], align='l')
         if args.url:
@@ -91,57 +109,172 @@ class PodcastManager():
             t.add_column('Path', [p.path for p in matched], align='l')
         else:
             if args.verbose:
-                t.add_column('#Ep', [len(p.episodes) for p in matched], align='r')
-                t.add_column('#Skp', [len([1 for x in p.episodes if x.has_status('skipped')]) for p in matched], align='r')
-            t.add_column('#New', [len([1 for x in p.episodes if x.has_status('new')]) for p in matched], align='r')
-            t.add_column('#Dld', [len([1 for x in p.episodes if x.has_status('downloaded')]) for p in matched], align='r')
+                t.add_column('#Ep', [p.episodes for p in matched], align='r')
+                t.add_column('#Skp', [p.skipped for p in matched], align='r')
+            t.add_column('#New', [p.new for p in matched], align='r')
+            t.add_column('#Dld', [p.downloaded() for p in matched], align='r')
 
         print(t)
 
     def catchup_podcast(self, args):
         log.debug('catchup_podcast(%s, %s)' % ( args.pfilter, args.leave ))
-        for p in [x for x in self.podcasts if x.matches_filter(args.pfilter)]:
-            skipped = p.catch_up(args.leave)
-            log.info('caught up %s, skipped %d, leaving %s' % (p.title, skipped, args.leave))
+        for entry in self.library.summaries(args.pfilter):
+            skipped = self.library.catch_up(entry, args.leave)
+            log.info('caught up %s, skipped %d, leaving %s' % (entry.title, skipped, args.leave))
             if skipped > 0:
-                # Remove downloaded files for skipped episodes
-                for e in [x for x in p.episodes if x.has_status('skipped')]:
-                    if e.media_path and os.path.exists(e.media_path):
+                # Remove downloaded files for skipped episodes, and free the
+                # store's copy of those which have been listened to and
+                # deleted already
+                for e in self.library.select_episodes(entry, ['skipped']):
+                    if not e.media_path:
+                        continue
+                    if media_exists(e.media_path):
                         os.remove(e.media_path)
-                p.save()
+                        media_removed(e.media_path)
+                    mpp.store.release(self.config['audio_directory'], e.media_url)
 
     def update_podcasts(self, args):
         log.debug('update_podcasts(pfilter=%s)' % args.pfilter)
-        to_update = [(x, args) for x in self.podcasts if x.matches_filter(args.pfilter)]
+        to_update = self.podcasts_to_update(args)
         if args.verbose:
             print('Updating %d feeds...' % len(to_update))
-        with Pool(args.parallel) as p:
-            p.starmap(update_and_save_podcast, to_update)
+        self.run_updater(args, to_update, lambda p, new, changed: self.feed_updated(args, p, new, changed))
 
-    def download_podcasts(self, args):
-        log.debug('download_podcasts(pfilter=%s, efilter=%s)' % (args.pfilter,args.efilter))
-        new_episodes = []
-        args.max = 1 # temp fix for update / thread problem (see problems section of README.md)
-        for podcast in [x for x in self.podcasts if x.matches_filter(args.pfilter)]:
-            new = [(podcast, x, args) for x in podcast.episodes if x.has_status('new') and x.matches_filter(args.efilter)][:args.max]
-            log.debug('download_podcasts() downloading %d from %s' % (len(new), podcast.title))
-            new_episodes.extend(new)
-        log.debug('download_podcasts() downloading total of %d new episodes with %d parallel' % (len(new_episodes), args.parallel))
+    def podcasts_to_update(self, args):
+        """ The podcasts matching args.pfilter, and with --due, only those
+            which are due to be polled
+        """
+        if not getattr(args, 'due', False):
+            return self.library.podcasts(args.pfilter)
+        to_update = self.library.podcasts(args.pfilter, time.time())
+        log.debug('podcasts_to_update() %d of %d podcasts are due' % (len(to_update), len(self.library.summaries(args.pfilter))))
+        return to_update
+
+    def run_updater(self, args, to_update, callback):
+        from mpp.updater import FeedUpdater
+        updater = FeedUpdater(args.connections, args.per_host, min(args.parallel, os.cpu_count() or 1))
+        updater.run(to_update, callback)
+
+    def feed_updated(self, args, podcast, new, changed):
         if args.verbose:
-            if len(new_episodes) > 0:
-                print('Downloading %d episode%s...' % (len(new_episodes), '' if len(new_episodes)==1 else 's'))
+            self.message('%d new episode%s for %s' % (new, '' if new == 1 else 's', podcast.title))
+        if changed:
+            log.debug('update_podcasts(%s) saving' % podcast.title)
+            self.library.save(podcast)
+        else:
+            self.library.save_schedule(podcast)
+
+    def download_podcasts(self, args, to_update=None):
+        """ Download new episodes of podcasts matching args.pfilter. If 
+            to_update is given, those podcasts are updated at the same time
+            in another thread, and new episodes are queued for download as
+            soon as each feed has been updated.
+        """
+        log.debug('download_podcasts(pfilter=%s, efilter=%s)' % (args.pfilter,args.efilter))
+        from multiprocessing import Pool, SimpleQueue
+        from mpp.scheduler import DownloadScheduler, Throttle
+        from mpp.progress import ProgressReporter
+        scheduler = DownloadScheduler(args.per_host, args.order)
+        entries = dict()
+        episodes = dict()
+        pending = dict()
+        def queue_new(entry):
+            # workers only need the title and url of the podcast, so don't
+            # pickle the whole episode history for each one
+            stub = Podcast(entry.url, entry.title)
+            # episodes with the same media url are downloaded once, and all
+            # of them get the downloaded file
+            new = dict()
+            for e in self.library.select_episodes(entry, ['new'], efilter=args.efilter):
+                if (entry.url_hash, e.media_url) not in episodes:
+                    new.setdefault((entry.url_hash, e.media_url), []).append(e)
+            keys = list(new.keys())
+            if args.max is not None:
+                keys = keys[:max(args.max - len([1 for x in episodes if x[0] == entry.url_hash]), 0)]
+            log.debug('download_podcasts() downloading %d from %s' % (len(keys), entry.title))
+            if len(keys) > 0:
+                entries[entry.url_hash] = entry
+                pending[entry.url_hash] = pending.get(entry.url_hash, 0) + len(keys)
+            for key in keys:
+                episodes[key] = new[key]
+            scheduler.add([(stub, new[key][0], args) for key in keys])
+        for entry in self.library.summaries(args.pfilter):
+            queue_new(entry)
+        log.debug('download_podcasts() downloading total of %d new episodes with %d parallel' % (len(episodes), args.parallel))
+        if args.verbose and to_update is None:
+            if len(episodes) > 0:
+                self.message('Downloading %d episode%s...' % (len(episodes), '' if len(episodes)==1 else 's'))
+            else:
+                self.message('No new episodes to download')
+        # Podcasts are not saved while the updater thread may be changing
+        # them, so that downloads can't save new cache validators without 
+        # the new episodes which go with them
+        updating = set([p.url_hash() for p in to_update or []])
+        downloaded = dict()
+        def save_downloaded(url_hash):
+            if pending.get(url_hash) == 0 and url_hash in downloaded and url_hash not in updating:
+                self.library.save_episodes(entries[url_hash], downloaded.pop(url_hash))
+        def feed_updated(podcast, new, changed):
+            updating.discard(podcast.url_hash())
+            self.feed_updated(args, podcast, new, changed)
+            save_downloaded(podcast.url_hash())
+            if new > 0:
+                queue_new(self.library.entry_for(podcast))
+        def updates_done():
+            updating.clear()
+            scheduler.close()
+        def update():
+            try:
+                self.run_updater(args, to_update, lambda *x: scheduler.call_soon(feed_updated, *x))
+            except Exception as e:
+                log.exception('download_podcasts: error updating feeds - %s: %s' % (type(e), e))
+            finally:
+                scheduler.call_soon(updates_done)
+        # The scheduler starts each download when a worker becomes free, so
+        # the order, per-host limit and rate limit apply across all workers
+        throttle = Throttle(args.rate) if args.rate else None
+        # Workers report progress through a queue, which is shown by the 
+        # reporter in a thread of this process
+        progress = SimpleQueue()
+        self.reporter = ProgressReporter(progress, args.progress, verbose=args.verbose).start()
+        # Workers send back results as they complete, and this process is the
+        # only one which modifies and saves the episodes. Each podcast's 
+        # episodes are saved once, when the last of its downloads has 
+        # finished. Updated feeds are also saved in this thread.
+        with Pool(args.parallel, initializer=init_download_worker, initargs=(throttle, progress)) as p:
+            if to_update is None:
+                scheduler.close()
             else:
-                print('No new episodes to download')
-        with Pool(args.parallel) as p:
+                updater = threading.Thread(target=update, name='updater')
+                updater.start()
             try:
-                p.starmap(download_podcast_episode, new_episodes)
+                for url_hash, media_url, media_path in scheduler.run(p, download_task, args.parallel):
+                    if media_path is not None:
+                        media_created(media_path)
+                        for e in episodes[(url_hash, media_url)]:
+                            e.media_path = media_path
+                            downloaded.setdefault(url_hash, []).append(e)
+                    pending[url_hash] -= 1
+                    save_downloaded(url_hash)
             except Exception as e:
-                log.exception('download_podcasts: error file downloading %s - %s: %s' % (str(new_episodes), type(e), e))
+                log.exception('download_podcasts: error file downloading %s - %s: %s' % (str(list(episodes.keys())), type(e), e))
+            finally:
+                if to_update is not None:
+                    updater.join()
+                    scheduler.drain()
+                for url_hash in downloaded:
+                    self.library.save_episodes(entries[url_hash], downloaded[url_hash])
+                self.reporter.stop()
+                self.reporter = None
 
     def fetch_podcasts(self, args):
-        self.update_podcasts(args)
-        self.load_podcasts()
-        self.download_podcasts(args)
+        """ Update feeds and download new episodes, starting each feed's 
+            downloads as soon as it has been updated
+        """
+        to_update = self.podcasts_to_update(args)
+        if args.verbose:
+            print('Updating %d feeds...' % len(to_update))
+        self.download_podcasts(args, to_update)
 
     def list_episodes(self, args):
         stati = ['new', 'downloaded']
@@ -155,13 +288,22 @@ class PodcastManager():
                     args.since,
                     args.path,
                     stati))
+        if args.path and not (args.efilter or args.since or args.first or args.last) and set(stati) <= set(['new', 'downloaded', 'listened']):
+            # The index has the media paths of the episodes which are not
+            # skipped, in date order, so the feeds don't need to be loaded
+            for entry in self.library.summaries(args.pfilter):
+                for path in entry.media:
+                    if ('downloaded' if media_exists(path) else 'listened') in stati:
+                        print(path)
+            return
         if not args.path and not args.url:
+            from prettytable import PrettyTable
             table = PrettyTable()
             table.field_names = ['Published', 'Podcast', 'Episode', 'Status']
             table.align = 'l'
 
-        for podcast in [x for x in self.podcasts if x.matches_filter(args.pfilter)]:
-            episodes = [e for e in podcast.episodes if stati_match(stati, e) and e.since(args.since) and e.matches_filter(args.efilter)]
+        for entry in self.library.summaries(args.pfilter):
+            episodes = self.library.select_episodes(entry, stati, args.since, args.efilter)
             if args.first:
                 episodes = episodes[:args.first]
             elif args.last:
@@ -179,7 +321,7 @@ class PodcastManager():
                     else:
                         title = e.title[:47] + '...'
                     table.add_row([ e._pub_date().strftime('%Y-%m-%d %T'),
-                                    podcast.title, 
+                                    entry.title, 
                                     title, 
                                     e.status() ])
                 
@@ -199,9 +341,9 @@ class PodcastManager():
                     stati))
 
         total = 0
-        for podcast in [x for x in self.podcasts if x.matches_filter(args.pfilter)]:
+        for entry in self.library.summaries(args.pfilter):
             count_this_podcast = 0
-            episodes = [e for e in podcast.episodes if stati_match(stati, e) and e.since(args.since) and e.matches_filter(args.efilter)]
+            episodes = self.library.select_episodes(entry, stati, args.since, args.efilter)
             if args.first:
                 episodes = episodes[:args.first]
             elif args.last:
@@ -216,11 +358,11 @@ class PodcastManager():
                     log.log
 
                 if e.media_path:
-                    if not os.path.exists(e.media_path):
+                    if not media_exists(e.media_path):
                         e.media_path = None
 
             if count_this_podcast > 0:
-                podcast.save()
+                self.library.save_episodes(entry, episodes)
 
         if args.verbose:
             print('%d episodes renewed' % total)
@@ -228,7 +370,7 @@ class PodcastManager():
     def export_podcasts(self, args):
         log.debug('export_podcasts(pfilter=%s, output_path=%s)' % (args.pfilter, args.path))
         with get_fh_or(sys.stdout, args.path, 'w') as f:
-            data = [x.to_dict() for x in self.podcasts if x.matches_filter(args.pfilter)]
+            data = [x.to_dict() for x in self.library.podcasts(args.pfilter)]
             f.write(json.dumps(data, indent=4, separators=(',', ': ')))
 
     def import_podcasts(self, args):
@@ -240,20 +382,34 @@ class PodcastManager():
                     p = Podcast.from_dict(podcast_dict)
                     log.debug('import_podcasts: examining: %s' % p.title)
                     path = self.get_podcast_path(p)
-                    if os.path.exists(path):
-                        raise(Exception('already exists: %s for %s' % (path, p.title)))
+                    if self.library.has_podcast(p):
+                        raise(Exception('already exists: %s' % p.title))
                     p.path = path
                     if p.matches_filter(args.pfilter):
                         log.debug('import_podcasts: Podcast matches pfilter, saving... %s' % p.title)
-                        p.save()
+                        self.library.save(p)
                 except Exception as e:
                     log.warning('import_podcasts: exception while importing podcast: %s' % e)
                 
-def stati_match(stati, e):
-    for s in stati:
-        if e.has_status(s):
-            return True
-    return False
+    def migrate_podcasts(self, args):
+        feed_format = args.format or self.config.get('feed_format', 'json')
+        log.debug('migrate_podcasts(pfilter=%s, format=%s)' % (args.pfilter, feed_format))
+        count = 0
+        for p in self.library.podcasts(args.pfilter):
+            path = self.get_podcast_path(p, feed_format)
+            if p.path != path:
+                log.debug('migrate_podcasts: %s -> %s' % (p.path, path))
+                self.library.move(p, path)
+                count += 1
+        if args.verbose:
+            print('Migrated %d podcast%s to %s' % (count, '' if count == 1 else 's', feed_format))
+
+    def run_daemon(self, args):
+        """ Keep the podcasts in memory and run commands sent by the mpp
+            script, updating or fetching them every args.interval seconds
+        """
+        from mpp.daemon import Daemon, socket_path
+        Daemon(self, socket_path(self.config), args, args.interval, not args.no_download).serve()
 
 @contextmanager
 def get_fh_or(alt, path, mode):
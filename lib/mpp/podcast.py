@@ -1,24 +1,59 @@
-import json
 import datetime
 import time
+import calendar
 import hashlib
 import os
 import logging
-from mpp.fixedparser import feedparser
+import mpp.polling
+import mpp.session
+import mpp.streamparser
 from mpp.episode import Episode
+from mpp.query import podcast_query
+from mpp.storage import atomic_write, storage_for_path
+from mpp.timing import timed, span
 from mpp.util import log
 
 class BadlyFormedFeed(Exception):
     pass
 
 class Podcast():
+    # what is known about how often to poll the feed (see mpp.polling)
+    SCHEDULE_FIELDS = ('checked', 'ttl', 'skip_hours', 'skip_days', 'max_age')
+
     def __init__(self, url, title=None):
         self.url = url
         self.title = title
         self.path = None
-        self.episodes = []
+        self._episodes = []
+        # HTTP cache validators and a hash of the feed body from the last 
+        # update, used to avoid re-parsing feeds which have not changed
+        self.etag = None
+        self.modified = None
+        self.content_hash = None
+        # when the feed was last polled, its RSS <ttl> (in minutes), 
+        # <skipHours> and <skipDays>, and the max-age of the last response
+        self.checked = None
+        self.ttl = None
+        self.skip_hours = []
+        self.skip_days = []
+        self.max_age = None
+        # indexes of episodes by media url and by (title, publish time), 
+        # which are (re-)built when needed by _check_index
+        self._url_index = dict()
+        self._title_index = dict()
+        self._indexed = None
         log.log(logging.DEBUG-1, 'Podcast.__init__(url=%s, ...)' % self.url)
 
+    # setting episodes to another list clears the indexes
+    @property
+    def episodes(self):
+        return self._episodes
+
+    @episodes.setter
+    def episodes(self, episodes):
+        self._episodes = episodes
+        self._indexed = None
+
     def __str__(self):
         s = 'Podcast:\n+ url=%s\n+ title=%s\n+ episodes=%d :' % (
                 self.title, 
@@ -33,10 +68,13 @@ class Podcast():
             raise Exception('cannot save - no path defined for this Podcast')
         self.save_to_file(self.path)
 
+    @timed('Podcast.save_to_file')
     def save_to_file(self, path):
+        """ Saves the podcast atomically, in the format chosen by the file
+            extension of path (see mpp.storage)
+        """
         log.log(logging.DEBUG-1, 'Podcast.save_to_file(%s/%s, %s)' % (self.title, self.url, path))
-        with open(path, 'w') as f:
-            f.write(json.dumps(self.to_dict()))
+        atomic_write(path, storage_for_path(path).dumps(self.to_dict()))
 
     def delete(self):
         # TODO: remove episodes first
@@ -49,11 +87,61 @@ class Podcast():
         d = dict()
         d['title'] = self.title
         d['url'] = self.url
+        d['etag'] = self.etag
+        d['modified'] = self.modified
+        d['content_hash'] = self.content_hash
+        d.update(self.schedule())
         d['episodes'] = []
         for e in self.episodes:
             d['episodes'].append(e.to_dict())
         return d
 
+    def add_episode(self, episode):
+        self._check_index()
+        self.episodes.append(episode)
+        self._index_episode(episode)
+        self._indexed = self._index_state()
+
+    def find_episode(self, episode):
+        """ Returns the first episode in this podcast which is equal to 
+            episode (see Episode.__eq__), or None
+        """
+        self._check_index()
+        found = self._url_index.get(episode.media_url)
+        if found is None:
+            found = self._title_index.get(episode.title_key())
+        return found
+
+    def find_episode_by_url(self, media_url):
+        self._check_index()
+        return self._url_index.get(media_url)
+
+    def _index_episode(self, episode):
+        self._url_index.setdefault(episode.media_url, episode)
+        self._title_index.setdefault(episode.title_key(), episode)
+
+    def _index_state(self):
+        """ The length of self.episodes, and its first and last episodes,
+            which change when episodes are added, removed, re-ordered or
+            replaced at either end without using add_episode
+        """
+        episodes = self._episodes
+        if not episodes:
+            return (0, None, None)
+        return (len(episodes), id(episodes[0]), id(episodes[-1]))
+
+    def _check_index(self):
+        """ The indexes are rebuilt if self.episodes has been set to another
+            list, or changed without using add_episode
+        """
+        if self._indexed != self._index_state():
+            log.log(logging.DEBUG-1, 'Podcast._check_index() re-indexing %d episodes' % len(self.episodes))
+            self._url_index = dict()
+            self._title_index = dict()
+            for e in self.episodes:
+                self._index_episode(e)
+            self._indexed = self._index_state()
+
     def url_hash(self):
         log.log(logging.DEBUG-1, 'Podcast.url_hash()')
         m = hashlib.md5()
@@ -61,9 +149,7 @@ class Podcast():
         return m.hexdigest()
 
     def matches_filter(self, filter):
-        if filter is None or filter == '*':
-            return True
-        return filter.lower() in self.title.lower()
+        return podcast_query(filter).match(self)
 
     def catch_up(self, leave=0):
         log.log(logging.DEBUG-1, 'Podcast.catch_up()')
@@ -74,14 +160,87 @@ class Podcast():
                 count += 1
         return count
 
+    def cache_validators(self):
+        return (self.etag, self.modified, self.content_hash)
+
+    def schedule(self):
+        return {x: getattr(self, x) for x in self.SCHEDULE_FIELDS}
+
+    def set_schedule(self, d):
+        for x in self.SCHEDULE_FIELDS:
+            if x in d:
+                setattr(self, x, d[x])
+
+    def set_hints(self, hints):
+        """ Set the <ttl>, <skipHours> and <skipDays> of the feed from
+            those found by the parser. Those it stopped before reaching are
+            not in hints, and are left as they were.
+        """
+        for k in ('ttl', 'skip_hours', 'skip_days'):
+            if k in hints:
+                setattr(self, k, hints[k])
+
+    def next_due(self):
+        return mpp.polling.next_due(self)
+
     def update(self):
         """ Downloads feed data from self.url, and adds new episodes if they 
-            are in the feed data
+            are in the feed data. A conditional GET is used, and the feed is
+            only parsed if it has changed since the last update.
         """
         log.log(logging.DEBUG-1, 'Podcast.update()')
-        p = Podcast.from_url(self.url)
-        return self.update_from_podcast(p)
+        r = fetch_feed(self.url, self.etag, self.modified)
+        return self.update_from_response(r)
 
+    def update_from_response(self, r):
+        """ Takes the response from fetch_feed and updates this feed from it.
+            returns the number of new episodes found
+        """
+        content_hash = self.check_response(r)
+        if content_hash is None:
+            return 0
+        new_count = self.update_from_data(r.content)
+        self.content_hash = content_hash
+        return new_count
+
+    def update_from_data(self, data):
+        """ Adds new episodes from feed data. The incremental parser is used
+            if possible, so that only new items are parsed, otherwise the
+            whole feed is parsed with feedparser.
+            returns the number of new episodes found
+        """
+        try:
+            hints = dict()
+            new = self.add_new_episodes(mpp.streamparser.parse_new_episodes(data, self, hints=hints))
+            self.set_hints(hints)
+            return new
+        except mpp.streamparser.NotStreamable as e:
+            log.debug('Podcast.update_from_data(%s) using feedparser: %s' % (self.title, e))
+            return self.update_from_podcast(parse_feed(data, self.url))
+
+    def check_response(self, r):
+        """ Takes the response from fetch_feed and updates the cache 
+            validators from it. Returns the hash of the feed content, or None
+            if the feed has not changed since the last update
+        """
+        log.log(logging.DEBUG-1, 'Podcast.check_response(%s)' % r.status_code)
+        if r.status_code != 304:
+            r.raise_for_status()
+        # a failed poll leaves the feed due
+        self.checked = time.time()
+        self.max_age = mpp.polling.max_age(r.headers)
+        if r.status_code == 304:
+            log.debug('Podcast.check_response(%s) not modified' % self.title)
+            return None
+        self.etag = r.headers.get('ETag')
+        self.modified = r.headers.get('Last-Modified')
+        content_hash = hashlib.md5(r.content).hexdigest()
+        if content_hash == self.content_hash:
+            log.debug('Podcast.check_response(%s) content unchanged' % self.title)
+            return None
+        return content_hash
+
+    @timed('Podcast.update_from_podcast')
     def update_from_podcast(self, p):
         """ Takes another feed and updates this feed from it.
             returns the number of new episodes found
@@ -89,11 +248,18 @@ class Podcast():
         log.log(logging.DEBUG-1, 'Podcast.update_from_podcast(%s)' % p.url)
         if p.url != self.url:
             raise Exception('cannot update from a different podcast')
+        self.ttl = p.ttl
+        return self.add_new_episodes(p.episodes)
+
+    def add_new_episodes(self, episodes):
+        """ Adds those of episodes which are not already in this podcast, in
+            date order. returns the number added
+        """
         new_count = 0
-        for episode in p.episodes:
-            if episode not in self.episodes:
+        for episode in sorted(episodes):
+            if self.find_episode(episode) is None:
                 log.log(logging.DEBUG-1, 'adding new episode: %s' % episode)
-                self.episodes.append(episode)
+                self.add_episode(episode)
                 new_count += 1
         return new_count
         
@@ -101,6 +267,10 @@ class Podcast():
     def from_dict(cls, d):
         log.log(logging.DEBUG-1, 'Podcast.from_dict()')
         p = cls(d['url'], d['title'])
+        p.etag = d.get('etag')
+        p.modified = d.get('modified')
+        p.content_hash = d.get('content_hash')
+        p.set_schedule({x: d[x] for x in cls.SCHEDULE_FIELDS if d.get(x) is not None})
         if d.get('episodes'):
             for e in d['episodes']:
                 p.episodes.append(Episode.from_dict(e))
@@ -108,10 +278,11 @@ class Podcast():
         return p
 
     @classmethod
+    @timed('Podcast.from_parsed')
     def from_parsed(cls, feed, url=None):
         log.log(logging.DEBUG-1, 'Podcast.from_parsed()')
         if feed.bozo:
-            if type(feed.bozo_exception) != feedparser.CharacterEncodingOverride:
+            if type(feed.bozo_exception) != load_feedparser().CharacterEncodingOverride:
                 raise(feed.bozo_exception)
         if url is None:
             try:
@@ -119,34 +290,82 @@ class Podcast():
             except:
                 url = feed.feed.link
         p = cls(url, feed.feed.title)
+        # feedparser drops <skipHours> and <skipDays>, so only the ttl is kept
+        p.ttl = parse_ttl(feed.feed.get('ttl'))
         for e in feed.entries:
-            p.episodes.append(Episode(e.title, get_media_url_for_entry(e), e.published))
+            # feedparser has already parsed the date to a UTC time tuple
+            published_ts = None
+            if e.get('published_parsed'):
+                published_ts = calendar.timegm(e.published_parsed)
+            p.episodes.append(Episode(e.title, get_media_url_for_entry(e), e.published, published_ts=published_ts))
         p.episodes.sort()
         return p
 
     @classmethod
     def from_url(cls, url):
         log.log(logging.DEBUG-1, 'Podcast.from_url()')
-        feed = feedparser.parse(url)
-        return cls.from_parsed(feed,url)
+        r = fetch_feed(url)
+        r.raise_for_status()
+        p = parse_feed(r.content, url)
+        p.content_hash = p.check_response(r)
+        return p
 
     @classmethod
     def from_file_feed(cls, path):
         log.log(logging.DEBUG-1, 'Podcast.from_file_feed()')
         with open(path, 'r') as f:
             s = f.read()
-        feed = feedparser.parse(s)
+        with span('feedparser.parse'):
+            feed = load_feedparser().parse(s)
         return cls.from_parsed(feed)
 
     @classmethod
+    @timed('Podcast.from_file')
     def from_file(cls, path):
         log.log(logging.DEBUG-1, 'Podcast.from_file()')
-        with open(path, 'r') as f:
-            d = json.loads(f.read())
+        with open(path, 'rb') as f:
+            d = storage_for_path(path).loads(f.read())
         p = cls.from_dict(d)
         p.path = path
         return p
 
+@timed('fetch_feed')
+def fetch_feed(url, etag=None, modified=None):
+    """ GET a feed, sending If-None-Match / If-Modified-Since headers if we
+        have validators from a previous fetch. Returns the requests Response
+        (status 304 if the feed has not changed)
+    """
+    log.debug('fetch_feed(%s, etag=%s, modified=%s)' % (url, etag, modified))
+    headers = dict()
+    if etag:
+        headers['If-None-Match'] = etag
+    if modified:
+        headers['If-Modified-Since'] = modified
+    return mpp.session.get(url, headers=headers)
+
+def parse_feed(data, url):
+    """ Parse feed data into a new Podcast. This is a module level function
+        so it may be run in a worker process.
+    """
+    log.debug('parse_feed(%s)' % url)
+    with span('feedparser.parse'):
+        feed = load_feedparser().parse(data)
+    return Podcast.from_parsed(feed, url)
+
+def parse_ttl(ttl):
+    """ The minutes of an RSS <ttl>, or None """
+    try:
+        return max(int(ttl.strip()), 0)
+    except (AttributeError, ValueError):
+        return None
+
+def load_feedparser():
+    """ feedparser is slow to import, and only needed when a feed is parsed
+        in full, so it is imported on first use
+    """
+    from mpp.fixedparser import feedparser
+    return feedparser
+
 def get_media_url_for_entry(e):
     """ Look at a feedparser entry and find the media URL """
     log.debug('get_media_url_for_entry(e.title=%s)' % e.get('title'))
@@ -0,0 +1,93 @@
+import calendar
+import time
+
+# Feeds are polled according to how often they publish. The typical interval
+# between the recent episodes of a feed is divided by POLLS_PER_INTERVAL, so a
+# daily feed is polled every few hours and a weekly one about once a day. A
+# feed which has gone quiet for longer than its typical interval is taken to
+# publish at that longer interval, so it is polled less and less often.
+#
+# The interval is at least the feed's RSS <ttl>, and the max-age of its last
+# HTTP response, and it is kept between MIN_INTERVAL and MAX_INTERVAL. The
+# due time is moved past the feed's <skipHours> and <skipDays>, which are in
+# GMT.
+
+MIN_INTERVAL = 3600
+MAX_INTERVAL = 7 * 86400
+POLLS_PER_INTERVAL = 8
+
+# the number of recent intervals between episodes which are looked at
+HISTORY = 20
+
+# a feed due this soon is updated now, so that feeds polled hourly by cron
+# aren't skipped for being due a few seconds after the run
+EARLY = 300
+
+DAYS = ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday')
+
+def publish_intervals(episodes, history=HISTORY):
+    """ The intervals in seconds between the last history+1 episodes, which
+        are in date order. Episodes published at the same time, or without a
+        date, are ignored.
+    """
+    times = sorted(set([e.published_ts for e in episodes[-(history+1):] if e.published_ts is not None]))
+    return [b - a for a, b in zip(times, times[1:])]
+
+def median(values):
+    values = sorted(values)
+    n = len(values)
+    if n % 2:
+        return values[n // 2]
+    return (values[n // 2 - 1] + values[n // 2]) / 2
+
+def poll_interval(podcast, now):
+    """ The seconds between polls of podcast, as of now """
+    recent = [e.published_ts for e in podcast.episodes[-(HISTORY+1):] if e.published_ts is not None]
+    if not recent:
+        return MAX_INTERVAL
+    intervals = publish_intervals(podcast.episodes)
+    typical = max(median(intervals) if intervals else 0, now - max(recent))
+    interval = max(typical / POLLS_PER_INTERVAL, (podcast.ttl or 0) * 60, podcast.max_age or 0)
+    return int(min(max(interval, MIN_INTERVAL), MAX_INTERVAL))
+
+def skip(due, hours, days):
+    """ The first time from due which is not in one of hours or days (GMT) """
+    if not hours and not days:
+        return due
+    t = due
+    for i in range(24 * 7):
+        tm = time.gmtime(t)
+        if tm.tm_hour not in hours and DAYS[tm.tm_wday] not in days:
+            return t
+        # the start of the next hour
+        t = calendar.timegm(tm[:4] + (0, 0)) + 3600
+    # every hour is skipped
+    return due
+
+def next_due(podcast):
+    """ The time at which podcast should next be polled, or None if it
+        hasn't been polled yet
+    """
+    if podcast.checked is None:
+        return None
+    due = podcast.checked + poll_interval(podcast, podcast.checked)
+    return skip(due, podcast.skip_hours or [], podcast.skip_days or [])
+
+def is_due(due, now):
+    return due is None or due <= now + EARLY
+
+def max_age(headers):
+    """ The max-age of an HTTP response from its Cache-Control header, or
+        None
+    """
+    for directive in headers.get('Cache-Control', '').split(','):
+        name, _, value = directive.strip().partition('=')
+        name = name.lower()
+        if name in ('no-cache', 'no-store'):
+            return None
+        if name == 'max-age':
+            try:
+                return max(int(value.strip('"')), 0)
+            except ValueError:
+                return None
+    return None
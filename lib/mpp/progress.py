@@ -0,0 +1,206 @@
+import json
+import shutil
+import sys
+import threading
+import time
+import mpp.timing
+
+# Download workers send progress events to the parent process through this
+# queue, which is set by the Pool initializer. Events are dicts with an
+# 'event' of start, progress, done or failed, the 'id' of the transfer
+# (<podcast url hash>/<media URL>) and a 'time'. It should be a multiprocessing.SimpleQueue,
+# which writes each event before put returns, so that events from a worker
+# arrive before the result of its task.
+_queue = None
+
+# seconds between progress events for one transfer
+PROGRESS_INTERVAL = 0.25
+
+def set_queue(q):
+    global _queue
+    _queue = q
+
+def report(event, id, **fields):
+    if _queue is not None:
+        fields.update({'event': event, 'id': id, 'time': time.time()})
+        _queue.put(fields)
+
+class Transfer():
+    __slots__ = ('title', 'size', 'offset', 'done', 'start', 'end', 'error')
+
+    def __init__(self, title, size, offset, start):
+        self.title = title
+        self.size = size
+        self.offset = offset
+        self.done = offset
+        self.start = start
+        self.end = None
+        self.error = None
+
+class ProgressReporter():
+    """ Collects progress events from download workers in a thread of the
+        parent process, and shows them in one of these modes:
+
+        text    a line when each download starts and finishes, and on a
+                terminal, a progress bar for each download with the total
+                rate and ETA underneath
+        json    each event as a line of JSON, for monitoring
+        none    nothing but the summary
+
+        A summary of the bytes, times and failures is shown by stop().
+    """
+    MODES = ('text', 'json', 'none')
+
+    def __init__(self, queue, mode='text', out=None, verbose=False):
+        if mode not in self.MODES:
+            raise Exception('unknown progress mode "%s" (should be one of: %s)' % (mode, ', '.join(self.MODES)))
+        self.queue = queue
+        self.mode = mode
+        self.out = out or sys.stdout
+        self.verbose = verbose
+        self.bars = mode == 'text' and self.out.isatty()
+        self.transfers = dict()
+        self.started = time.time()
+        self.lines = 0
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='progress', daemon=True)
+        self.ticker = threading.Thread(target=self._tick, name='progress-bars', daemon=True)
+
+    def start(self):
+        self.thread.start()
+        if self.bars:
+            self.ticker.start()
+        return self
+
+    def stop(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.stopped.set()
+        if self.bars:
+            self.ticker.join()
+        with self.lock:
+            self._clear()
+            self._summary()
+
+    def message(self, text):
+        """ Show a message from the parent process without disturbing the
+            progress bars
+        """
+        with self.lock:
+            if self.mode == 'json':
+                self._json({'event': 'message', 'text': text, 'time': time.time()})
+            else:
+                self._clear()
+                self.out.write(text + '\n')
+                self._draw()
+
+    def _run(self):
+        while True:
+            event = self.queue.get()
+            if event is None:
+                return
+            if event['event'] == 'timing':
+                mpp.timing.merge(event['samples'])
+                continue
+            with self.lock:
+                self._handle(event)
+
+    def _tick(self):
+        while not self.stopped.wait(PROGRESS_INTERVAL):
+            with self.lock:
+                self._clear()
+                self._draw()
+
+    def _handle(self, event):
+        id = event['id']
+        if event['event'] == 'start':
+            self.transfers[id] = Transfer(event['title'], event['size'], event['offset'], event['time'])
+        t = self.transfers.get(id)
+        if t is None:
+            # a transfer which failed or was already complete before it 
+            # started, so no bytes were transferred
+            t = self.transfers[id] = Transfer(event.get('title', id), 0, event.get('bytes', 0), event['time'])
+        if 'bytes' in event:
+            t.done = event['bytes']
+        if event['event'] in ('done', 'failed'):
+            t.end = event['time']
+            t.error = event.get('error')
+        if self.mode == 'json':
+            self._json(event)
+        elif self.mode == 'text' and event['event'] != 'progress' and not (self.bars and event['event'] == 'start'):
+            self._clear()
+            self.out.write(self._describe(event['event'], t) + '\n')
+            self._draw()
+        self.out.flush()
+
+    def _describe(self, event, t):
+        if event == 'start':
+            if t.offset > 0:
+                return 'Resuming %s : from %d of %s bytes' % (t.title, t.offset, t.size or '[unknown]')
+            return 'Downloading %s : %s bytes' % (t.title, t.size or '[unknown]')
+        elif event == 'done':
+            return 'Complete %s' % t.title
+        return 'Failed %s : %s' % (t.title, t.error)
+
+    def _json(self, d):
+        self.out.write(json.dumps(d) + '\n')
+        self.out.flush()
+
+    def _clear(self):
+        if self.lines > 0:
+            self.out.write('\x1b[%dA\x1b[J' % self.lines)
+            self.lines = 0
+
+    def _draw(self):
+        if not self.bars:
+            return
+        width = shutil.get_terminal_size().columns
+        active = [t for t in self.transfers.values() if t.end is None]
+        for t in active:
+            percent = t.done * 100.0 / t.size if t.size else 0
+            bar = '#' * int(percent / 5)
+            self.out.write(('[%-20s] %5.1f%% %s' % (bar, percent, t.title))[:width-1] + '\n')
+        self.out.write(self._totals()[:width-1] + '\n')
+        self.lines = len(active) + 1
+        self.out.flush()
+
+    def _totals(self):
+        now = time.time()
+        done = sum([t.done - t.offset for t in self.transfers.values()])
+        rate = done / max(now - self.started, 0.001)
+        remaining = sum([t.size - t.done for t in self.transfers.values() if t.end is None and t.size])
+        eta = '%ds' % (remaining / rate) if rate > 0 else '?'
+        return '%d active, %d done, %s at %s/s, ETA %s' % (
+                    len([1 for t in self.transfers.values() if t.end is None]),
+                    len([1 for t in self.transfers.values() if t.end is not None]),
+                    human_bytes(done), human_bytes(rate), eta)
+
+    def _summary(self):
+        elapsed = time.time() - self.started
+        finished = [t for t in self.transfers.values() if t.end is not None and t.error is None]
+        failed = [t for t in self.transfers.values() if t.error is not None]
+        done = sum([t.done - t.offset for t in self.transfers.values()])
+        if self.mode == 'json':
+            self._json({'event': 'summary', 'time': time.time(), 'downloaded': len(finished), 'failed': len(failed),
+                        'bytes': done, 'seconds': elapsed, 'rate': done / max(elapsed, 0.001),
+                        'transfers': [{'title': t.title, 'bytes': t.done - t.offset, 'seconds': (t.end or time.time()) - t.start,
+                                       'error': t.error} for t in self.transfers.values()]})
+            return
+        if len(self.transfers) == 0:
+            return
+        self.out.write('Downloaded %d episode%s, %s in %.1fs (%s/s)%s\n' % (
+                        len(finished), '' if len(finished) == 1 else 's', human_bytes(done), elapsed,
+                        human_bytes(done / max(elapsed, 0.001)), ', %d failed' % len(failed) if failed else ''))
+        if self.verbose:
+            for t in finished:
+                self.out.write('  %s : %s in %.1fs\n' % (t.title, human_bytes(t.done - t.offset), t.end - t.start))
+        for t in failed:
+            self.out.write('  FAILED %s : %s\n' % (t.title, t.error))
+        self.out.flush()
+
+def human_bytes(n):
+    for unit in ['B', 'kB', 'MB', 'GB']:
+        if n < 1024 or unit == 'GB':
+            return '%.1f %s' % (n, unit) if unit != 'B' else '%d B' % n
+        n /= 1024.0
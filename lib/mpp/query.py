@@ -0,0 +1,270 @@
+import fnmatch
+import functools
+import re
+from mpp.episode import since_timestamp
+
+# Filters on podcasts and episodes are written in a small query language,
+# and compiled once into a predicate:
+#
+#     word            the title contains word (ignoring case)
+#     "some words"    the title contains the phrase
+#     field:value     a field matches value, where value is a substring, a
+#                     glob (if it has any of *?[) matched against the whole
+#                     field, or a /regex/
+#     a b             both a and b (and may also be written between them)
+#     a or b          either a or b (also a | b)
+#     -a, not a       not a
+#     ( ... )         grouping
+#
+# Podcast fields are title and url. Episode fields are title, url (of the
+# media), podcast (the podcast's title), status (a comma separated list of
+# statuses), and since, before and date (a range like 2024-01-01..2024-06-30)
+# which compare the publish time. A filter of * matches everything. Words
+# with a colon but an unknown field name are taken as part of the title.
+#
+# A podcast filter with no field:value, "phrase" or /regex/ in it is the
+# title substring, as it always was, so that a podcast called "Not Another
+# Podcast" matches itself and "mpp rm 'not this'" can't remove the rest.
+
+PODCAST_FIELDS = ('title', 'url')
+EPISODE_FIELDS = ('title', 'url', 'podcast', 'status', 'since', 'before', 'date')
+
+STATI = ('new', 'skipped', 'downloaded', 'listened', 'any')
+
+_TOKEN = re.compile(r'''\s*(?:(?P<paren>[()|])|(?P<neg>-)?(?:(?P<field>[A-Za-z]+):)?(?P<value>"[^"]*"?|/(?:\\.|[^/\\])*/?|[^\s()|]+))''')
+
+# Title words are split into these tokens for the token index
+_WORD = re.compile(r'\w+')
+
+class QueryError(Exception):
+    pass
+
+def title_tokens(title):
+    return set(_WORD.findall((title or '').lower()))
+
+class Query():
+    """ A compiled filter. match(x) tests a podcast, index entry or episode
+        (with its podcast's title, for the podcast field).
+
+        candidates(lookup) uses a token index to narrow down the podcasts or
+        episodes which could match, where lookup(word) returns the set of
+        keys whose titles have a token containing word. It returns None if
+        the index can't help, for instance for a regex.
+
+        words are the title substrings which every match must contain, which
+        a database can use to select rows.
+    """
+    def __init__(self, text, fields, plain=False):
+        self.text = text
+        self.fields = fields
+        self.words = []
+        self._tokens = self._tokenize(text)
+        if plain and self._tokens and not any(self._structured(t) for t in self._tokens):
+            self._tokens = [(None, None, None, '"%s"' % text.strip())]
+        if len(self._tokens) == 0:
+            self._node = (lambda x, podcast: True, lambda lookup: None)
+        else:
+            self._node = self._or(top=True)
+            if self._tokens:
+                raise QueryError('unexpected "%s" in filter: %s' % (self._tokens[0][3] or self._tokens[0][0], text))
+
+    def match(self, x, podcast=None):
+        return self._node[0](x, podcast)
+
+    def candidates(self, lookup):
+        return self._node[1](lookup)
+
+    def _tokenize(self, text):
+        tokens = []
+        if text is None or text.strip() == '*':
+            return tokens
+        pos = 0
+        text = text.rstrip()
+        while pos < len(text):
+            m = _TOKEN.match(text, pos)
+            if m is None or m.end() == pos:
+                raise QueryError('cannot parse filter at "%s": %s' % (text[pos:], text))
+            pos = m.end()
+            field = m.group('field')
+            value = m.group('value')
+            if field is not None and field.lower() not in self.fields:
+                value = '%s:%s' % (field, value)
+                field = None
+            tokens.append((m.group('paren'), m.group('neg'), field and field.lower(), value))
+        return tokens
+
+    def _structured(self, token):
+        """ True for a field:value, "phrase" or /regex/ token """
+        paren, neg, field, value = token
+        if field is not None:
+            return True
+        return bool(value) and (value.startswith('"') or (len(value) > 1 and value.startswith('/') and value.endswith('/')))
+
+    def _peek_keyword(self):
+        if not self._tokens:
+            return None
+        paren, neg, field, value = self._tokens[0]
+        if paren:
+            return paren
+        if not neg and field is None and value.lower() in ('or', 'and', 'not'):
+            return value.lower()
+        return None
+
+    def _or(self, top=False):
+        nodes = [self._and(top)]
+        while self._peek_keyword() in ('or', '|'):
+            self._tokens.pop(0)
+            nodes.append(self._and(False))
+        if len(nodes) == 1:
+            return nodes[0]
+        if top:
+            # the words of the first alternative are not required
+            self.words = []
+        preds = [x[0] for x in nodes]
+        cands = [x[1] for x in nodes]
+        def candidates(lookup):
+            found = set()
+            for c in cands:
+                s = c(lookup)
+                if s is None:
+                    return None
+                found |= s
+            return found
+        return (lambda x, podcast: any(p(x, podcast) for p in preds), candidates)
+
+    def _and(self, top):
+        nodes = []
+        while self._tokens and self._peek_keyword() not in ('or', '|', ')'):
+            if self._peek_keyword() == 'and':
+                self._tokens.pop(0)
+                continue
+            nodes.append(self._unary(top))
+        if len(nodes) == 0:
+            raise QueryError('missing term in filter: %s' % self.text)
+        if len(nodes) == 1:
+            return nodes[0]
+        preds = [x[0] for x in nodes]
+        cands = [x[1] for x in nodes]
+        def candidates(lookup):
+            found = None
+            for c in cands:
+                s = c(lookup)
+                if s is not None:
+                    found = s if found is None else found & s
+            return found
+        return (lambda x, podcast: all(p(x, podcast) for p in preds), candidates)
+
+    def _unary(self, top):
+        keyword = self._peek_keyword()
+        if keyword == 'not':
+            self._tokens.pop(0)
+            return self._negate(self._unary(False))
+        if keyword == '(':
+            self._tokens.pop(0)
+            node = self._or()
+            if self._peek_keyword() != ')':
+                raise QueryError('missing ) in filter: %s' % self.text)
+            self._tokens.pop(0)
+            return node
+        paren, neg, field, value = self._tokens.pop(0)
+        if paren:
+            raise QueryError('unexpected "%s" in filter: %s' % (paren, self.text))
+        node = self._term(field or 'title', value, top and not neg)
+        return self._negate(node) if neg else node
+
+    def _negate(self, node):
+        pred = node[0]
+        return (lambda x, podcast: not pred(x, podcast), lambda lookup: None)
+
+    def _term(self, field, value, required):
+        if field == 'status':
+            stati = [s.strip().lower() for s in value.split(',') if s.strip()]
+            for s in stati:
+                if s not in STATI:
+                    raise QueryError('unknown status "%s" in filter (should be one of: %s)' % (s, ', '.join(STATI)))
+            return (lambda x, podcast: any(x.has_status(s) for s in stati), lambda lookup: None)
+        if field in ('since', 'before', 'date'):
+            start, end = None, None
+            if field == 'since':
+                start = value
+            elif field == 'before':
+                end = value
+            else:
+                start, _, end = value.partition('..')
+            start = date_timestamp(start, field) if start else None
+            end = date_timestamp(end, field) if end else None
+            def in_range(x, podcast):
+                ts = x.published_ts or 0
+                return (start is None or ts >= start) and (end is None or ts < end)
+            return (in_range, lambda lookup: None)
+        match = text_matcher(value)
+        if field == 'title':
+            get = lambda x, podcast: x.title
+        elif field == 'url':
+            get = lambda x, podcast: getattr(x, 'media_url', None) or getattr(x, 'url', None)
+        else:
+            get = lambda x, podcast: podcast.title if podcast is not None else None
+        candidates = lambda lookup: None
+        if field == 'title' and match.word is not None:
+            if required:
+                self.words.append(match.word)
+            word = match.word.lower()
+            if _WORD.fullmatch(word):
+                candidates = lambda lookup: lookup(word)
+        return (lambda x, podcast: match(get(x, podcast) or ''), candidates)
+
+def text_matcher(value):
+    """ Returns a function testing a string against a query value, with the
+        substring it looks for as its word attribute (None for a glob or
+        regex)
+    """
+    word = None
+    if len(value) > 1 and value.startswith('/') and value.endswith('/'):
+        try:
+            match = re.compile(value[1:-1], re.I).search
+        except re.error as e:
+            raise QueryError('bad regex %s in filter: %s' % (value, e))
+    elif value.startswith('"'):
+        word = value.strip('"').lower()
+        match = lambda s: word in s.lower()
+    elif any([c in value for c in '*?[']):
+        match = re.compile(fnmatch.translate(value), re.I).match
+    else:
+        word = value.lower()
+        match = lambda s: word in s.lower()
+    def matcher(s):
+        return bool(match(s))
+    matcher.word = word
+    return matcher
+
+@functools.lru_cache(maxsize=64)
+def podcast_query(text):
+    return Query(text, PODCAST_FIELDS, plain=True)
+
+def date_timestamp(value, name):
+    """ since_timestamp, raising QueryError for a date which can't be
+        parsed
+    """
+    try:
+        return since_timestamp(value)
+    except (ValueError, OverflowError) as e:
+        raise QueryError('invalid date "%s" for %s: %s' % (value, name, e))
+
+@functools.lru_cache(maxsize=64)
+def episode_query(text, stati=None, since=None):
+    """ The query for an episode filter, combined with the --status and
+        --since options (stati should be a tuple)
+    """
+    q = Query(text, EPISODE_FIELDS)
+    if stati is None and since is None:
+        return q
+    pred = q._node[0]
+    start = date_timestamp(since, '--since') if since else None
+    def match(x, podcast):
+        if stati is not None and not any(x.has_status(s) for s in stati):
+            return False
+        if start is not None and (x.published_ts or 0) < start:
+            return False
+        return pred(x, podcast)
+    q._node = (match, q._node[1])
+    return q
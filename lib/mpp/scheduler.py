@@ -0,0 +1,159 @@
+import queue
+import time
+import urllib.parse
+from mpp.logger import log
+
+ORDERS = ('newest', 'round-robin')
+
+class DownloadScheduler():
+    """ Hands out (podcast, episode, args) download tasks to a Pool one at a
+        time, as earlier transfers finish, so that a slow host only holds up
+        its own downloads. Tasks are started in order (newest episodes
+        first, or taking the newest from each podcast in turn), skipping
+        tasks for hosts which already have per_host downloads running.
+
+        Tasks may be added while run() is in progress, and run() returns
+        once close() has been called and all the tasks are done.
+    """
+    def __init__(self, per_host=2, order='newest'):
+        if order not in ORDERS:
+            raise Exception('unknown download order "%s" (should be one of: %s)' % (order, ', '.join(ORDERS)))
+        self.per_host = per_host
+        self.order = order
+        self.pending = []
+        self.active = dict()
+        self.events = queue.Queue()
+        self.closed = False
+
+    def add(self, tasks):
+        self.pending = order_tasks(self.pending + list(tasks), self.order)
+
+    def close(self):
+        self.closed = True
+
+    def call_soon(self, func, *args):
+        """ Have func(*args) called by the thread running run(). This is how
+            other threads add tasks or close the scheduler.
+        """
+        self.events.put((func, args))
+
+    def drain(self):
+        """ Call any functions still waiting from call_soon, for use if run()
+            has stopped early. Results of downloads are dropped.
+        """
+        while not self.events.empty():
+            f, args = self.events.get()
+            if f is not None:
+                f(*args)
+
+    def next_task(self):
+        """ Removes and returns the first pending task for a host which is
+            below its limit, or None
+        """
+        for i, task in enumerate(self.pending):
+            host = task_host(task)
+            if self.active.get(host, 0) < self.per_host:
+                self.active[host] = self.active.get(host, 0) + 1
+                return self.pending.pop(i)
+        return None
+
+    def run(self, pool, func, parallel):
+        """ Runs func on each task in pool, with at most parallel running at
+            once, yielding the results as they complete
+        """
+        running = 0
+        while True:
+            while running < parallel:
+                task = self.next_task()
+                if task is None:
+                    break
+                log.debug('DownloadScheduler.run() starting %s' % task[1].media_url)
+                pool.apply_async(func, (task,),
+                                 callback=lambda r, task=task: self.events.put((None, (task, r))),
+                                 error_callback=lambda e, task=task: self.events.put((None, (task, e))))
+                running += 1
+            if running == 0 and self.closed:
+                break
+            f, args = self.events.get()
+            if f is not None:
+                try:
+                    f(*args)
+                except Exception as e:
+                    log.exception('DownloadScheduler.run() error in %s: %s' % (f, e))
+                continue
+            task, result = args
+            running -= 1
+            self.active[task_host(task)] -= 1
+            if isinstance(result, BaseException):
+                log.error('DownloadScheduler.run() %s failed: %s' % (task[1].media_url, result))
+                result = (task[0].url_hash(), task[1].media_url, None)
+            yield result
+
+def order_tasks(tasks, order):
+    newest = sorted(tasks, key=lambda t: t[1].published_ts or 0, reverse=True)
+    if order == 'newest':
+        return newest
+    # round-robin: the newest episode of each podcast, then the next newest
+    # of each, and so on
+    by_podcast = dict()
+    for task in newest:
+        by_podcast.setdefault(task[0].url, []).append(task)
+    ordered = []
+    for i in range(max([len(x) for x in by_podcast.values()] or [0])):
+        ordered.extend([x[i] for x in by_podcast.values() if i < len(x)])
+    return ordered
+
+def task_host(task):
+    return urllib.parse.urlparse(task[1].media_url).netloc.lower()
+
+class Throttle():
+    """ A token bucket limiting the total rate of downloads across worker
+        processes to rate bytes/second. It must be created before the Pool,
+        and passed to the workers with set_throttle.
+    """
+    def __init__(self, rate):
+        import multiprocessing
+        self.rate = float(rate)
+        self.lock = multiprocessing.Lock()
+        self.allowance = multiprocessing.Value('d', self.rate, lock=False)
+        self.last = multiprocessing.Value('d', time.monotonic(), lock=False)
+
+    def consume(self, count):
+        """ Take count bytes from the bucket, sleeping if it is overdrawn """
+        with self.lock:
+            now = time.monotonic()
+            allowance = min(self.allowance.value + (now - self.last.value) * self.rate, self.rate)
+            allowance -= count
+            self.allowance.value = allowance
+            self.last.value = now
+        if allowance < 0:
+            time.sleep(-allowance / self.rate)
+
+_throttle = None
+
+def set_throttle(throttle):
+    """ Pool initializer which sets the throttle used by the worker """
+    global _throttle
+    _throttle = throttle
+
+def throttle(count):
+    if _throttle is not None:
+        _throttle.consume(count)
+
+def parse_rate(s):
+    """ Returns bytes/second from a string like 500k or 2.5M. Used as the 
+        type of --rate arguments, so a bad rate is reported by argparse.
+    """
+    from argparse import ArgumentTypeError
+    multipliers = {'k': 1024, 'm': 1024**2, 'g': 1024**3}
+    value = s.strip().lower()
+    try:
+        if value and value[-1] in multipliers:
+            rate = float(value[:-1]) * multipliers[value[-1]]
+        else:
+            rate = float(value)
+    except ValueError:
+        raise ArgumentTypeError('invalid rate: %s (should be bytes/second, e.g. 500k or 2M)' % s)
+    if not rate > 0:
+        raise ArgumentTypeError('invalid rate: %s (should be more than 0)' % s)
+    return rate
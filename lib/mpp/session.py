@@ -0,0 +1,56 @@
+import os
+import threading
+import mpp.config
+from mpp.logger import log
+
+# One requests Session per process, shared by the threads in that process,
+# so that keep-alive connections are re-used for feeds and downloads from
+# the same host. The session is re-created in forked worker processes.
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+def config_value(name, default, convert=int):
+    return convert(mpp.config.config.get(name, default))
+
+def get_session():
+    global _session, _session_pid
+    with _session_lock:
+        if _session is None or _session_pid != os.getpid():
+            _session = make_session()
+            _session_pid = os.getpid()
+        return _session
+
+def make_session():
+    """ Make a Session with connection pooling and retries, configured with
+        these config file settings:
+
+        http_connections_per_host   connections kept per host (default 4)
+        http_retries                retries for failed requests (default 3)
+        http_backoff                backoff factor between retries (default 0.5)
+    """
+    # requests is slow to import, and not needed by most commands
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+    per_host = config_value('http_connections_per_host', 4)
+    log.debug('make_session(pid=%d, connections_per_host=%d)' % (os.getpid(), per_host))
+    retries = Retry(total=config_value('http_retries', 3),
+                    backoff_factor=config_value('http_backoff', 0.5, float),
+                    status_forcelist=(429, 500, 502, 503, 504),
+                    allowed_methods=frozenset(['GET', 'HEAD']),
+                    raise_on_status=False)
+    # pool_block means no more than per_host connections are made to one
+    # host, even with many threads
+    adapter = HTTPAdapter(pool_connections=32, pool_maxsize=per_host, pool_block=True, max_retries=retries)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def get(url, **kwargs):
+    """ requests.get using the shared session. The timeout in seconds is
+        taken from the http_timeout config file setting (default 30)
+    """
+    kwargs.setdefault('timeout', config_value('http_timeout', 30, float))
+    return get_session().get(url, **kwargs)
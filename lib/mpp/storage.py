@@ -0,0 +1,95 @@
+import json
+import os
+import tempfile
+from mpp.util import log
+
+class JsonStorage():
+    """ Podcasts saved as compact JSON """
+    name = 'json'
+    extension = '.json'
+
+    def dumps(self, d):
+        return json.dumps(d, separators=(',', ':')).encode('utf-8')
+
+    def loads(self, data):
+        return json.loads(data.decode('utf-8'))
+
+class MsgpackStorage():
+    """ Podcasts saved as msgpack, which is smaller and quicker to encode and
+        decode than JSON. Requires the msgpack python module.
+    """
+    name = 'msgpack'
+    extension = '.mpk'
+
+    def _msgpack(self):
+        try:
+            import msgpack
+        except ImportError:
+            raise Exception('the msgpack feed_format requires the msgpack python module (pip3 install msgpack)')
+        return msgpack
+
+    def dumps(self, d):
+        return self._msgpack().packb(d, use_bin_type=True)
+
+    def loads(self, data):
+        return self._msgpack().unpackb(data, raw=False)
+
+STORAGE = {x.name: x for x in [JsonStorage(), MsgpackStorage()]}
+
+def storage_named(name):
+    if name not in STORAGE:
+        raise Exception('unknown feed_format "%s" (should be one of: %s)' % (name, ', '.join(sorted(STORAGE.keys()))))
+    return STORAGE[name]
+
+def storage_for_path(path):
+    """ Choose the storage for a file from its extension """
+    for storage in STORAGE.values():
+        if path.endswith(storage.extension):
+            return storage
+    raise Exception('unknown feed file type: %s' % path)
+
+def extensions():
+    return [x.extension for x in STORAGE.values()]
+
+def atomic_write(path, data):
+    """ Write data to a temporary file in the same directory as path, sync it
+        to disk and rename it over path, so that path always contains either
+        the old or the new data, even if we crash part way through.
+    """
+    directory = os.path.dirname(path) or '.'
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.%s.' % os.path.basename(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        # mkstemp creates files readable only by the owner
+        os.chmod(tmp_path, file_mode(path))
+        os.replace(tmp_path, path)
+    except:
+        os.unlink(tmp_path)
+        raise
+    try:
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    except OSError as e:
+        log.debug('atomic_write(%s) could not sync directory: %s' % (path, e))
+
+def _umask():
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+# os.umask can only be read by changing it for the whole process, which
+# would affect files created by other threads, so it is read once here
+UMASK = _umask()
+
+def file_mode(path):
+    """ The mode of the existing file at path, or the mode of a new file """
+    try:
+        return os.stat(path).st_mode & 0o7777
+    except FileNotFoundError:
+        return 0o666 & ~UMASK
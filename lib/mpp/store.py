@@ -0,0 +1,165 @@
+import errno
+import fcntl
+import hashlib
+import os
+import urllib.parse
+from contextlib import contextmanager
+from mpp.logger import log
+
+# Downloaded media are kept once in a store in audio_directory/.store,
+# and linked into the directory of each podcast which has the episode, so an
+# episode in several feeds is only downloaded once, and takes no extra disk
+# space:
+#
+#   .store/sha256/cd/<sha256 of content><ext>       the media, once for
+#                                                   each content
+#   .store/url/ab/<sha1 of normalised url><ext>     a symlink to the
+#                                                   content of each url
+#
+# Links into podcast directories are hard links, so content with only one
+# link is not in any podcast directory and can be removed. Where hard links
+# can't be made symlinks are used, and the content is marked to be kept.
+
+STORE_DIR = '.store'
+
+def normalise_url(url):
+    """ The url with the scheme and host in lower case, without a default
+        port or fragment
+    """
+    parts = urllib.parse.urlsplit(url)
+    netloc = parts.netloc.lower()
+    if (parts.scheme.lower(), parts.port) in (('http', 80), ('https', 443)):
+        netloc = netloc.rsplit(':', 1)[0]
+    return urllib.parse.urlunsplit((parts.scheme.lower(), netloc, parts.path, parts.query, ''))
+
+def extension(url):
+    ext = os.path.splitext(urllib.parse.urlsplit(url).path)[1]
+    return ext if 0 < len(ext) <= 8 else ''
+
+def url_path(audio_dir, url):
+    """ The path of the store object for a media url """
+    h = hashlib.sha1(normalise_url(url).encode('utf-8')).hexdigest()
+    return os.path.join(audio_dir, STORE_DIR, 'url', h[:2], h + extension(url))
+
+def content_path(audio_dir, digest, ext):
+    return os.path.join(audio_dir, STORE_DIR, 'sha256', digest[:2], digest + ext)
+
+@contextmanager
+def locked(path):
+    """ Hold an exclusive lock on path + '.lock', so that only one process
+        downloads a url at a time
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.lock', 'w') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def file_digest(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024*1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def add(audio_dir, url, path):
+    """ Move a downloaded file at path into the store as the content for
+        url. If the store already has the same content, the file is removed
+        and url refers to that instead. Returns the path of the content.
+    """
+    content = content_path(audio_dir, file_digest(path), extension(url))
+    os.makedirs(os.path.dirname(content), exist_ok=True)
+    if os.path.exists(content):
+        log.debug('store.add() %s has the same content as %s' % (url, content))
+        os.unlink(path)
+    else:
+        os.replace(path, content)
+    obj = url_path(audio_dir, url)
+    tmp = obj + '.link'
+    if os.path.lexists(tmp):
+        os.unlink(tmp)
+    os.symlink(os.path.relpath(content, os.path.dirname(obj)), tmp)
+    os.replace(tmp, obj)
+    return content
+
+def content_for(audio_dir, url):
+    """ The path of the content stored for url, or None """
+    obj = url_path(audio_dir, url)
+    if os.path.exists(obj):
+        return os.path.realpath(obj)
+    return None
+
+# errors from os.link which mean hard links can't be made there
+NO_HARD_LINKS = (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP, errno.EOPNOTSUPP)
+
+def link(content, path):
+    """ Link stored content into a podcast directory at path """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        os.link(content, path)
+    except OSError as e:
+        if e.errno not in NO_HARD_LINKS:
+            raise
+        log.debug('store.link() cannot hard link %s, using a symlink: %s' % (path, e))
+        open(content + '.keep', 'w').close()
+        os.symlink(os.path.abspath(content), path)
+
+def link_into(audio_dir, url, content, directory, basename, stored=True):
+    """ Link the content stored for url into a podcast directory, with the
+        path chosen by podcast_path, and return the path. The path is chosen
+        and linked while holding a lock on the directory, as downloads of
+        other urls with the same basename may be finishing at the same time.
+    """
+    # the lock is directory/.lock
+    with locked(os.path.join(directory, '')):
+        for attempt in range(3):
+            path = podcast_path(audio_dir, url, directory, basename, stored)
+            if stored and linked(content, path):
+                return path
+            try:
+                link(content, path)
+                return path
+            except FileExistsError:
+                # made by a process which doesn't take the lock
+                log.debug('store.link_into() %s was created while linking' % path)
+        raise FileExistsError(errno.EEXIST, 'cannot find a free path for %s' % url, os.path.join(directory, basename))
+
+def linked(obj, path):
+    """ True if path is a link to the same file as obj """
+    try:
+        return os.path.samefile(obj, path)
+    except OSError:
+        return False
+
+def podcast_path(audio_dir, url, directory, basename, stored=True):
+    """ The path in a podcast's directory for the media at url. If a
+        different file already has the episode's basename, the path has part
+        of the url hash added to it. stored is False if url has only just 
+        been added to the store, so no file in the directory is its link,
+        even one with the same content.
+    """
+    path = os.path.join(directory, basename)
+    obj = url_path(audio_dir, url)
+    if not os.path.lexists(path) or (stored and linked(obj, path)):
+        return path
+    stem, ext = os.path.splitext(basename)
+    return os.path.join(directory, '%s-%s%s' % (stem, os.path.basename(obj)[:8], ext))
+
+def release(audio_dir, url):
+    """ Remove the content stored for url if it is no longer linked into
+        any podcast directory. Content linked with symlinks is kept.
+    """
+    obj = url_path(audio_dir, url)
+    if not os.path.lexists(obj):
+        return
+    content = os.path.realpath(obj)
+    if os.path.exists(content) and (os.stat(content).st_nlink > 1 or os.path.exists(content + '.keep')):
+        return
+    log.debug('store.release() removing %s' % content)
+    os.unlink(obj)
+    if os.path.exists(obj + '.lock'):
+        os.unlink(obj + '.lock')
+    if os.path.exists(content):
+        os.unlink(content)
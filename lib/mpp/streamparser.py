@@ -0,0 +1,164 @@
+import logging
+import mpp.podcast
+import mpp.polling
+from mpp.episode import Episode, parse_timestamp
+from mpp.timing import timed
+from mpp.util import log
+
+# Stop reading a feed after this many consecutive items which are already
+# known, as long as the feed lists items newest first
+KNOWN_RUN = 5
+
+CHUNK_SIZE = 1024*64
+
+MEDIA_NS = '{http://search.yahoo.com/mrss/}'
+FEEDBURNER_NS = '{http://rssnamespace.org/feedburner/ext/1.0}'
+ATOM_NS = '{http://www.w3.org/2005/Atom}'
+
+# elements of an RSS channel which say when to poll it
+CHANNEL_HINTS = ('ttl', 'skipHours', 'skipDays')
+
+class NotStreamable(Exception):
+    """ Raised for feeds which parse_new_episodes does not handle, in which
+        case the full feedparser parse should be used
+    """
+    pass
+
+@timed('parse_new_episodes')
+def parse_new_episodes(data, podcast, known_run=KNOWN_RUN, hints=None):
+    """ Parse RSS or Atom feed data incrementally, item by item, returning a
+        list of the episodes which are not already in podcast. Items are
+        discarded as soon as they have been looked at, and parsing stops
+        once known_run known items in a row have been seen in a feed which
+        is in newest first order.
+
+        If hints is a dict, the channel's <ttl>, <skipHours> and <skipDays>
+        which come before the point where parsing stops are added to it (see
+        channel_hints). If the whole channel is parsed, those it doesn't
+        have are added as None or [], so hints only lacks those which
+        parsing stopped before.
+
+        Raises NotStreamable if the feed cannot be handled this way.
+    """
+    import xml.etree.ElementTree as ET
+    log.log(logging.DEBUG-1, 'parse_new_episodes(%s)' % podcast.url)
+    parser = ET.XMLPullParser(events=('start', 'end'))
+    new = []
+    known = 0
+    newest_first = True
+    previous_ts = None
+    count = 0
+    stack = []
+    try:
+        for i in range(0, len(data), CHUNK_SIZE):
+            parser.feed(data[i:i+CHUNK_SIZE])
+            for event, elem in parser.read_events():
+                if event == 'start':
+                    stack.append(elem)
+                    continue
+                stack.pop()
+                if hints is not None and elem.tag in CHANNEL_HINTS and stack and stack[-1].tag == 'channel':
+                    hints.update(channel_hints(elem))
+                if hints is not None and elem.tag == 'channel':
+                    for k, v in (('ttl', None), ('skip_hours', []), ('skip_days', [])):
+                        hints.setdefault(k, v)
+                if elem.tag not in ('item', ATOM_NS + 'entry'):
+                    continue
+                episode = episode_from_element(elem)
+                # drop the item from the tree, so memory use depends on the
+                # number of items looked at, not the size of the feed
+                if stack:
+                    stack[-1].remove(elem)
+                count += 1
+                if previous_ts is not None and episode.published_ts is not None and episode.published_ts > previous_ts:
+                    newest_first = False
+                previous_ts = episode.published_ts
+                if podcast.find_episode(episode) is None:
+                    new.append(episode)
+                    known = 0
+                else:
+                    known += 1
+                    if known >= known_run and newest_first:
+                        log.debug('parse_new_episodes(%s) stopped after %d items' % (podcast.url, count))
+                        return new
+        parser.close()
+    except ET.ParseError as e:
+        raise NotStreamable('XML parse error: %s' % e)
+    if count == 0:
+        raise NotStreamable('no items found')
+    log.debug('parse_new_episodes(%s) parsed all %d items' % (podcast.url, count))
+    return new
+
+class KnownEpisodes():
+    """ The media urls and title keys of the episodes of a podcast, which 
+        stand in for the podcast in parse_new_episodes, so that it can run in
+        another process without pickling the podcast's episodes
+    """
+    def __init__(self, podcast):
+        self.url = podcast.url
+        self.media_urls = set([e.media_url for e in podcast.episodes])
+        self.title_keys = set([e.title_key() for e in podcast.episodes])
+
+    def find_episode(self, episode):
+        if episode.media_url in self.media_urls or episode.title_key() in self.title_keys:
+            return episode
+        return None
+
+def parse_with_hints(data, known, known_run=KNOWN_RUN):
+    """ parse_new_episodes for a worker process, returning the new episodes
+        and the channel's hints
+    """
+    hints = dict()
+    return parse_new_episodes(data, known, known_run, hints), hints
+
+def episode_from_element(elem):
+    """ Make an Episode from an RSS <item> or Atom <entry> element, choosing
+        the media URL in the same way as get_media_url_for_entry
+    """
+    title = text_of(elem, ('title', ATOM_NS + 'title'))
+    published = text_of(elem, ('pubDate', ATOM_NS + 'published', ATOM_NS + 'updated'))
+    if title is None or published is None:
+        raise NotStreamable('item without a title or date')
+    candidate_urls = [x.get('url') for x in elem.iter(MEDIA_NS + 'content') if x.get('url')]
+    candidate_urls += [x.text.strip() for x in elem.iter(FEEDBURNER_NS + 'origEnclosureLink') if x.text]
+    link = None
+    for child in elem:
+        if child.tag == 'enclosure' and child.get('url'):
+            candidate_urls.append(child.get('url'))
+        elif child.tag == ATOM_NS + 'link' and child.get('href'):
+            candidate_urls.append(child.get('href'))
+            if child.get('rel', 'alternate') == 'alternate':
+                link = child.get('href')
+        elif child.tag == 'link' and child.text:
+            candidate_urls.append(child.text.strip())
+            link = child.text.strip()
+    if link is not None:
+        candidate_urls.append(link)
+    media_url = None
+    for url in candidate_urls:
+        if mpp.podcast.is_valid_media_url(url):
+            media_url = url
+            break
+    return Episode(title, media_url, published, published_ts=parse_timestamp(published))
+
+def channel_hints(elem):
+    """ The hints about when to poll a feed in a <ttl>, <skipHours> or
+        <skipDays> element of an RSS channel, as ttl (minutes), skip_hours
+        (0-23 GMT) and skip_days (as in mpp.polling.DAYS)
+    """
+    if elem.tag == 'ttl':
+        ttl = mpp.podcast.parse_ttl(elem.text)
+        return {} if ttl is None else {'ttl': ttl}
+    if elem.tag == 'skipHours':
+        hours = [x.text.strip() for x in elem.findall('hour') if x.text]
+        # some feeds count the hours from 1 to 24
+        return {'skip_hours': sorted(set([int(x) % 24 for x in hours if x.isdigit()]))}
+    days = [x.text.strip().capitalize() for x in elem.findall('day') if x.text]
+    return {'skip_days': [x for x in mpp.polling.DAYS if x in days]}
+
+def text_of(elem, tags):
+    for tag in tags:
+        child = elem.find(tag)
+        if child is not None and child.text:
+            return child.text.strip()
+    return None
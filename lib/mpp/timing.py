@@ -0,0 +1,101 @@
+import functools
+import sys
+import time
+from contextlib import contextmanager
+
+# Durations in seconds of each timed phase, recorded only when enabled (by
+# mpp --profile), so that the spans cost almost nothing otherwise.
+enabled = False
+_samples = dict()
+
+def enable():
+    global enabled
+    enabled = True
+
+def record(name, seconds):
+    _samples.setdefault(name, []).append(seconds)
+
+@contextmanager
+def span(name):
+    if not enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+def timed(name):
+    """ Decorator which records the time taken by each call as name """
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(name, time.perf_counter() - start)
+        return wrapper
+    return decorate
+
+# Worker processes are forked with a copy of the parent's samples, so they
+# start each task with none, and send back just the samples for that task,
+# which the parent adds to its own with merge.
+
+def reset():
+    _samples.clear()
+
+def take():
+    """ Returns and clears the samples recorded so far """
+    samples = dict(_samples)
+    _samples.clear()
+    return samples
+
+def merge(samples):
+    for name, values in samples.items():
+        _samples.setdefault(name, []).extend(values)
+
+def collected(func, *args):
+    """ Run func(*args) in a worker process, returning (result, samples) """
+    reset()
+    return func(*args), take()
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[int(round(p * (len(values) - 1)))]
+
+def report():
+    """ Returns a table of the count, total and p50/p95 times of each phase """
+    from prettytable import PrettyTable
+    t = PrettyTable(['Phase', 'Count', 'Total (s)', 'p50 (ms)', 'p95 (ms)'])
+    t.align = 'r'
+    t.align['Phase'] = 'l'
+    for name, values in sorted(_samples.items(), key=lambda x: sum(x[1]), reverse=True):
+        t.add_row([name, len(values), '%.3f' % sum(values),
+                   '%.3f' % (percentile(values, 0.5) * 1000), '%.3f' % (percentile(values, 0.95) * 1000)])
+    return t.get_string()
+
+@contextmanager
+def profiled(path=None):
+    """ Time the phases of the enclosed code, printing a report at the end,
+        and if path is given, also run it under cProfile, saving the stats
+        to path (for use with python -m pstats)
+    """
+    enable()
+    profiler = None
+    if path is not None:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record('total', time.perf_counter() - start)
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(path)
+        print(report(), file=sys.stderr)
@@ -0,0 +1,78 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from urllib.parse import urlparse
+from mpp.podcast import fetch_feed, parse_feed
+from mpp.streamparser import parse_with_hints, KnownEpisodes, NotStreamable
+from mpp.timing import collected, merge
+from mpp.util import log
+
+class FeedUpdater():
+    """ Updates many feeds at once using an asyncio event loop.
+
+        HTTP requests are made in a pool of threads, with at most 
+        connections requests in flight, and at most per_host requests to any
+        one host. Changed feeds are parsed in a small pool of processes, with
+        the incremental parser given the keys of the podcast's episodes, or 
+        if it can't handle the feed, with feedparser. The new episodes are 
+        merged into the Podcast objects in the calling process, so the event
+        loop is not held up by parsing, and only the new feed data is 
+        pickled.
+        
+        callback(podcast, new_count, changed) is called in the calling
+        process as each feed completes. changed is True if the podcast has 
+        been modified and should be saved.
+    """
+    def __init__(self, connections=32, per_host=4, parsers=2):
+        self.connections = connections
+        self.per_host = per_host
+        self.parsers = parsers
+
+    def run(self, podcasts, callback):
+        log.debug('FeedUpdater.run(%d podcasts, connections=%d, per_host=%d, parsers=%d)' % (
+                    len(podcasts), self.connections, self.per_host, self.parsers))
+        if len(podcasts) == 0:
+            return
+        with ThreadPoolExecutor(self.connections) as fetchers, \
+             ProcessPoolExecutor(self.parsers) as parsers:
+            loop = asyncio.new_event_loop()
+            try:
+                loop.run_until_complete(self._update_all(podcasts, callback, fetchers, parsers))
+            finally:
+                loop.close()
+
+    async def _update_all(self, podcasts, callback, fetchers, parsers):
+        self._limit = asyncio.Semaphore(self.connections)
+        self._host_limits = dict()
+        await asyncio.gather(*[self._update(p, callback, fetchers, parsers) for p in podcasts])
+
+    def _host_limit(self, url):
+        host = urlparse(url).netloc.lower()
+        if host not in self._host_limits:
+            self._host_limits[host] = asyncio.Semaphore(self.per_host)
+        return self._host_limits[host]
+
+    async def _update(self, podcast, callback, fetchers, parsers):
+        loop = asyncio.get_event_loop()
+        try:
+            async with self._host_limit(podcast.url), self._limit:
+                r = await loop.run_in_executor(fetchers, fetch_feed, podcast.url, podcast.etag, podcast.modified)
+            validators = podcast.cache_validators()
+            new = 0
+            # the content of a large feed takes a while to hash
+            content_hash = await loop.run_in_executor(fetchers, podcast.check_response, r)
+            if content_hash is not None:
+                try:
+                    (parsed, hints), samples = await loop.run_in_executor(parsers, collected, parse_with_hints, r.content, KnownEpisodes(podcast))
+                    merge(samples)
+                    new = podcast.add_new_episodes(parsed)
+                    podcast.set_hints(hints)
+                except NotStreamable as e:
+                    log.debug('FeedUpdater._update(%s) using feedparser: %s' % (podcast.title, e))
+                    parsed, samples = await loop.run_in_executor(parsers, collected, parse_feed, r.content, podcast.url)
+                    merge(samples)
+                    new = podcast.update_from_podcast(parsed)
+                podcast.content_hash = content_hash
+            log.debug('FeedUpdater._update(%s) %d new episodes' % (podcast.title, new))
+            callback(podcast, new, new > 0 or podcast.cache_validators() != validators)
+        except Exception as e:
+            log.warning('Failed to update %s: %s/%s' % (podcast.title, type(e), e))
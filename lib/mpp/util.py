@@ -1,11 +1,22 @@
 import logging
-import requests
 import mpp.config 
+import mpp.session
+import mpp.scheduler
+import mpp.progress
+import mpp.store
+import mpp.timing
 import os
 import re
 import sys
+import time
+from mpp.logger import log
 
-log = logging.getLogger('mpp')
+# Listings of media directories, so that checking whether many media files 
+# exist costs one listdir per directory rather than one stat per file. 
+# media_generation is incremented when the cache is cleared, which also
+# invalidates the status cached by each Episode.
+_media_listings = dict()
+media_generation = 0
 
 def confirm(prompt='Confirm?', def_yes=False):
     if def_yes:
@@ -25,70 +36,168 @@ def confirm(prompt='Confirm?', def_yes=False):
         if resp.lower() == 'n':
             return False
 
-def update_and_save_podcast(p, args):
-    log.debug('update_and_save_podcast(%s) starting' % p.title)
+def media_exists(path):
+    """ Equivalent to os.path.exists for media files, but answered from a 
+        cached listing of the directory containing path
+    """
+    directory, name = os.path.split(path)
+    if directory not in _media_listings:
+        log.log(logging.DEBUG-1, 'media_exists() listing %s' % directory)
+        try:
+            _media_listings[directory] = set(os.listdir(directory))
+        except OSError:
+            _media_listings[directory] = set()
+    return name in _media_listings[directory]
+
+def media_created(path):
+    directory, name = os.path.split(path)
+    if directory in _media_listings:
+        _media_listings[directory].add(name)
+
+def media_removed(path):
+    directory, name = os.path.split(path)
+    if directory in _media_listings:
+        _media_listings[directory].discard(name)
+
+def forget_media():
+    """ Clear the cached directory listings and episode statuses, for 
+        example when media files may have been changed by another program
+    """
+    global media_generation
+    _media_listings.clear()
+    media_generation += 1
+
+def init_download_worker(throttle, progress_queue):
+    """ Pool initializer for download workers """
+    mpp.scheduler.set_throttle(throttle)
+    mpp.progress.set_queue(progress_queue)
+
+def download_task(task):
+    """ Pool wrapper for download_podcast_episode, which 
+        takes a (podcast, episode, args) tuple. The timings for the task
+        are sent to the parent process with the progress events.
+    """
+    mpp.timing.reset()
     try:
-        new = p.update()
-        log.debug('update_and_save_podcast(%s) %d new episodes' % (p.title, new))
-        if args.verbose:
-            print('%d new episode%s for %s' % (new, '' if new == 1 else 's', p.title))
-        if new > 0:
-            log.debug('update_and_save_podcast(%s) saving' % p.title)
-            p.save()
-    except Exception as e:
-        log.warning('Failed to update %s: %s/%s' % (p.title, type(e), e))
-    
+        return download_podcast_episode(*task)
+    finally:
+        if mpp.timing.enabled:
+            mpp.progress.report('timing', None, samples=mpp.timing.take())
+
+@mpp.timing.timed('download_podcast_episode')
 def download_podcast_episode(podcast=None, episode=None, args=None):
-    """ download an episode and save the podcast item
-        podcast_episode is a tuple (podcast, episode)
-        return True if the episode was downloaded successfully, else False
+    """ download an episode. The podcast is not modified or saved here -
+        instead the result is sent back to the calling process, which is
+        the single writer for the Podcast objects.
+        return a tuple (podcast url hash, episode media_url, media_path),
+        where media_path is None if the episode was not downloaded
     """
+    failed = (podcast.url_hash(), episode.media_url, None)
+    title = '%s / %s' % (podcast.title, episode.title)
+    # the same url may be downloaded for more than one podcast at once
+    id = '%s/%s' % (podcast.url_hash(), episode.media_url)
+    audio_dir = mpp.config.config['audio_directory']
     try:
-        path = '%s/%s/%s' % ( mpp.config.config['audio_directory'], 
-                                 podcast.url_hash(), 
-                                 episode.url_basename() )
-        log.debug('download_episode((%s / %s)) starting -> %s' % (podcast.title, episode.title, path))
+        directory = os.path.join(audio_dir, podcast.url_hash())
+        basename = episode.url_basename()
+        obj = mpp.store.url_path(audio_dir, episode.media_url)
+        log.debug('download_episode((%s / %s)) starting -> %s' % (podcast.title, episode.title, obj))
     except Exception as e:
         log.exception('download_podcast_episode: %s : %s' % (type(e), e))
-        return False
-    # make parent directory
+        mpp.progress.report('failed', id, title=title, error=str(e))
+        return failed
+
+    # The media is downloaded into the store (see mpp.store) and linked into
+    # the podcast's directory, so media which is already in the store, for
+    # another podcast or from another url with the same content, is not 
+    # downloaded or stored again. The download is written to a .part file,
+    # and if one is left from an earlier attempt, the download resumes from
+    # the end of it. Only one process downloads a url at a time.
+    part_path = obj + '.part'
     try:
-        if os.path.exists(path):
-            log.warning('download_podcast_episode: already exists: "%s", SKIPPING' % path)
-            return False
-        if not os.path.exists(os.path.dirname(path)):
-            recursively_make_dir(os.path.dirname(path))
+        with mpp.store.locked(obj):
+            content = mpp.store.content_for(audio_dir, episode.media_url)
+            stored = content is not None
+            size = 0
+            if content is None:
+                # a partial download from before media were stored
+                old_part_path = os.path.join(directory, basename) + '.part'
+                if os.path.exists(old_part_path) and not os.path.exists(part_path):
+                    os.rename(old_part_path, part_path)
+                so_far = 0
+                if os.path.exists(part_path):
+                    so_far = os.path.getsize(part_path)
+                size = fetch_to_part_file(episode.media_url, part_path, so_far, title, id)
+                with mpp.timing.span('download.store'):
+                    content = mpp.store.add(audio_dir, episode.media_url, part_path)
+            else:
+                log.debug('download_podcast_episode: %s is already stored' % episode.media_url)
+            path = mpp.store.link_into(audio_dir, episode.media_url, content, directory, basename, stored)
+        mpp.progress.report('done', id, title=title, bytes=size, path=path)
+        return (podcast.url_hash(), episode.media_url, path)
     except Exception as e:
         log.exception('download_podcast_episode: %s : %s' % (type(e), e))
-        return False
-        
-    try:
-        r = requests.head(episode.media_url, allow_redirects=True)
-        if 'Content-Length' in r.headers:
+        mpp.progress.report('failed', id, title=title, error=str(e))
+        return failed
+
+def fetch_to_part_file(url, part_path, so_far, title, id=None):
+    """ GET url into part_path, starting from byte so_far using a Range 
+        request if the part file already has some data. The size of the 
+        file is taken from the Content-Length or Content-Range of the 
+        response, and checked once the transfer is complete. The file is 
+        synced to disk before returning the number of bytes in it.
+        Progress is reported to the parent process (see mpp.progress), as
+        the transfer id (default url).
+    """
+    headers = dict()
+    if so_far > 0:
+        headers['Range'] = 'bytes=%d-' % so_far
+    with mpp.timing.span('download.request'):
+        r = mpp.session.get(url, stream=True, headers=headers)
+    if r.status_code == 416 and so_far > 0:
+        r.close()
+        if content_range_size(r.headers.get('Content-Range')) == so_far:
+            log.debug('fetch_to_part_file: %s is already complete' % part_path)
+            return so_far
+        log.warning('fetch_to_part_file: bad range for %s, restarting' % part_path)
+        return fetch_to_part_file(url, part_path, 0, title, id)
+    r.raise_for_status()
+    size = 0
+    if r.status_code == 206:
+        size = content_range_size(r.headers.get('Content-Range'))
+    else:
+        if so_far > 0:
+            log.warning('fetch_to_part_file: server ignored range request for %s, restarting' % url)
+            so_far = 0
+        if 'Content-Length' in r.headers and 'Content-Encoding' not in r.headers:
             size = int(r.headers['Content-Length'])
-        else:
-            size = 0
-        r = requests.get(episode.media_url, stream=True)
-        so_far = 0
-        next_notify_percent = 5 
-        with open(path, 'wb') as f:
-            print('Downloading %s / %s : %s bytes' % (podcast.title, episode.title, '[unknown]' if size is 0 else size))
+    mpp.progress.report('start', id or url, title=title, size=size, offset=so_far)
+    next_report = time.time() + mpp.progress.PROGRESS_INTERVAL
+    with open(part_path, 'ab' if so_far > 0 else 'wb') as f:
+        with mpp.timing.span('download.transfer'):
             for chunk in r.iter_content(chunk_size=1024*64): 
                 if chunk: # filter out keep-alive new chunks
                     f.write(chunk)
                     so_far += len(chunk)
-                    if size > 0:
-                        percent = so_far * 100 / size
-                        if percent >= next_notify_percent and args.verbose:
-                            print('%.1f%% %s / %s' % (percent, podcast.title, episode.title))
-                            next_notify_percent += 5
-            print('Complete %s / %s' % (podcast.title, episode.title))
-        episode.media_path = path
-        podcast.save()
-        return True
-    except Exception as e:
-        log.exception('download_podcast_episode: %s : %s' % (type(e), e))
-        return False
+                    mpp.scheduler.throttle(len(chunk))
+                    if time.time() >= next_report:
+                        mpp.progress.report('progress', id or url, bytes=so_far)
+                        next_report = time.time() + mpp.progress.PROGRESS_INTERVAL
+        with mpp.timing.span('download.fsync'):
+            f.flush()
+            os.fsync(f.fileno())
+    if size > 0 and so_far != size:
+        raise Exception('incomplete download of %s: %d of %d bytes' % (url, so_far, size))
+    return so_far
+
+def content_range_size(content_range):
+    """ Returns the complete size from a Content-Range header like 
+        "bytes 100-199/200", or 0 if it is not known
+    """
+    try:
+        return int(content_range.split('/')[1])
+    except:
+        return 0
 
 def recursively_make_dir(path):
     p = os.path.dirname(path)
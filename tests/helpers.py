@@ -0,0 +1,18 @@
+""" Fixtures shared by the tests """
+
+class FakeResponse():
+    """ Stands in for a requests Response from mpp.session.get """
+    def __init__(self, status_code, content=b'', headers=dict()):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers
+
+    def raise_for_status(self):
+        pass
+
+    def close(self):
+        pass
+
+    def iter_content(self, chunk_size=1):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i+chunk_size]
@@ -0,0 +1,70 @@
+import unittest
+import argparse
+import io
+import os
+import sys
+import tempfile
+import shutil
+import threading
+from mpp.podcast import Podcast
+from mpp.library import Library
+from mpp.manager import PodcastManager
+from mpp.daemon import Daemon, Output, call
+
+class TestDaemon(unittest.TestCase):
+    def setUp(self):
+        self.feed_dir = tempfile.mkdtemp()
+        self.manager = PodcastManager({'feed_dir': self.feed_dir})
+        for i in range(2):
+            p = Podcast.from_dict({
+                'title': 'Podcast %d' % i,
+                'url': 'http://localhost/%d.xml' % i,
+                'episodes': [   {   'media_url': 'http://localhost/%d/ep1.mp3' % i,
+                                    'published': 'Thu, 22 May 2008 07:00:00 GMT',
+                                    'title': 'Hooves' },
+                                {   'media_url': 'http://localhost/%d/ep2.mp3' % i,
+                                    'published': 'Fri, 6 Jun 2008 07:00:00 GMT',
+                                    'title': 'Teeth' },
+                            ]})
+            self.manager.library.add(p, self.manager.get_podcast_path(p))
+        self.path = os.path.join(self.feed_dir, '.mpp.sock')
+        self.daemon = Daemon(self.manager, self.path, None)
+        self.server = self.daemon.listen()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        # the output of commands in the daemon's threads goes to the client
+        self.stdout = sys.stdout
+        sys.stdout = Output(self.daemon, self.stdout, 'out')
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.feed_dir)
+
+    def call(self, cmd, **kwargs):
+        d = {'cmd': cmd, 'pfilter': None, 'efilter': None, 'verbose': False, 'status': None, 'since': None,
+             'first': None, 'last': None, 'leave': 0, 'path': False, 'url': True, 'full': False}
+        d.update(kwargs)
+        out = io.StringIO()
+        status = call(self.path, argparse.Namespace(**d), out, io.StringIO())
+        return status, out.getvalue().split()
+
+    def test_commands(self):
+        status, urls = self.call('list_episodes', pfilter='podcast 1')
+        self.assertEqual((status, urls), (0, ['http://localhost/1/ep1.mp3', 'http://localhost/1/ep2.mp3']))
+        self.assertEqual(self.call('catchup_podcast', pfilter='podcast 1', leave=1)[0], 0)
+        self.assertEqual(self.call('list_episodes', pfilter='podcast 1')[1], ['http://localhost/1/ep2.mp3'])
+        # errors in the command are reported in its exit status
+        self.assertEqual(self.call('list_episodes', efilter='status:bogus')[0], 1)
+        self.assertEqual(self.call('add_podcast')[0], 1)
+
+    def test_changes_by_other_processes(self):
+        self.assertEqual(len(self.call('list_episodes', efilter='hooves')[1]), 2)
+        library = Library(self.feed_dir)
+        entry = library.summaries('podcast 0')[0]
+        library.catch_up(entry)
+        library.remove(library.podcasts('podcast 1')[0])
+        self.assertEqual(self.call('list_episodes', efilter='hooves')[1], [])
+
+    def test_no_daemon(self):
+        self.assertIsNone(call(os.path.join(self.feed_dir, 'missing.sock'), argparse.Namespace(cmd='list_podcasts')))
@@ -0,0 +1,65 @@
+import unittest
+import os
+import tempfile
+import shutil
+from mpp.podcast import Podcast
+from mpp.episode import Episode
+from mpp.database import DatabaseLibrary
+
+class TestDatabase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = '%s/mpp.sqlite' % self.dir
+        library = DatabaseLibrary(self.path)
+        for i in range(3):
+            p = Podcast.from_dict({
+                'title': 'Podcast %d' % i,
+                'url': 'http://localhost/%d.xml' % i,
+                'episodes': [   {   'media_url': 'http://localhost/%d/ep1.mp3' % i,
+                                    'published': 'Thu, 22 May 2008 07:00:00 GMT',
+                                    'title': 'Hooves',
+                                    'skipped': True },
+                                {   'media_url': 'http://localhost/%d/ep2.mp3' % i,
+                                    'published': 'Fri, 6 Jun 2008 07:00:00 GMT',
+                                    'title': 'Teeth' },
+                            ]})
+            library.add(p)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_summaries(self):
+        library = DatabaseLibrary(self.path)
+        entry = library.summaries('podcast 1')[0]
+        self.assertEqual((entry.episodes, entry.new, entry.skipped), (2, 1, 1))
+        self.assertEqual(len(library.loaded), 0)
+
+    def test_select_episodes(self):
+        library = DatabaseLibrary(self.path)
+        entry = library.summaries('podcast 1')[0]
+        self.assertEqual([e.title for e in library.select_episodes(entry, ['new'])], ['Teeth'])
+        self.assertEqual([e.title for e in library.select_episodes(entry, ['any'], since='2008-06-01')], ['Teeth'])
+        self.assertEqual([e.title for e in library.select_episodes(entry, ['any'], efilter='HOO')], ['Hooves'])
+        self.assertEqual(library.select_episodes(entry, ['any'], efilter='%'), [])
+        self.assertEqual(len(library.loaded), 0)
+
+    def test_save_episodes(self):
+        library = DatabaseLibrary(self.path)
+        entry = library.summaries('podcast 2')[0]
+        episodes = library.select_episodes(entry, ['new'])
+        episodes[0].skipped = True
+        library.save_episodes(entry, episodes)
+        self.assertEqual(library.summaries('podcast 2')[0].skipped, 2)
+        p = DatabaseLibrary(self.path).podcasts('podcast 2')[0]
+        self.assertEqual([e.skipped for e in p.episodes], [True, True])
+
+    def test_update_and_remove(self):
+        library = DatabaseLibrary(self.path)
+        p = library.podcasts('podcast 0')[0]
+        p.add_new_episodes([Episode('Tail', 'http://localhost/0/ep3.mp3', 'Sat, 7 Jun 2008 07:00:00 GMT')])
+        p.title = 'Renamed'
+        library.save(p)
+        library.remove(library.podcasts('podcast 1')[0])
+        library = DatabaseLibrary(self.path)
+        self.assertEqual(sorted([x.title for x in library.summaries()]), ['Podcast 2', 'Renamed'])
+        self.assertEqual([e.title for e in library.podcasts('renamed')[0].episodes], ['Hooves', 'Teeth', 'Tail'])
@@ -0,0 +1,141 @@
+import unittest
+import errno
+import io
+import queue
+import os
+import threading
+import tempfile
+import shutil
+from unittest import mock
+import mpp.config
+from mpp.podcast import Podcast
+from mpp.episode import Episode
+from mpp.util import download_podcast_episode
+import mpp.store
+import mpp.progress
+from helpers import FakeResponse
+
+class Args():
+    verbose = False
+
+class TestDownload(unittest.TestCase):
+    def setUp(self):
+        self.audio_dir = tempfile.mkdtemp()
+        self.saved_config = mpp.config.config
+        mpp.config.config = {'audio_directory': self.audio_dir}
+        self.podcast = Podcast('http://localhost/lovelyhorse.xml', 'My Lovely Horse')
+        self.episode = Episode('Hooves', 'http://localhost/ep1.mp3', 'Thu, 22 May 2008 07:00:00 GMT')
+        self.data = bytes(range(256)) * 1000
+        self.path = '%s/%s/ep1.mp3' % (self.audio_dir, self.podcast.url_hash())
+
+    def tearDown(self):
+        mpp.config.config = self.saved_config
+        shutil.rmtree(self.audio_dir)
+
+    def download(self, get, podcast=None, episode=None):
+        with mock.patch('mpp.session.get', side_effect=get) as get_mock, \
+             mock.patch('builtins.print'):
+            result = download_podcast_episode(podcast or self.podcast, episode or self.episode, Args())
+        return result, get_mock
+
+    def test_resume(self):
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path + '.part', 'wb') as f:
+            f.write(self.data[:1000])
+        def get(url, stream=False, headers=dict()):
+            self.assertEqual(headers.get('Range'), 'bytes=1000-')
+            return FakeResponse(206, self.data[1000:], {'Content-Range': 'bytes 1000-%d/%d' % (len(self.data)-1, len(self.data))})
+        result, get_mock = self.download(get)
+        self.assertEqual(result, (self.podcast.url_hash(), self.episode.media_url, self.path))
+        self.assertEqual(get_mock.call_count, 1)
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertFalse(os.path.exists(self.path + '.part'))
+
+    def test_truncated(self):
+        get = lambda url, stream=False, headers=dict(): FakeResponse(200, self.data[:5000], {'Content-Length': str(len(self.data))})
+        result, get_mock = self.download(get)
+        self.assertIsNone(result[2])
+        self.assertFalse(os.path.exists(self.path))
+        part_path = mpp.store.url_path(self.audio_dir, self.episode.media_url) + '.part'
+        self.assertEqual(os.path.getsize(part_path), 5000)
+
+    def test_already_complete(self):
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path + '.part', 'wb') as f:
+            f.write(self.data)
+        get = lambda url, stream=False, headers=dict(): FakeResponse(416, headers={'Content-Range': 'bytes */%d' % len(self.data)})
+        result, get_mock = self.download(get)
+        self.assertEqual(result[2], self.path)
+        self.assertEqual(os.path.getsize(self.path), len(self.data))
+
+    def test_store(self):
+        get = lambda url, stream=False, headers=dict(): FakeResponse(200, self.data, {'Content-Length': str(len(self.data))})
+        result, get_mock = self.download(get)
+        self.assertEqual(result[2], self.path)
+        # the same url in another feed is linked, not downloaded again
+        other = Podcast('http://localhost/bestof.xml', 'Best Of')
+        result, get_mock = self.download(get, other, Episode('Hooves', 'HTTP://LOCALHOST:80/ep1.mp3', self.episode.published))
+        self.assertEqual(get_mock.call_count, 0)
+        self.assertTrue(os.path.samefile(result[2], self.path))
+        # a different url with the same basename and content is downloaded
+        # to another path, but stored once
+        result, get_mock = self.download(get, other, Episode('Teeth', 'http://localhost/2/ep1.mp3', self.episode.published))
+        self.assertEqual(get_mock.call_count, 1)
+        self.assertNotEqual(os.path.basename(result[2]), 'ep1.mp3')
+        self.assertTrue(os.path.samefile(result[2], self.path))
+        self.assertEqual(os.stat(self.path).st_nlink, 4)
+        for path, url in [(self.path, self.episode.media_url), (result[2], 'http://localhost/2/ep1.mp3')]:
+            os.unlink(path)
+            mpp.store.release(self.audio_dir, url)
+        self.assertEqual(os.stat(mpp.store.content_for(self.audio_dir, 'http://localhost/ep1.mp3')).st_nlink, 2)
+        os.unlink('%s/%s/ep1.mp3' % (self.audio_dir, other.url_hash()))
+        mpp.store.release(self.audio_dir, 'http://localhost/ep1.mp3')
+        self.assertIsNone(mpp.store.content_for(self.audio_dir, 'http://localhost/ep1.mp3'))
+        self.assertEqual([f for d, dirs, files in os.walk(os.path.join(self.audio_dir, '.store', 'sha256')) for f in files], [])
+
+    def test_same_basename(self):
+        # different urls with the same basename, downloaded at once
+        episodes = [Episode('Part %d' % i, 'http://localhost/%d/ep1.mp3' % i, self.episode.published) for i in range(4)]
+        get = lambda url, stream=False, headers=dict(): FakeResponse(200, url.encode('utf-8'), {'Content-Length': str(len(url))})
+        results = []
+        with mock.patch('mpp.session.get', side_effect=get), mock.patch('builtins.print'):
+            threads = [threading.Thread(target=lambda e=e: results.append(download_podcast_episode(self.podcast, e, Args()))) for e in episodes]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        self.assertEqual(len(set([r[2] for r in results])), 4)
+        for url_hash, url, path in results:
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), url.encode('utf-8'))
+
+    def test_link_errors(self):
+        content = os.path.join(self.audio_dir, 'content.mp3')
+        open(content, 'w').close()
+        path = os.path.join(self.audio_dir, 'podcast', 'ep1.mp3')
+        with mock.patch('os.link', side_effect=FileExistsError(errno.EEXIST, 'exists')):
+            self.assertRaises(FileExistsError, mpp.store.link, content, path)
+        self.assertFalse(os.path.exists(content + '.keep'))
+        with mock.patch('os.link', side_effect=OSError(errno.EXDEV, 'cross-device link')):
+            mpp.store.link(content, path)
+        self.assertTrue(os.path.islink(path))
+        self.assertTrue(os.path.exists(content + '.keep'))
+
+    def test_progress_for_shared_url(self):
+        # the same url in two podcasts is reported as two transfers
+        get = lambda url, stream=False, headers=dict(): FakeResponse(200, self.data, {'Content-Length': str(len(self.data))})
+        q = queue.Queue()
+        out = io.StringIO()
+        reporter = mpp.progress.ProgressReporter(q, 'text', out).start()
+        mpp.progress.set_queue(q)
+        try:
+            self.download(get)
+            self.download(get, Podcast('http://localhost/bestof.xml', 'Best Of'))
+        finally:
+            mpp.progress.set_queue(None)
+            reporter.stop()
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines.count('Complete My Lovely Horse / Hooves'), 1)
+        self.assertEqual(lines.count('Complete Best Of / Hooves'), 1)
+        self.assertTrue(lines[-1].startswith('Downloaded 2 episodes'))
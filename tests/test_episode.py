@@ -2,7 +2,12 @@ import unittest
 import os  
 import time
 import datetime
-from mpp.episode import Episode
+import tempfile
+import shutil
+from unittest import mock
+from mpp.episode import Episode, parse_timestamp
+from mpp.streamparser import episode_from_element
+from mpp.util import forget_media
 
 class TestWhataver(unittest.TestCase):
     def test_episode_from_dict(self):
@@ -39,3 +44,49 @@ class TestWhataver(unittest.TestCase):
         self.assertTrue(e1 != e4)
         self.assertTrue(e4 != e5)
 
+    def test_timestamps(self):
+        # 1 Jan 2024 15:00 UTC
+        ts = 1704121200
+        for datestring in ['Mon, 01 Jan 2024 10:00:00 EST', 'Mon, 01 Jan 2024 15:00:00 GMT',
+                           'Mon, 1 Jan 2024 16:00:00 +0100', '2024-01-01T15:00:00Z',
+                           '2024-01-01T10:00:00-05:00', '2024-01-01 10:00:00 EST', '2024-01-01 15:00:00']:
+            self.assertEqual(parse_timestamp(datestring), ts, datestring)
+        self.assertIsNone(parse_timestamp(None))
+        self.assertIsNone(parse_timestamp(''))
+        # feed files without stored timestamps agree with the feed parser
+        import xml.etree.ElementTree as ET
+        item = ET.fromstring('<item><title>Ep</title><pubDate>Mon, 01 Jan 2024 10:00:00 EST</pubDate></item>')
+        e = Episode.from_dict({'title': 'Ep', 'media_url': None, 'published': 'Mon, 01 Jan 2024 10:00:00 EST'})
+        self.assertEqual(e.published_ts, ts)
+        self.assertEqual(e.title_key(), episode_from_element(item).title_key())
+        self.assertEqual(Episode.from_dict(e.to_dict()).published_ts, ts)
+
+    def test_since(self):
+        e = Episode('Ep', 'http://foo.com/ep.mp3', 'Mon, 01 Jan 2024 10:00:00 EST')
+        self.assertTrue(e.since(None))
+        self.assertTrue(e.since('2024-01-01 15:00 UTC'))
+        self.assertFalse(e.since('2024-01-01 15:01 UTC'))
+        self.assertTrue(e.since('2024-01-01'))
+        self.assertFalse(e.since('2024-01-02'))
+        self.assertFalse(Episode('Ep', None, None).since('1970-01-02'))
+
+    def test_status_cache(self):
+        media_dir = tempfile.mkdtemp()
+        try:
+            episodes = [Episode('Ep %d' % i, 'http://foo.com/ep%d.mp3' % i, '2014-01-0%d' % (i+1), 
+                                '%s/ep%d.mp3' % (media_dir, i)) for i in range(3)]
+            open(episodes[0].media_path, 'w').close()
+            forget_media()
+            with mock.patch('os.listdir', side_effect=os.listdir) as listdir:
+                self.assertEqual([e.status() for e in episodes], ['downloaded', 'listened', 'listened'])
+                self.assertEqual([e.status() for e in episodes], ['downloaded', 'listened', 'listened'])
+                self.assertEqual(listdir.call_count, 1)
+            episodes[1].skipped = True
+            episodes[2].media_path = None
+            self.assertEqual([e.status() for e in episodes], ['downloaded', 'skipped', 'new'])
+            os.unlink(episodes[0].media_path)
+            self.assertEqual(episodes[0].status(), 'downloaded')
+            forget_media()
+            self.assertEqual(episodes[0].status(), 'listened')
+        finally:
+            shutil.rmtree(media_dir)
@@ -0,0 +1,182 @@
+import unittest
+import os
+import json
+import tempfile
+import shutil
+import sys
+import threading
+from unittest import mock
+from mpp.podcast import Podcast
+from mpp.library import Library
+from mpp.journal import journal_path
+
+class TestLibrary(unittest.TestCase):
+    def setUp(self):
+        self.feed_dir = tempfile.mkdtemp()
+        for i in range(3):
+            p = Podcast.from_dict({
+                'title': 'Podcast %d' % i,
+                'url': 'http://localhost/%d.xml' % i,
+                'episodes': [   {   'media_url': 'http://localhost/%d/ep1.mp3' % i,
+                                    'published': 'Thu, 22 May 2008 07:00:00 GMT',
+                                    'title': 'Hooves',
+                                    'skipped': True },
+                                {   'media_url': 'http://localhost/%d/ep2.mp3' % i,
+                                    'published': 'Fri, 6 Jun 2008 07:00:00 GMT',
+                                    'title': 'Teeth' },
+                            ]})
+            p.save_to_file('%s/%s.json' % (self.feed_dir, p.url_hash()))
+
+    def tearDown(self):
+        shutil.rmtree(self.feed_dir)
+
+    def test_index(self):
+        library = Library(self.feed_dir)
+        self.assertEqual(len(library.summaries()), 3)
+        library.write_index()
+        self.assertTrue(os.path.exists(library.index_path))
+        library = Library(self.feed_dir)
+        # answered from the index, without loading any feeds
+        entry = library.summaries('podcast 1')[0]
+        self.assertEqual(len(library.loaded), 0)
+        self.assertEqual((entry.episodes, entry.new, entry.skipped), (2, 1, 1))
+        podcasts = library.podcasts('podcast 1')
+        self.assertEqual(len(podcasts), 1)
+        self.assertEqual(len(library.loaded), 1)
+
+    def test_save_and_remove(self):
+        library = Library(self.feed_dir)
+        library.write_index()
+        p = library.podcasts('podcast 2')[0]
+        p.title = 'Renamed'
+        library.save(p)
+        library.remove(library.podcasts('podcast 0')[0])
+        library.write_index()
+        with open(library.index_path) as f:
+            titles = sorted([x['title'] for x in json.load(f)])
+        self.assertEqual(titles, ['Podcast 1', 'Renamed'])
+
+    def test_stale_index(self):
+        Library(self.feed_dir).write_index()
+        p = Podcast('http://localhost/1.xml')
+        p = Podcast.from_file('%s/%s.json' % (self.feed_dir, p.url_hash()))
+        p.title = 'Changed Elsewhere'
+        p.save()
+        library = Library(self.feed_dir)
+        self.assertEqual(len(library.summaries('changed elsewhere')), 1)
+
+    def test_parallel_load(self):
+        serial = Library(self.feed_dir)
+        with mock.patch('mpp.library.PARALLEL_LOAD', 2):
+            # no index, so every feed is read by the workers
+            library = Library(self.feed_dir, workers=2)
+            self.assertEqual(len(library.loaded), 0)
+            self.assertEqual([x.to_dict() for x in library.summaries()], [x.to_dict() for x in serial.summaries()])
+            podcasts = library.podcasts()
+        self.assertEqual([(x.path, x.to_dict()) for x in podcasts], [(x.path, x.to_dict()) for x in serial.podcasts()])
+        self.assertEqual([e.status() for e in podcasts[0].episodes], ['skipped', 'new'])
+
+    def test_journal(self):
+        library = Library(self.feed_dir)
+        entry = library.summaries('podcast 1')[0]
+        mtime = os.stat(entry.path).st_mtime_ns
+        episodes = library.select_episodes(entry, ['new'])
+        episodes[0].media_path = '/tmp/teeth.mp3'
+        library.save_episodes(entry, episodes)
+        self.assertEqual(library.catch_up(library.summaries('podcast 2')[0]), 1)
+        library.rename(library.podcasts('podcast 0')[0], 'Renamed')
+        library.write_index()
+        # the changes were appended to journals, without re-writing the feeds
+        self.assertEqual(os.stat(entry.path).st_mtime_ns, mtime)
+        self.assertTrue(os.path.exists(journal_path(entry.path)))
+        with open(journal_path(entry.path), 'ab') as f:
+            f.write(b'\n{"episode":')
+        library = Library(self.feed_dir)
+        library.rename(library.podcasts('podcast 1')[0], 'Podcast One')
+        library = Library(self.feed_dir)
+        self.assertEqual(len(library.summaries('podcast one')), 1)
+        self.assertEqual(library.summaries('podcast one')[0].media, ['/tmp/teeth.mp3'])
+        self.assertEqual(library.summaries('podcast 2')[0].new, 0)
+        self.assertEqual(library.podcasts('podcast one')[0].episodes[1].media_path, '/tmp/teeth.mp3')
+        self.assertEqual(library.podcasts('renamed')[0].url, 'http://localhost/0.xml')
+        with mock.patch('mpp.library.COMPACT_SIZE', 0):
+            library.write_index()
+        self.assertFalse(os.path.exists(journal_path(entry.path)))
+        self.assertEqual(Podcast.from_file(entry.path).episodes[1].media_path, '/tmp/teeth.mp3')
+
+    def test_journal_exact_episode(self):
+        p = Podcast.from_dict({
+            'title': 'Shared',
+            'url': 'http://localhost/shared.xml',
+            'episodes': [ { 'media_url': 'http://localhost/shared.mp3', 'published': 'Thu, 22 May 2008 07:00:00 GMT', 'title': 'Part 1' },
+                          { 'media_url': 'http://localhost/shared.mp3', 'published': 'Fri, 6 Jun 2008 07:00:00 GMT', 'title': 'Part 2' },
+                          { 'media_url': 'http://localhost/other.mp3', 'published': 'Fri, 6 Jun 2008 07:00:00 GMT', 'title': 'Part 2' },
+                        ]})
+        path = '%s/%s.json' % (self.feed_dir, p.url_hash())
+        p.save_to_file(path)
+        library = Library(self.feed_dir)
+        entry = library.summaries('shared')[0]
+        episodes = library.select_episodes(entry, ['new'])
+        episodes[1].media_path = '/tmp/part2.mp3'
+        library.save_episodes(entry, episodes[1:2])
+        # an old record without an index, and one for an episode which has gone
+        with open(journal_path(path), 'a') as f:
+            f.write('\n{"episode":{"media_url":"http://localhost/other.mp3","title":"Part 2","published":"Fri, 6 Jun 2008 07:00:00 GMT","skipped":true}}')
+            f.write('\n{"episode":{"media_url":"http://localhost/shared.mp3","title":"Part 3","published":"Fri, 6 Jun 2008 07:00:00 GMT","skipped":true},"index":0}')
+        library = Library(self.feed_dir)
+        episodes = library.podcasts('shared')[0].episodes
+        self.assertEqual([e.media_path for e in episodes], [None, '/tmp/part2.mp3', None])
+        self.assertEqual([bool(e.skipped) for e in episodes], [False, False, True])
+
+    def test_token_index(self):
+        library = Library(self.feed_dir)
+        p = library.podcasts('podcast 1')[0]
+        p.episodes[0].title = 'Fetlocks'
+        library.save(p)
+        library.write_index()
+        self.assertTrue(os.path.exists(library.tokens_path))
+        library = Library(self.feed_dir)
+        matched = [(x.title, e.title) for x in library.summaries() for e in library.select_episodes(x, efilter='fetlock or hoof')]
+        self.assertEqual(matched, [('Podcast 1', 'Fetlocks')])
+        # only the feed which could match was loaded
+        self.assertEqual([x.title for x in library.loaded.values()], ['Podcast 1'])
+        self.assertEqual(len([1 for x in library.summaries() for e in library.select_episodes(x, efilter='teeth')]), 3)
+
+    def test_concurrent_reads(self):
+        # a daemon reads the library in other threads while it is changed
+        library = Library(self.feed_dir)
+        errors = []
+        done = threading.Event()
+        def read():
+            i = 0
+            while not done.is_set():
+                try:
+                    for x in library.summaries():
+                        library.select_episodes(x, efilter='teeth%d or hooves' % (i % 7))
+                    library.has_podcast(Podcast('http://localhost/1.xml'))
+                except Exception as e:
+                    errors.append(e)
+                    return
+                i += 1
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        reader = threading.Thread(target=read)
+        reader.start()
+        try:
+            extra = Podcast('http://localhost/extra.xml', 'Extra')
+            extra_path = '%s/%s.json' % (self.feed_dir, extra.url_hash())
+            for i in range(30):
+                p = library.podcasts('podcast %d' % (i % 3))[0]
+                p.episodes[1].title = 'Teeth%d' % i
+                library.save(p)
+                if i % 2:
+                    extra.save_to_file(extra_path)
+                else:
+                    os.path.exists(extra_path) and os.unlink(extra_path)
+                library.revalidate()
+                library.write_index()
+        finally:
+            done.set()
+            reader.join()
+            sys.setswitchinterval(interval)
+        self.assertEqual(errors, [])
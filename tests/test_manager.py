@@ -0,0 +1,143 @@
+import unittest
+import argparse
+import os
+import tempfile
+import shutil
+import time
+from unittest import mock
+from mpp.podcast import Podcast
+from mpp.manager import PodcastManager
+import mpp.store
+
+def fake_download(podcast, episode, args):
+    if episode.media_url.endswith('ep9.mp3'):
+        return (podcast.url_hash(), episode.media_url, None)
+    path = '%s/%s' % (args.audio_dir, episode.url_basename())
+    open(path, 'w').close()
+    return (podcast.url_hash(), episode.media_url, path)
+
+class TestManager(unittest.TestCase):
+    storage = 'files'
+
+    def setUp(self):
+        self.feed_dir = tempfile.mkdtemp()
+        self.audio_dir = tempfile.mkdtemp()
+        self.manager = PodcastManager({'feed_dir': self.feed_dir, 'storage': self.storage})
+        p = Podcast.from_dict({
+            'title': 'My Lovely Horse',
+            'url': 'http://localhost/lovelyhorse.xml',
+            'episodes': [   {   'media_url': 'http://localhost/ep1.mp3',
+                                'published': 'Thu, 22 May 2008 07:00:00 GMT',
+                                'title': 'Hooves' },
+                            {   'media_url': 'http://localhost/ep2.mp3',
+                                'published': 'Fri, 6 Jun 2008 07:00:00 GMT',
+                                'title': 'Teeth' },
+                            {   'media_url': 'http://localhost/ep9.mp3',
+                                'published': 'Sat, 7 Jun 2008 07:00:00 GMT',
+                                'title': 'Mane' },
+                        ]})
+        self.manager.library.add(p, self.manager.get_podcast_path(p))
+
+    def tearDown(self):
+        shutil.rmtree(self.feed_dir)
+        shutil.rmtree(self.audio_dir)
+
+    def args(self, **kwargs):
+        d = {'pfilter': None, 'efilter': None, 'max': 10, 'parallel': 2, 'verbose': False, 'audio_dir': self.audio_dir,
+             'status': None, 'since': None, 'first': None, 'last': None, 'leave': 0,
+             'per_host': 2, 'order': 'newest', 'rate': None, 'progress': 'none'}
+        d.update(kwargs)
+        return argparse.Namespace(**d)
+
+    def reopen(self):
+        self.manager.library.write_index()
+        return PodcastManager({'feed_dir': self.feed_dir, 'storage': self.storage}).library
+
+    def test_download(self):
+        with mock.patch('mpp.util.download_podcast_episode', fake_download):
+            self.manager.download_podcasts(self.args(efilter='e', max=2))
+        library = self.reopen()
+        entry = library.summaries()[0]
+        self.assertEqual(entry.downloaded(), 2)
+        self.assertEqual([e.title for e in library.select_episodes(entry, ['downloaded'])], ['Hooves', 'Teeth'])
+        self.assertEqual([e.title for e in library.select_episodes(entry, ['new'])], ['Mane'])
+
+    def test_same_media_url(self):
+        p = Podcast.from_dict({
+            'title': 'Reruns',
+            'url': 'http://localhost/reruns.xml',
+            'episodes': [   {   'media_url': 'http://localhost/rerun.mp3',
+                                'published': 'Thu, 22 May 2008 07:00:00 GMT',
+                                'title': 'First Showing' },
+                            {   'media_url': 'http://localhost/rerun.mp3',
+                                'published': 'Thu, 22 May 2009 07:00:00 GMT',
+                                'title': 'Repeat' },
+                        ]})
+        self.manager.library.add(p, self.manager.get_podcast_path(p))
+        with mock.patch('mpp.util.download_podcast_episode', fake_download):
+            self.manager.download_podcasts(self.args(pfilter='reruns'))
+        entry = self.reopen().summaries('reruns')[0]
+        self.assertEqual((entry.new, entry.downloaded()), (0, 2))
+
+    def test_failed_download(self):
+        with mock.patch('mpp.util.download_podcast_episode', fake_download):
+            self.manager.download_podcasts(self.args(efilter='mane'))
+        entry = self.reopen().summaries()[0]
+        self.assertEqual((entry.new, entry.downloaded()), (3, 0))
+
+    def test_catchup_and_renew(self):
+        self.manager.catchup_podcast(self.args(leave=1))
+        entry = self.reopen().summaries()[0]
+        self.assertEqual((entry.new, entry.skipped), (1, 2))
+        self.manager = PodcastManager({'feed_dir': self.feed_dir, 'storage': self.storage})
+        self.manager.renew_episodes(self.args(efilter='hoo'))
+        library = self.reopen()
+        entry = library.summaries()[0]
+        self.assertEqual([e.title for e in library.select_episodes(entry, ['new'])], ['Hooves', 'Mane'])
+
+    def test_catchup_releases_store(self):
+        self.manager.config['audio_directory'] = self.audio_dir
+        library = self.manager.library
+        entry = library.summaries()[0]
+        episodes = library.select_episodes(entry, ['new'])[:2]
+        contents = []
+        for e in episodes:
+            part = os.path.join(self.audio_dir, 'download.part')
+            with open(part, 'w') as f:
+                f.write(e.title)
+            with mpp.store.locked(mpp.store.url_path(self.audio_dir, e.media_url)):
+                content = mpp.store.add(self.audio_dir, e.media_url, part)
+            e.media_path = mpp.store.link_into(self.audio_dir, e.media_url, content,
+                                               os.path.join(self.audio_dir, entry.url_hash), e.url_basename())
+            contents.append(content)
+        library.save_episodes(entry, episodes)
+        # the first has been listened to, and deleted
+        os.remove(episodes[0].media_path)
+        self.manager.catchup_podcast(self.args())
+        self.assertFalse(any(os.path.exists(x) for x in contents))
+        self.assertFalse(os.path.exists(episodes[1].media_path))
+
+    def test_remove(self):
+        p = Podcast('http://localhost/notanother.xml', 'Not Another Podcast')
+        self.manager.library.add(p, self.manager.get_podcast_path(p))
+        # a podcast filter of words is the title substring, not a query
+        self.manager.remove_podcast(self.args(pfilter='not horse'))
+        self.assertEqual(len(self.reopen().summaries()), 2)
+        self.manager.remove_podcast(self.args(pfilter='not another'))
+        self.assertEqual([x.title for x in self.reopen().summaries()], ['My Lovely Horse'])
+
+    def test_due(self):
+        # a podcast which hasn't been polled is due
+        self.assertEqual(len(self.manager.podcasts_to_update(self.args(due=True))), 1)
+        p = self.manager.library.podcasts()[0]
+        p.checked = time.time()
+        self.manager.feed_updated(self.args(), p, 0, False)
+        self.assertEqual(self.manager.podcasts_to_update(self.args(due=True)), [])
+        self.assertEqual(len(self.manager.podcasts_to_update(self.args())), 1)
+        library = self.reopen()
+        self.assertEqual(library.podcasts(None, time.time()), [])
+        self.assertEqual(len(library.podcasts(None, time.time() + 8 * 86400)), 1)
+        self.assertEqual(library.podcasts()[0].checked, p.checked)
+
+class TestManagerDatabase(TestManager):
+    storage = 'sqlite'
@@ -2,7 +2,9 @@ import unittest
 import os  
 import tempfile
 import copy
+from unittest import mock
 from mpp.podcast import Podcast
+from helpers import FakeResponse
 
 class TestWhataver(unittest.TestCase):
     def setUp(self):
@@ -66,3 +68,61 @@ class TestWhataver(unittest.TestCase):
         with self.assertRaises(Exception):
             podcast.update_from_podcast(other)
 
+
+    def test_update_is_fuzzy(self):
+        updated_feed_dict = copy.deepcopy(self.feed_dict)
+        # moved media, same title and date
+        updated_feed_dict['episodes'][0]['media_url'] = 'http://otherhost/ep1.mp3'
+        # same media, changed title
+        updated_feed_dict['episodes'][1]['title'] = 'Molars'
+        # same title, different date and media
+        updated_feed_dict['episodes'][2]['media_url'] = 'http://otherhost/ep3.mp3'
+        updated_feed_dict['episodes'][2]['published'] = 'Fri, 27 Jun 2008 07:00:00 GMT'
+        podcast = Podcast.from_dict(self.feed_dict)
+        other = Podcast.from_dict(updated_feed_dict)
+        self.assertEqual(podcast.update_from_podcast(other), 1)
+        self.assertEqual(len(podcast.episodes), 4)
+        self.assertEqual(podcast.find_episode(other.episodes[0]), podcast.episodes[0])
+        self.assertEqual(podcast.find_episode_by_url('http://otherhost/ep3.mp3'), podcast.episodes[3])
+
+    def test_index_follows_episodes(self):
+        podcast = Podcast.from_dict(self.feed_dict)
+        other = Podcast.from_dict(self.feed_dict)
+        for e in other.episodes:
+            e.media_url = e.media_url.replace('localhost', 'otherhost')
+            e.title = e.title + ' (moved)'
+        self.assertIsNotNone(podcast.find_episode_by_url('http://localhost/ep1.mp3'))
+        # replaced with a list of the same length
+        podcast.episodes = other.episodes
+        self.assertIsNone(podcast.find_episode_by_url('http://localhost/ep1.mp3'))
+        self.assertIs(podcast.find_episode_by_url(other.episodes[0].media_url), other.episodes[0])
+        # the last episode replaced in place
+        podcast.episodes = list(other.episodes)
+        podcast.find_episode(other.episodes[0])
+        old = podcast.episodes[-1]
+        podcast.episodes[-1:] = [Podcast.from_dict(self.feed_dict).episodes[-1]]
+        self.assertIsNone(podcast.find_episode_by_url(old.media_url))
+        self.assertIs(podcast.find_episode(podcast.episodes[-1]), podcast.episodes[-1])
+
+    def test_conditional_update(self):
+        feed_file = '%s/tests/feed.xml' % os.popen("git rev-parse --show-toplevel").read().strip()
+        with open(feed_file, 'rb') as f:
+            xml_data = f.read()
+        podcast = Podcast.from_dict(self.feed_dict)
+        r = FakeResponse(200, xml_data, {'ETag': '"abc"', 'Last-Modified': 'Fri, 12 Jun 2015 08:54:35 GMT'})
+        with mock.patch('mpp.podcast.fetch_feed', return_value=r) as fetch:
+            self.assertEqual(podcast.update(), 185)
+            fetch.assert_called_with(podcast.url, None, None)
+        self.assertEqual(podcast.etag, '"abc"')
+        self.assertIsNotNone(podcast.content_hash)
+        restored = Podcast.from_dict(podcast.to_dict())
+        self.assertEqual(restored.cache_validators(), podcast.cache_validators())
+        # unchanged body and 304 responses are not parsed
+        with mock.patch('mpp.fixedparser.feedparser.parse') as parse:
+            with mock.patch('mpp.podcast.fetch_feed', return_value=r) as fetch:
+                self.assertEqual(podcast.update(), 0)
+                fetch.assert_called_with(podcast.url, '"abc"', 'Fri, 12 Jun 2015 08:54:35 GMT')
+            with mock.patch('mpp.podcast.fetch_feed', return_value=FakeResponse(304)):
+                self.assertEqual(podcast.update(), 0)
+            self.assertFalse(parse.called)
+        self.assertEqual(len(podcast.episodes), 188)
@@ -0,0 +1,102 @@
+import unittest
+import calendar
+from mpp.episode import Episode
+from mpp.podcast import Podcast
+from mpp.polling import poll_interval, next_due, is_due, max_age, MIN_INTERVAL, MAX_INTERVAL
+from helpers import FakeResponse
+
+HOUR = 3600
+DAY = 24 * HOUR
+# Monday 1 June 2020, 00:00 GMT
+START = calendar.timegm((2020, 6, 1, 0, 0, 0))
+
+def podcast(interval, count=10, end=START):
+    """ A podcast with count episodes published every interval seconds, the
+        last at end
+    """
+    p = Podcast('http://localhost/feed.xml', 'Feed')
+    for i in range(count):
+        ts = end - (count - 1 - i) * interval
+        p.episodes.append(Episode('Episode %d' % i, 'http://localhost/%d.mp3' % i, str(ts), published_ts=ts))
+    return p
+
+class TestPolling(unittest.TestCase):
+    def test_interval(self):
+        self.assertEqual(poll_interval(podcast(DAY), START + HOUR), 3 * HOUR)
+        self.assertEqual(poll_interval(podcast(7 * DAY), START + HOUR), 21 * HOUR)
+        # hourly feeds are not polled more than once an hour
+        self.assertEqual(poll_interval(podcast(HOUR), START), MIN_INTERVAL)
+        # a daily feed which has been quiet for 4 days
+        self.assertEqual(poll_interval(podcast(DAY), START + 4 * DAY), 12 * HOUR)
+        # a feed which hasn't published for two years
+        self.assertEqual(poll_interval(podcast(DAY), START + 730 * DAY), MAX_INTERVAL)
+        self.assertEqual(poll_interval(Podcast('http://localhost/feed.xml'), START), MAX_INTERVAL)
+
+    def test_ttl_and_max_age(self):
+        p = podcast(DAY)
+        p.ttl = 360
+        self.assertEqual(poll_interval(p, START), 6 * HOUR)
+        p.max_age = 8 * HOUR
+        self.assertEqual(poll_interval(p, START), 8 * HOUR)
+        p.max_age = 365 * DAY
+        self.assertEqual(poll_interval(p, START), MAX_INTERVAL)
+        self.assertEqual(max_age({'Cache-Control': 'public, max-age=600'}), 600)
+        self.assertEqual(max_age({'Cache-Control': 'no-cache, max-age=600'}), None)
+        self.assertEqual(max_age({}), None)
+
+    def test_check_response(self):
+        class Response(FakeResponse):
+            def __init__(self, status_code):
+                super().__init__(status_code, headers={'Cache-Control': 'max-age=7200'})
+            def raise_for_status(self):
+                if self.status_code >= 400:
+                    raise Exception('HTTP %d' % self.status_code)
+        p = podcast(DAY)
+        self.assertRaises(Exception, p.check_response, Response(500))
+        self.assertEqual((p.checked, p.max_age), (None, None))
+        self.assertIsNone(p.check_response(Response(304)))
+        self.assertIsNotNone(p.checked)
+        self.assertEqual(p.max_age, 7200)
+
+    def test_next_due(self):
+        p = podcast(DAY)
+        self.assertIsNone(next_due(p))
+        self.assertTrue(is_due(None, START))
+        p.checked = START + HOUR
+        self.assertEqual(next_due(p), START + 4 * HOUR)
+        self.assertFalse(is_due(next_due(p), START + 2 * HOUR))
+        self.assertTrue(is_due(next_due(p), START + 4 * HOUR - 60))
+        # skipHours and skipDays move it to the next hour which isn't skipped
+        p.skip_hours = [4, 5, 6]
+        self.assertEqual(next_due(p), START + 7 * HOUR)
+        p.skip_days = ['Monday']
+        self.assertEqual(next_due(p), START + DAY)
+
+    def test_channel_hints(self):
+        data = b'''<rss version="2.0"><channel><title>Feed</title><ttl>90</ttl>
+                   <skipHours><hour>0</hour><hour>24</hour><hour>7</hour></skipHours>
+                   <skipDays><day>sunday</day><day>Saturday</day></skipDays>
+                   <item><title>One</title><pubDate>Mon, 01 Jun 2020 00:00:00 GMT</pubDate>
+                   <enclosure url="http://localhost/1.mp3" type="audio/mpeg"/></item></channel></rss>'''
+        p = Podcast('http://localhost/feed.xml')
+        self.assertEqual(p.update_from_data(data), 1)
+        self.assertEqual((p.ttl, p.skip_hours, p.skip_days), (90, [0, 7], ['Saturday', 'Sunday']))
+        restored = Podcast.from_dict(p.to_dict())
+        self.assertEqual(restored.schedule(), p.schedule())
+
+    def test_hints_after_items(self):
+        items = ''.join(['<item><title>Ep %d</title><pubDate>Mon, %02d Jun 2020 00:00:00 GMT</pubDate>'
+                         '<enclosure url="http://localhost/%d.mp3" type="audio/mpeg"/></item>' % (i, 10 - i, i) for i in range(8)])
+        data = ('<rss version="2.0"><channel><title>Feed</title>%s<ttl>90</ttl>'
+                '<skipDays><day>Sunday</day></skipDays></channel></rss>' % items).encode('utf-8')
+        p = Podcast('http://localhost/feed.xml')
+        self.assertEqual(p.update_from_data(data), 8)
+        self.assertEqual((p.ttl, p.skip_hours, p.skip_days), (90, [], ['Sunday']))
+        # parsing stops at the known items, before the hints
+        self.assertEqual(p.update_from_data(data), 0)
+        self.assertEqual((p.ttl, p.skip_hours, p.skip_days), (90, [], ['Sunday']))
+        # the hints are removed from a feed which is parsed in full
+        p = Podcast('http://localhost/feed.xml')
+        p.ttl, p.skip_days = 90, ['Sunday']
+        p.update_from_data(data.replace(b'<ttl>90</ttl>', b'').replace(b'<skipDays><day>Sunday</day></skipDays>', b''))
+        self.assertEqual((p.ttl, p.skip_days), (None, []))
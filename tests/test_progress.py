@@ -0,0 +1,42 @@
+import unittest
+import io
+import json
+import queue
+from mpp.progress import ProgressReporter, human_bytes
+
+class TestProgress(unittest.TestCase):
+    def events(self, q):
+        q.put({'event': 'start', 'id': 'a', 'title': 'A', 'size': 2048, 'offset': 1024, 'time': 10.0})
+        q.put({'event': 'progress', 'id': 'a', 'bytes': 1536, 'time': 10.5})
+        q.put({'event': 'done', 'id': 'a', 'title': 'A', 'bytes': 2048, 'time': 11.0})
+        q.put({'event': 'failed', 'id': 'b', 'title': 'B', 'error': 'oops', 'time': 11.0})
+
+    def test_text(self):
+        q = queue.Queue()
+        out = io.StringIO()
+        reporter = ProgressReporter(q, 'text', out).start()
+        self.events(q)
+        reporter.stop()
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[0], 'Resuming A : from 1024 of 2048 bytes')
+        self.assertEqual(lines[1], 'Complete A')
+        self.assertEqual(lines[2], 'Failed B : oops')
+        self.assertTrue(lines[3].startswith('Downloaded 1 episode, 1.0 kB in'))
+        self.assertTrue(lines[3].endswith(', 1 failed'))
+
+    def test_json(self):
+        q = queue.Queue()
+        out = io.StringIO()
+        reporter = ProgressReporter(q, 'json', out).start()
+        self.events(q)
+        reporter.message('hello')
+        reporter.stop()
+        events = [json.loads(x) for x in out.getvalue().splitlines()]
+        self.assertEqual([x['event'] for x in events if x['event'] != 'message'], ['start', 'progress', 'done', 'failed', 'summary'])
+        summary = events[-1]
+        self.assertEqual((summary['downloaded'], summary['failed'], summary['bytes']), (1, 1, 1024))
+
+    def test_human_bytes(self):
+        self.assertEqual(human_bytes(10), '10 B')
+        self.assertEqual(human_bytes(1536), '1.5 kB')
+        self.assertEqual(human_bytes(3*1024**3), '3.0 GB')
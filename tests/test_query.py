@@ -0,0 +1,67 @@
+import unittest
+from mpp.episode import Episode
+from mpp.podcast import Podcast
+from mpp.query import Query, QueryError, EPISODE_FIELDS, episode_query, podcast_query
+
+def episodes():
+    return [Episode('Hooves and Teeth', 'http://localhost/1.mp3', 'Thu, 22 May 2008 07:00:00 GMT', skipped=True),
+            Episode('The Lovely Horse', 'http://localhost/2.mp3', 'Fri, 6 Jun 2008 07:00:00 GMT'),
+            Episode('Part 3: Horse Teeth', 'http://example.com/3.ogg', 'Sat, 5 Jul 2008 07:00:00 GMT')]
+
+class TestQuery(unittest.TestCase):
+    def titles(self, text, **kwargs):
+        q = episode_query(text, **kwargs)
+        return [e.title for e in episodes() if q.match(e, Podcast('http://localhost/feed.xml', 'My Lovely Horse'))]
+
+    def test_words(self):
+        self.assertEqual(len(self.titles(None)), 3)
+        self.assertEqual(len(self.titles('*')), 3)
+        self.assertEqual(self.titles('teeth'), ['Hooves and Teeth', 'Part 3: Horse Teeth'])
+        self.assertEqual(self.titles('horse TEETH'), ['Part 3: Horse Teeth'])
+        self.assertEqual(self.titles('"horse teeth"'), ['Part 3: Horse Teeth'])
+        self.assertEqual(self.titles('hooves or lovely'), ['Hooves and Teeth', 'The Lovely Horse'])
+        self.assertEqual(self.titles('teeth -hooves'), ['Part 3: Horse Teeth'])
+        self.assertEqual(self.titles('not (hooves or lovely)'), ['Part 3: Horse Teeth'])
+        # an unknown field is part of the title
+        self.assertEqual(self.titles('part 3:'), ['Part 3: Horse Teeth'])
+
+    def test_fields(self):
+        self.assertEqual(self.titles('title:/^the/'), ['The Lovely Horse'])
+        self.assertEqual(self.titles('title:*teeth'), ['Hooves and Teeth', 'Part 3: Horse Teeth'])
+        self.assertEqual(self.titles('url:*.ogg'), ['Part 3: Horse Teeth'])
+        self.assertEqual(self.titles('podcast:lovely status:skipped'), ['Hooves and Teeth'])
+        self.assertEqual(self.titles('since:2008-06-01 before:2008-07-01'), ['The Lovely Horse'])
+        self.assertEqual(self.titles('date:2008-06-01..2008-07-01'), ['The Lovely Horse'])
+        self.assertEqual(self.titles('teeth', stati=('new',), since='2008-06-01'), ['Part 3: Horse Teeth'])
+        self.assertTrue(podcast_query('url:localhost lovely').match(Podcast('http://localhost/feed.xml', 'My Lovely Horse')))
+        for bad in ['status:ready', '(teeth', 'teeth or', 'title:/(/', 'since:yesterday', 'date:2008-01-01..soon']:
+            with self.assertRaises(QueryError):
+                Query(bad, EPISODE_FIELDS)
+        with self.assertRaises(QueryError):
+            episode_query('teeth', since='last tuesday')
+
+    def test_podcast_titles(self):
+        for title in ['Not Another Podcast', 'This or That', 'Q&A (part 1', 'Left - Right | Centre', 'Murder and Mystery']:
+            self.assertTrue(podcast_query(title).match(Podcast('http://localhost/feed.xml', title)))
+            self.assertTrue(podcast_query(title.lower()).match(Podcast('http://localhost/feed.xml', title)))
+        horse = Podcast('http://localhost/feed.xml', 'My Lovely Horse')
+        self.assertFalse(podcast_query('not zzz').match(horse))
+        self.assertFalse(podcast_query('horse -lovely').match(horse))
+        self.assertTrue(podcast_query('horse lovely').match(Podcast('http://localhost/feed.xml', 'Horse Lovely')))
+        # with a field or a phrase, it is a query
+        self.assertTrue(podcast_query('"horse" -title:zzz').match(horse))
+        self.assertFalse(podcast_query('"horse" -title:lovely').match(horse))
+        self.assertEqual(podcast_query('not another').words, ['not another'])
+
+    def test_index(self):
+        index = {'hooves': {1}, 'teeth': {1, 3}, 'horse': {2, 3}, 'lovely': {2}}
+        lookup = lambda word: set().union(*[v for k, v in index.items() if word in k])
+        candidates = lambda text: Query(text, EPISODE_FIELDS).candidates(lookup)
+        self.assertEqual(candidates('teeth horse'), {3})
+        self.assertEqual(candidates('hoov or lovely'), {1, 2})
+        self.assertEqual(candidates('teeth -hooves'), {1, 3})
+        self.assertIsNone(candidates('title:/teeth/'))
+        self.assertIsNone(candidates('teeth or status:new'))
+        q = Query('teeth horse "a b" or lovely', EPISODE_FIELDS)
+        self.assertEqual(q.words, [])
+        self.assertEqual(Query('teeth "a b" -c status:new', EPISODE_FIELDS).words, ['teeth', 'a b'])
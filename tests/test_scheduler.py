@@ -0,0 +1,57 @@
+import unittest
+import argparse
+import time
+from multiprocessing.pool import ThreadPool
+from mpp.podcast import Podcast
+from mpp.episode import Episode
+from mpp.scheduler import DownloadScheduler, Throttle, order_tasks, parse_rate
+
+def make_tasks():
+    tasks = []
+    for p in ['a', 'b']:
+        podcast = Podcast('http://%s.localhost/feed.xml' % p, p)
+        for i in range(3):
+            e = Episode('%s%d' % (p, i), 'http://%s.localhost/%d.mp3' % (p, i), None, published_ts=i*10 + (p == 'b'))
+            tasks.append((podcast, e, None))
+    return tasks
+
+class TestScheduler(unittest.TestCase):
+    def test_order(self):
+        titles = lambda tasks: [t[1].title for t in tasks]
+        self.assertEqual(titles(order_tasks(make_tasks(), 'newest')), ['b2', 'a2', 'b1', 'a1', 'b0', 'a0'])
+        tasks = make_tasks()[:3] + make_tasks()[3:4]
+        self.assertEqual(titles(order_tasks(tasks, 'round-robin')), ['a2', 'b0', 'a1', 'a0'])
+
+    def test_per_host(self):
+        running = dict()
+        most = dict()
+        def work(task):
+            host = task[0].title
+            running[host] = running.get(host, 0) + 1
+            most[host] = max(most.get(host, 0), running[host])
+            time.sleep(0.01)
+            running[host] -= 1
+            return (task[0].url_hash(), task[1].media_url, task[1].title)
+        scheduler = DownloadScheduler(per_host=1)
+        scheduler.add(make_tasks()[:3])
+        # tasks added while running, and close from another thread
+        scheduler.call_soon(scheduler.add, make_tasks()[3:])
+        scheduler.call_soon(scheduler.close)
+        with ThreadPool(4) as pool:
+            results = list(scheduler.run(pool, work, 4))
+        self.assertEqual(sorted([x[2] for x in results]), ['a0', 'a1', 'a2', 'b0', 'b1', 'b2'])
+        self.assertEqual(most, {'a': 1, 'b': 1})
+
+    def test_throttle(self):
+        throttle = Throttle(100000)
+        start = time.monotonic()
+        for i in range(3):
+            throttle.consume(50000)
+        self.assertGreater(time.monotonic() - start, 0.4)
+
+    def test_parse_rate(self):
+        self.assertEqual(parse_rate('500k'), 512000)
+        self.assertEqual(parse_rate('2M'), 2*1024*1024)
+        self.assertEqual(parse_rate('1000'), 1000)
+        for rate in ['abc', '0', '-1k', 'nan', '']:
+            self.assertRaises(argparse.ArgumentTypeError, parse_rate, rate)
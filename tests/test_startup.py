@@ -0,0 +1,46 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+LIB = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'lib')
+MPP = os.path.join(os.path.dirname(LIB), 'mpp')
+
+# Run the mpp script in a fresh interpreter and print the modules it imported
+RUN = '''
+import json, runpy, sys
+sys.argv = [%r, '-c', %r] + %r
+try:
+    runpy.run_path(%r, run_name='__main__')
+except SystemExit as e:
+    if e.code:
+        raise
+sys.stderr.write(json.dumps(sorted(sys.modules)))
+'''
+
+HEAVY = ['requests', 'feedparser', 'multiprocessing', 'asyncio', 'sqlite3', 'dateutil']
+
+class TestStartup(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.config = os.path.join(self.dir.name, 'config')
+        with open(self.config, 'w') as f:
+            f.write('feed_dir=%s\naudio_directory=%s\n' % (self.dir.name, self.dir.name))
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def imported(self, args):
+        env = dict(os.environ, PYTHONPATH=LIB)
+        p = subprocess.run([sys.executable, '-c', RUN % (MPP, self.config, args, MPP)],
+                           env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+        return set([m.split('.')[0] for m in json.loads(p.stderr.decode().splitlines()[-1])])
+
+    def test_read_only_commands(self):
+        for args in [['ls', '--path'], ['ep', '--path']]:
+            modules = self.imported(args)
+            self.assertEqual([m for m in HEAVY if m in modules], [], args)
+        # ls prints a table, but ep --path only prints paths
+        self.assertNotIn('prettytable', self.imported(['ep', '--path']))
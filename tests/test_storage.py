@@ -0,0 +1,52 @@
+import unittest
+import os
+import tempfile
+import shutil
+from unittest import mock
+from mpp.podcast import Podcast
+from mpp.storage import atomic_write, storage_for_path, STORAGE, UMASK
+
+class TestStorage(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.podcast = Podcast.from_dict({
+            'title': 'My Lovely Horse',
+            'url': 'http://localhost/lovelyhorse.xml',
+            'episodes': [   {   'media_url': 'http://localhost/ep1.mp3',
+                                'published': 'Thu, 22 May 2008 07:00:00 GMT',
+                                'title': 'Hooves' },
+                            {   'media_url': 'http://localhost/ep2.mp3',
+                                'published': 'Fri, 6 Jun 2008 07:00:00 GMT',
+                                'media_path': '/tmp/ep2.mp3',
+                                'title': 'Teeth' },
+                        ]})
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_formats(self):
+        for storage in STORAGE.values():
+            path = '%s/feed%s' % (self.tmp_dir, storage.extension)
+            self.assertIs(storage_for_path(path), storage)
+            self.podcast.save_to_file(path)
+            restored = Podcast.from_file(path)
+            self.assertEqual(restored.to_dict(), self.podcast.to_dict())
+
+    def test_atomic_write(self):
+        path = '%s/feed.json' % self.tmp_dir
+        atomic_write(path, b'old')
+        with mock.patch('os.fsync', side_effect=OSError('disk full')):
+            with self.assertRaises(OSError):
+                atomic_write(path, b'new')
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), b'old')
+        self.assertEqual(os.listdir(self.tmp_dir), ['feed.json'])
+
+    def test_mode(self):
+        path = '%s/feed.json' % self.tmp_dir
+        with mock.patch('os.umask', side_effect=AssertionError('umask changed')):
+            atomic_write(path, b'old')
+            self.assertEqual(os.stat(path).st_mode & 0o777, 0o666 & ~UMASK)
+            os.chmod(path, 0o640)
+            atomic_write(path, b'new')
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o640)
@@ -0,0 +1,48 @@
+import unittest
+import os
+from mpp.podcast import Podcast
+from mpp.streamparser import parse_new_episodes, NotStreamable
+
+class TestStreamParser(unittest.TestCase):
+    def setUp(self):
+        feed_file = '%s/tests/feed.xml' % os.popen("git rev-parse --show-toplevel").read().strip()
+        with open(feed_file, 'rb') as f:
+            self.xml_data = f.read()
+        self.full = Podcast.from_file_feed(feed_file)
+
+    def fields(self, episodes):
+        return sorted([(e.title, e.media_url, e.published, e.published_ts) for e in episodes])
+
+    def test_same_as_feedparser(self):
+        new = parse_new_episodes(self.xml_data, Podcast(self.full.url))
+        self.assertEqual(self.fields(new), self.fields(self.full.episodes))
+
+    def test_stops_at_known_episodes(self):
+        # the newest episode is new, and the feed is cut short after the 
+        # items which need to be read
+        podcast = Podcast(self.full.url)
+        for e in self.full.episodes[:-1]:
+            podcast.add_episode(e)
+        end = 0
+        for i in range(7):
+            end = self.xml_data.index(b'</item>', end) + 1
+        new = parse_new_episodes(self.xml_data[:end], podcast)
+        self.assertEqual(self.fields(new), self.fields(self.full.episodes[-1:]))
+
+    def test_oldest_first(self):
+        # feeds in date order must be read to the end
+        podcast = Podcast(self.full.url)
+        for e in self.full.episodes[1:]:
+            podcast.add_episode(e)
+        start = self.xml_data.index(b'<item>')
+        end = self.xml_data.rindex(b'</item>') + len(b'</item>')
+        items = self.xml_data[start:end].split(b'</item>')[:-1]
+        data = self.xml_data[:start] + b''.join(reversed([x + b'</item>' for x in items])) + self.xml_data[end:]
+        new = parse_new_episodes(data, podcast)
+        self.assertEqual(self.fields(new), self.fields(self.full.episodes[:1]))
+
+    def test_not_streamable(self):
+        with self.assertRaises(NotStreamable):
+            parse_new_episodes(b'<html><body>not a feed</body></html>', Podcast(self.full.url))
+        with self.assertRaises(NotStreamable):
+            parse_new_episodes(b'<rss><channel><item><title>&nbsp;</title></item></channel></rss>', Podcast(self.full.url))
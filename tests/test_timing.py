@@ -0,0 +1,42 @@
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+import mpp.timing
+from mpp.timing import span, timed, collected, merge, percentile, report
+
+@timed('square')
+def square(x):
+    return x * x
+
+def squares(n):
+    return [square(x) for x in range(n)]
+
+class TestTiming(unittest.TestCase):
+    def setUp(self):
+        mpp.timing.reset()
+        mpp.timing.enable()
+
+    def tearDown(self):
+        mpp.timing.enabled = False
+        mpp.timing.reset()
+
+    def test_spans(self):
+        with span('outer'):
+            self.assertEqual(square(3), 9)
+        self.assertEqual(sorted(mpp.timing.take().keys()), ['outer', 'square'])
+        mpp.timing.enabled = False
+        square(3)
+        self.assertEqual(mpp.timing.take(), {})
+
+    def test_workers(self):
+        square(1)
+        with ProcessPoolExecutor(2) as pool:
+            for result, samples in pool.map(collected, [squares]*3, [5]*3):
+                merge(samples)
+        # the parent's sample is not counted again by the workers
+        self.assertEqual(len(mpp.timing._samples['square']), 16)
+        self.assertIn('square', report())
+
+    def test_percentile(self):
+        values = list(range(101))
+        self.assertEqual(percentile(values, 0.5), 50)
+        self.assertEqual(percentile(values, 0.95), 95)
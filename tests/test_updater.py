@@ -0,0 +1,31 @@
+import unittest
+import os
+from unittest import mock
+from mpp.podcast import Podcast
+from mpp.updater import FeedUpdater
+from helpers import FakeResponse
+
+class TestFeedUpdater(unittest.TestCase):
+    def setUp(self):
+        feed_file = '%s/tests/feed.xml' % os.popen("git rev-parse --show-toplevel").read().strip()
+        with open(feed_file, 'rb') as f:
+            self.xml_data = f.read()
+
+    def fake_fetch(self, url, etag, modified):
+        if 'unchanged' in url:
+            return FakeResponse(304)
+        return FakeResponse(200, self.xml_data)
+
+    def test_update(self):
+        podcasts = [Podcast('http://localhost/%d/feed.xml' % i, 'Feed %d' % i) for i in range(5)]
+        podcasts.append(Podcast('http://localhost/unchanged/feed.xml', 'Unchanged'))
+        results = dict()
+        def callback(podcast, new, changed):
+            results[podcast.title] = (new, changed)
+        with mock.patch('mpp.updater.fetch_feed', side_effect=self.fake_fetch):
+            FeedUpdater(connections=4, per_host=2, parsers=2).run(podcasts, callback)
+        self.assertEqual(len(results), 6)
+        self.assertEqual(results['Feed 3'], (185, True))
+        self.assertEqual(results['Unchanged'], (0, False))
+        self.assertEqual(len(podcasts[0].episodes), 185)
+        self.assertIsNotNone(podcasts[0].content_hash)